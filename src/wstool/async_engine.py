@@ -0,0 +1,417 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Engine running workers of DistributedWork in a single asyncio event
+loop, as the 'asyncio' backend.
+
+Workers declaring replay_commands = True have their do_work() run in
+the thread of the loop, with the commands vcstools runs through
+run_shell_command started as subprocesses of the loop instead. As
+do_work() cannot wait for them, it is aborted at the first command
+whose output is not known yet, and run again from the start once that
+command finished, until it completes. So vcstools decides which
+commands to run for any SCM and version of it, and each command runs
+once. Such workers must have no side effects other than those
+commands, like status, diff and info. Other workers, and those
+needing options of run_shell_command not emulated, e.g. a timeout,
+run in the default executor of the loop.
+
+Subprocesses of all workers are multiplexed by the event loop running
+in a background thread, so waiting on them costs no thread or process
+per worker.
+
+This module requires python 3.8 or newer, which by default watches
+subprocesses started from a loop outside the main thread. It uses
+callbacks rather than coroutine syntax, so that python 2 can still
+byte-compile the package.
+"""
+
+import asyncio
+import copy
+import functools
+import logging
+import os
+import subprocess
+import threading
+import time
+
+import vcstools.bzr
+import vcstools.git
+import vcstools.hg
+import vcstools.svn
+from vcstools.common import run_shell_command
+from vcstools.vcs_base import VcsError
+
+from wstool.tracing import CallLedger
+
+# vcstools modules running commands through run_shell_command
+_VCSTOOLS_MODULES = [vcstools.bzr, vcstools.git, vcstools.hg, vcstools.svn]
+
+# outputs of the worker replayed in the current thread, if any
+_replay = threading.local()
+
+
+class _NeedCommand(BaseException):
+    """
+    Raised by run_shell_command while replaying a worker, for a
+    command whose output is not known yet. Not an Exception, so that
+    error handling of vcstools and wstool lets it pass.
+    """
+
+    def __init__(self, key, no_warn):
+        BaseException.__init__(self, key)
+        self.key = key
+        self.no_warn = no_warn
+
+
+class _CannotReplay(BaseException):
+    """
+    Raised by run_shell_command while replaying a worker, for options
+    the engine does not emulate
+    """
+
+
+def _replaying_run_shell_command(cmd, cwd=None, shell=False, us_env=True,
+                                 show_stdout=False, verbose=False, timeout=None,
+                                 no_warn=False, no_filter=False):
+    """
+    vcstools.common.run_shell_command, returning the outputs recorded
+    for the worker replayed in the current thread, if any
+    """
+    outputs = getattr(_replay, 'outputs', None)
+    if outputs is None:
+        return run_shell_command(cmd, cwd=cwd, shell=shell, us_env=us_env,
+                                 show_stdout=show_stdout, verbose=verbose,
+                                 timeout=timeout, no_warn=no_warn,
+                                 no_filter=no_filter)
+    if show_stdout or verbose or no_filter or timeout is not None:
+        raise _CannotReplay()
+    if isinstance(cmd, list):
+        cmd = tuple(cmd)
+    key = (cmd, cwd, shell, us_env)
+    # the same command may run repeatedly, e.g. before and after a
+    # fetch, vcstools caching results skips some of them on replay
+    index = _replay.counts.get(key, 0)
+    _replay.counts[key] = index + 1
+    if index >= len(outputs.get(key, [])):
+        raise _NeedCommand(key, no_warn)
+    output = outputs[key][index]
+    if isinstance(output, Exception):
+        raise output
+    return output
+
+
+def _install_replay():
+    for module in _VCSTOOLS_MODULES:
+        # leave alone those patched by others
+        if module.run_shell_command is run_shell_command:
+            module.run_shell_command = _replaying_run_shell_command
+
+
+def _get_shell_result(need, returncode, stdout, stderr):
+    """
+    :returns: what vcstools run_shell_command returns for that output
+    :raises UnicodeDecodeError: like run_shell_command
+    """
+    cmd, cwd, _, _ = need.key
+    if isinstance(cmd, tuple):
+        cmd = list(cmd)
+    stdout = stdout.decode('utf-8')
+    stderr = stderr.decode('utf-8')
+    message = None
+    if returncode != 0 and stderr != '':
+        message = "Command failed: '%s'" % (cmd, )
+        if cwd is not None:
+            message += "\n run at: '%s'" % (cwd)
+        message += "\n errcode: %s:\n%s" % (returncode, stderr)
+        if not need.no_warn:
+            logging.getLogger('vcstools').warning(message)
+    return (returncode, stdout.rstrip(), message)
+
+
+def _raise(exception):
+    raise exception
+
+
+class AsyncEngine(object):
+    """
+    Runs an asyncio event loop in a daemon thread, shared by all
+    DistributedWork instances.
+    """
+
+    _engine = None
+    _lock = threading.Lock()
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self._run_loop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    @staticmethod
+    def get_engine():
+        with AsyncEngine._lock:
+            if AsyncEngine._engine is None:
+                _install_replay()
+                AsyncEngine._engine = AsyncEngine()
+            return AsyncEngine._engine
+
+
+class _CommandProtocol(asyncio.SubprocessProtocol):
+    """
+    collects the output of a subprocess, resolving future with
+    (returncode, stdout, stderr) once it exited and closed its pipes
+    """
+
+    def __init__(self, future):
+        self.future = future
+        self.transport = None
+        self.output = {1: [], 2: []}
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def pipe_data_received(self, fd, data):
+        self.output[fd].append(data)
+
+    def connection_lost(self, exc):
+        returncode = self.transport.get_returncode()
+        self.transport.close()
+        if not self.future.done():
+            self.future.set_result((returncode,
+                                    b''.join(self.output[1]),
+                                    b''.join(self.output[2])))
+
+
+class AsyncWorker(object):
+    """
+    Runs a worker in the event loop of the AsyncEngine, with the
+    interface of WorkerThread. All methods but start, run, is_alive
+    and terminate run in the thread of the loop.
+    """
+
+    def __init__(self, worker, outlist, index, done_queue=None):
+        """
+        :param done_queue: optional queue.Queue, receives index when done
+        """
+        self.worker = worker
+        self.outlist = outlist
+        self.index = index
+        self.done_queue = done_queue
+        self.loop = None
+        # set once started, like for threads
+        self.ident = None
+        # seconds waited to be started, set by DistributedWork
+        self.queue_wait = None
+        # thread of the executor running do_work(), if any
+        self.executor_ident = None
+        self._start_time = None
+        # key -> list of outputs of commands run for the replayed worker
+        self._outputs = {}
+        # of the command running, if any
+        self._protocol = None
+        self._cancelled = False
+        self._finished = threading.Event()
+
+    def start(self):
+        self.loop = AsyncEngine.get_engine().loop
+        self.ident = id(self)
+        self.loop.call_soon_threadsafe(self._guarded, self._start)
+
+    def run(self):
+        self.start()
+        try:
+            # waiting with a timeout, to remain interruptible
+            while not self._finished.wait(1):
+                pass
+        except KeyboardInterrupt:
+            self.terminate()
+            raise
+
+    def is_alive(self):
+        return self.loop is not None and not self._finished.is_set()
+
+    def terminate(self):
+        from wstool.common import _cancel_worker
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self._cancel)
+        executor_ident = self.executor_ident
+        if executor_ident is not None:
+            _cancel_worker(executor_ident)
+
+    def _guarded(self, function, *args):
+        # an exception escaping a callback would leave the worker
+        # unfinished forever
+        try:
+            function(*args)
+        except Exception as exc:
+            from wstool.common import run_worker
+            self._finish(run_worker(self.worker, functools.partial(_raise, exc)))
+
+    def _start(self):
+        self._start_time = time.time()
+        if getattr(self.worker, 'replay_commands', False):
+            self._replay()
+        else:
+            self._run_in_executor()
+
+    def _replay(self):
+        from wstool.common import run_worker
+        if self._cancelled:
+            return
+        _replay.outputs = self._outputs
+        _replay.counts = {}
+        try:
+            result = run_worker(self.worker)
+        except _NeedCommand as need:
+            self._run_command(need)
+            return
+        except _CannotReplay:
+            self._run_in_executor()
+            return
+        finally:
+            _replay.outputs = None
+        self._finish(result)
+
+    def _run_command(self, need):
+        cmd, cwd, shell, us_env = need.key
+        env = copy.copy(os.environ)
+        if us_env:
+            env["LANG"] = "en_US.UTF-8"
+        future = self.loop.create_future()
+        protocol = _CommandProtocol(future)
+        kwargs = {'stdin': None,
+                  'stdout': subprocess.PIPE,
+                  'stderr': subprocess.PIPE,
+                  'cwd': cwd,
+                  'env': env}
+        if shell:
+            started = self.loop.subprocess_shell(lambda: protocol, cmd, **kwargs)
+        else:
+            argv = list(cmd) if isinstance(cmd, tuple) else [cmd]
+            started = self.loop.subprocess_exec(lambda: protocol, *argv, **kwargs)
+        self._protocol = protocol
+        task = self.loop.create_task(started)
+        task.add_done_callback(functools.partial(
+            self._guarded, self._on_started, need, future))
+        future.add_done_callback(functools.partial(
+            self._guarded, self._on_command_done, need, time.time()))
+
+    def _on_started(self, need, future, task):
+        exc = task.exception()
+        if exc is None:
+            if self._cancelled:
+                self._kill(task.result()[0])
+        elif not future.done():
+            if isinstance(exc, OSError):
+                # as run_shell_command does
+                exc = VcsError("Command failed with OSError. '%s' <%s, %s>:\n%s" % (
+                    need.key[0], need.key[2], need.key[1], exc))
+            future.set_exception(exc)
+
+    def _on_command_done(self, need, start, future):
+        self._protocol = None
+        if self._cancelled:
+            return
+        exc = future.exception()
+        if exc is not None:
+            output = exc
+        else:
+            returncode, stdout, stderr = future.result()
+            ledger = CallLedger.get_ledger()
+            if ledger is not None:
+                cmd = need.key[0]
+                ledger.add_call(list(cmd) if isinstance(cmd, tuple) else cmd,
+                                need.key[1], time.time() - start,
+                                returncode, len(stdout) + len(stderr))
+            try:
+                output = _get_shell_result(need, returncode, stdout, stderr)
+            except UnicodeDecodeError as ude:
+                output = ude
+        self._outputs.setdefault(need.key, []).append(output)
+        self._replay()
+
+    def _run_blocking(self, worker):
+        from wstool.common import run_worker, _start_tracking_worker,\
+            _stop_tracking_worker
+        _start_tracking_worker()
+        self.executor_ident = threading.current_thread().ident
+        try:
+            return run_worker(worker)
+        finally:
+            # the thread may run other workers next
+            self.executor_ident = None
+            _stop_tracking_worker()
+
+    def _run_in_executor(self):
+        future = self.loop.run_in_executor(None, self._run_blocking, self.worker)
+        future.add_done_callback(functools.partial(self._guarded, self._on_executor_done))
+
+    def _on_executor_done(self, future):
+        if self._cancelled:
+            return
+        self._finish(future.result())
+
+    def _cancel(self):
+        if self._finished.is_set():
+            return
+        self._cancelled = True
+        protocol = self._protocol
+        if protocol is not None and protocol.transport is not None:
+            self._kill(protocol.transport)
+        self._finished.set()
+        if self.done_queue is not None:
+            self.done_queue.put(self.index)
+
+    def _kill(self, transport):
+        try:
+            transport.kill()
+        except OSError:
+            # finished meanwhile
+            pass
+
+    def _finish(self, result):
+        from wstool.common import trace_worker
+        if self._finished.is_set():
+            return
+        self.outlist[self.index] = result
+        trace_worker(self.worker, self._start_time, time.time(),
+                     result, self.queue_wait)
+        self._finished.set()
+        if self.done_queue is not None:
+            self.done_queue.put(self.index)
@@ -154,6 +154,8 @@ def _get_status_flags(basepath, elt_dict):
     :param elt_dict: a dict representing one elt_dict in a table
     :returns: str
     """
+    if 'timed_out' in elt_dict and elt_dict['timed_out'] is True:
+        return 'T'
     if 'exists' in elt_dict and elt_dict['exists'] is False:
         return 'x'
     mflag = ''
@@ -34,16 +34,34 @@
 import sys
 import traceback
 import os
-import copy
+import json
+import random
+import signal
+import stat
+import tempfile
+import time
+import multiprocessing
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import resource
+except ImportError:
+    # not available on Windows
+    resource = None
 try:
     from urlparse import urlparse
 except ImportError:
     from urllib.parse import urlparse
-# choosing multiprocessing over threading for clean Control-C
+import threading
+# multiprocessing remains available as backend for clean Control-C
 # interrupts (provides terminate())
 from multiprocessing import Process, Manager
 from vcstools.vcs_base import VcsError
 
+from wstool.tracing import PopenHooks, Tracer, timed, timed_iter
+
 
 class MultiProjectException(Exception):
     pass
@@ -101,6 +119,45 @@ def is_web_uri(source_uri):
     return True
 
 
+def get_uri_host(uri):
+    """
+    Extracts the remote host from a VCS uri, supporting scp-like
+    syntax such as git@github.com:foo/bar.git
+    :param uri: uri of a remote repository
+    :returns: lowercase hostname, None for local paths
+    """
+    if not is_web_uri(uri):
+        return None
+    parsed_uri = urlparse(uri)
+    if parsed_uri.hostname:
+        return parsed_uri.hostname
+    # scp-like syntax [user@]host:path
+    prefix = uri.split('/')[0]
+    if ':' in prefix:
+        host = prefix.split(':')[0].split('@')[-1]
+        if host:
+            return host.lower()
+    return None
+
+
+# seconds to wait before the first retry, doubling for each further one
+RETRY_BASE_DELAY = 1.0
+# maximum seconds to wait before a retry
+RETRY_MAX_DELAY = 30.0
+
+
+def get_retry_delay(attempt, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY):
+    """
+    Exponential backoff with full jitter, so that workers failing at
+    the same time for the same remote do not retry at the same time.
+
+    :param attempt: number of failed attempts so far, starting with 1
+    :returns: random seconds between 0 and base_delay * 2^(attempt - 1),
+    at most max_delay
+    """
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
 def normalize_uri(source_uri, base_path):
     """
     If source_uri is none or a web uri, return it.
@@ -152,6 +209,42 @@ def string_diff(str1_orig, str2_orig, maxlen=11, backtrack=7):
     return result
 
 
+def write_atomically(filename, data):
+    """
+    writes data to a temporary file in the same folder, then renames it
+    to filename, so that readers and concurrent wstool invocations never
+    see a partially written file. Keeps the mode of an existing file.
+
+    :param data: bytes
+    :raises: IOError, OSError if the file cannot be written
+    """
+    folder = os.path.dirname(filename) or '.'
+    fd, temp_filename = tempfile.mkstemp(
+        prefix='.%s.' % os.path.basename(filename), dir=folder)
+    try:
+        with os.fdopen(fd, 'wb') as fhand:
+            fhand.write(data)
+            fhand.flush()
+            os.fsync(fhand.fileno())
+        if os.path.exists(filename):
+            mode = stat.S_IMODE(os.stat(filename).st_mode)
+        else:
+            # mkstemp creates files only readable by the user
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        os.chmod(temp_filename, mode)
+        if hasattr(os, 'replace'):
+            os.replace(temp_filename, filename)
+        else:
+            # python2, atomic on POSIX
+            os.rename(temp_filename, filename)
+    except BaseException:
+        if os.path.exists(temp_filename):
+            os.remove(temp_filename)
+        raise
+
+
 def normabspath(localname, path):
     """
     if localname is absolute, return it normalized. If relative,
@@ -208,6 +301,130 @@ def realpath_relation(abspath1, abspath2):
     return None
 
 
+class PathTrie(object):
+    """
+    Maps absolute paths to values, indexed by path component, so that
+    finding a path, its ancestors or its descendants costs time linear
+    in the depth of the path, not in the number of paths stored.
+    Paths are expected to be normalized, e.g. by os.path.realpath.
+    """
+
+    class _Node(object):
+
+        def __init__(self):
+            self.children = {}
+            self.has_value = False
+            self.value = None
+            # number of values stored in this node and below
+            self.count = 0
+
+    def __init__(self):
+        self._root = PathTrie._Node()
+
+    def __len__(self):
+        return self._root.count
+
+    def copy(self):
+        """
+        :returns: a PathTrie with the same paths, sharing the values
+        """
+        result = PathTrie()
+        pending = [(self._root, result._root)]
+        while pending:
+            node, new_node = pending.pop()
+            new_node.has_value = node.has_value
+            new_node.value = node.value
+            new_node.count = node.count
+            for part, child in node.children.items():
+                new_child = PathTrie._Node()
+                new_node.children[part] = new_child
+                pending.append((child, new_child))
+        return result
+
+    @staticmethod
+    def _split(path):
+        return [part for part in path.split(os.sep) if part]
+
+    def _find(self, path):
+        node = self._root
+        for part in PathTrie._split(path):
+            node = node.children.get(part)
+            if node is None:
+                return None
+        return node
+
+    def add(self, path, value):
+        """replaces any value stored for path"""
+        nodes = [self._root]
+        for part in PathTrie._split(path):
+            nodes.append(nodes[-1].children.setdefault(part, PathTrie._Node()))
+        if not nodes[-1].has_value:
+            for node in nodes:
+                node.count += 1
+        nodes[-1].has_value = True
+        nodes[-1].value = value
+
+    def remove(self, path):
+        """
+        :returns: True if a value was stored for path
+        """
+        nodes = [self._root]
+        parts = PathTrie._split(path)
+        for part in parts:
+            node = nodes[-1].children.get(part)
+            if node is None:
+                return False
+            nodes.append(node)
+        if not nodes[-1].has_value:
+            return False
+        nodes[-1].has_value = False
+        nodes[-1].value = None
+        for node in nodes:
+            node.count -= 1
+        # prune empty branches
+        for index in range(len(parts), 0, -1):
+            if nodes[index].count > 0:
+                break
+            del nodes[index - 1].children[parts[index - 1]]
+        return True
+
+    def get(self, path, default=None):
+        node = self._find(path)
+        if node is None or not node.has_value:
+            return default
+        return node.value
+
+    def get_ancestors(self, path):
+        """
+        :returns: values stored for parent folders of path, outermost first
+        """
+        result = []
+        node = self._root
+        for part in PathTrie._split(path):
+            if node.has_value:
+                result.append(node.value)
+            node = node.children.get(part)
+            if node is None:
+                break
+        return result
+
+    def get_descendants(self, path):
+        """
+        :returns: values stored for paths below path, excluding path itself
+        """
+        result = []
+        node = self._find(path)
+        if node is None or node.count == int(node.has_value):
+            return result
+        stack = list(node.children.values())
+        while stack:
+            node = stack.pop()
+            if node.has_value:
+                result.append(node.value)
+            stack.extend(node.children.values())
+        return result
+
+
 def select_element(elements, localname):
     """
     selects entry among elements where path or localname matches.
@@ -229,19 +446,29 @@ def select_elements(config, localnames):
     """
     selects config elements with given localnames, returns in the
     order given in config If localnames has one element which is path
-    of the config, return all elements
+    of the config, return all elements. See Config.select_elements
     """
     if config is None:
         return []
+    if hasattr(config, 'select_elements'):
+        # uses the indexes of wstool.config.Config
+        return config.select_elements(localnames)
     if localnames is None:
         return config.get_config_elements()
     elements = config.get_config_elements()
-    selected = []
+    by_local_name = {}
+    by_realpath = {}
+    for element in reversed(elements):
+        by_local_name[element.get_local_name()] = element
+        by_realpath[os.path.realpath(element.get_path())] = element
+    selected = {}
     notfound = []
     for localname in localnames:
-        element = select_element(elements, localname)
+        element = by_local_name.get(localname)
+        if element is None:
+            element = by_realpath.get(os.path.realpath(localname))
         if element is not None:
-            selected.append(element)
+            selected[id(element)] = element
         else:
             notfound.append(localname)
     if notfound != []:
@@ -251,12 +478,8 @@ def select_elements(config, localnames):
 
             return config.get_config_elements()
         raise MultiProjectException("Unknown elements '%s'" % notfound)
-    result = []
     # select in order and remove duplicates
-    for element in config.get_config_elements():
-        if element in selected:
-            result.append(element)
-    return result
+    return [element for element in elements if id(element) in selected]
 
 
 ## Multithreading The following classes help with distributing work
@@ -266,54 +489,619 @@ def select_elements(config, localnames):
 ## that some library is not thread-safe.
 
 
-class WorkerThread(Process):
+# slot names of each ResultRecord class, in declaration order and as
+# set, computed once
+_RECORD_FIELDS = {}
+
+
+class ResultRecord(object):
+    """
+    Result of a worker for one element. The keys a command produces
+    are stored in slots, saving the per element dict for workspaces
+    with thousands of entries, with the dict access callers used when
+    results were dicts. An unset slot counts as a missing key. Keys
+    without a slot are kept in an extra dict.
+    """
+
+    __slots__ = ('entry', 'error', 'timed_out', '_extra')
+
+    def __init__(self, values=None, **kwargs):
+        self._extra = None
+        self.update(values, **kwargs)
+
+    @classmethod
+    def _get_field_names(cls):
+        fields = _RECORD_FIELDS.get(cls)
+        if fields is None:
+            names = tuple([name for klass in reversed(cls.__mro__)
+                           for name in klass.__dict__.get('__slots__', ())
+                           if name != '_extra'])
+            fields = (names, frozenset(names))
+            _RECORD_FIELDS[cls] = fields
+        return fields[0]
+
+    @classmethod
+    def _get_fields(cls):
+        if cls not in _RECORD_FIELDS:
+            cls._get_field_names()
+        return _RECORD_FIELDS[cls][1]
+
+    def __getitem__(self, key):
+        if key in self._get_fields():
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self._get_fields():
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self._get_fields():
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key)
+        elif self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        else:
+            del self._extra[key]
+
+    def __contains__(self, key):
+        if key in self._get_fields():
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __eq__(self, other):
+        if not hasattr(other, 'items'):
+            return False
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "%s(%s)" % (self.__class__.__name__, dict(self.items()))
+
+    def __getstate__(self):
+        return dict(self.items())
+
+    def __setstate__(self, state):
+        self._extra = None
+        self.update(state)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def keys(self):
+        keys = [name for name in self._get_field_names() if hasattr(self, name)]
+        if self._extra is not None:
+            keys.extend(self._extra.keys())
+        return keys
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def update(self, values=None, **kwargs):
+        if values is not None:
+            for key, value in values.items():
+                self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+
+def _create_result(worker):
+    """
+    :returns: an empty result of the result_class of the worker if
+    it declares one, else a dict
+    """
+    return getattr(worker, 'result_class', dict)()
+
+
+def run_worker(worker, do_work=None):
+    """
+    Calls worker.do_work() and wraps its result or any exception in
+    a result dict having at least the key 'entry'. The result is a
+    ResultRecord if the worker declares a result_class.
+
+    :param do_work: optional function to call instead of worker.do_work
+    """
+    result = _create_result(worker)
+    if do_work is None:
+        do_work = worker.do_work
+    try:
+        result['entry'] = worker.element.get_path_spec()
+        if is_worker_cancelled():
+            raise MultiProjectException("worker was cancelled")
+        result_dict = do_work()
+        if result_dict is not None:
+            result.update(result_dict)
+        else:
+            result.update(
+                {'error': MultiProjectException("worker returned None")})
+    except MultiProjectException as mpe:
+        result.update({'error': mpe})
+    except VcsError as vcse:
+        result.update({'error': vcse})
+    except OSError as ose:
+        result.update({'error': ose})
+    except Exception as exc:
+        # this would be a bug, and we need trace to find them in
+        # multithreaded cases.
+        traceback.print_exc(file=sys.stderr)
+        result.update({'error': exc})
+    return result
+
+
+def trace_worker(worker, start, end, output, queue_wait=None):
+    """
+    records a finished worker with the global Tracer, if tracing
+
+    :param output: result dict of the worker
+    :param queue_wait: seconds the worker waited to be started
+    """
+    tracer = Tracer.get_tracer()
+    if tracer is None:
+        return
+    args = {}
+    if output is None:
+        args['status'] = 'unknown'
+    elif output.get('timed_out'):
+        args['status'] = 'timed_out'
+    elif 'error' in output:
+        args['status'] = 'error'
+        args['error'] = str(output['error'])
+    else:
+        args['status'] = 'ok'
+    if output is not None and 'returncode' in output:
+        args['returncode'] = output['returncode']
+    if queue_wait is not None:
+        args['queue_wait_ms'] = int(queue_wait * 1000)
+    tracer.add_event(worker.element.get_local_name(),
+                     getattr(worker, 'phase', 'work'),
+                     start, end, args)
+
+
+class _WorkerState(object):
+    """
+    child processes and cancellation of the worker running in a thread
+    """
+
+    def __init__(self):
+        self.children = []
+        self.cancelled = threading.Event()
+
+
+# thread ident -> _WorkerState of the worker running in that thread
+_worker_states = {}
+_worker_states_lock = threading.Lock()
+
+
+class _ChildTracker(object):
+    """
+    PopenHooks hook recording the child processes of workers, and
+    killing those started by a worker already cancelled
+    """
+
+    def popen_started(self, proc):
+        state = _worker_states.get(threading.current_thread().ident)
+        if state is None:
+            return
+        with _worker_states_lock:
+            if not state.cancelled.is_set():
+                state.children.append(proc)
+                return
+        proc.kill()
+
+    def popen_done(self, proc, output_bytes):
+        pass
+
+
+_CHILD_TRACKER = _ChildTracker()
+
+
+def _start_tracking_worker():
+    """
+    records child processes started by the current thread until
+    _stop_tracking_worker is called from it
+    """
+    with _worker_states_lock:
+        if len(_worker_states) == 0:
+            PopenHooks.add_hook(_CHILD_TRACKER)
+        _worker_states[threading.current_thread().ident] = _WorkerState()
+
+
+def _stop_tracking_worker():
+    with _worker_states_lock:
+        _worker_states.pop(threading.current_thread().ident, None)
+        if len(_worker_states) == 0:
+            PopenHooks.remove_hook(_CHILD_TRACKER)
+
 
-    def __init__(self, worker, outlist, index):
+def _cancel_worker(ident):
+    """
+    marks the worker running in the thread as cancelled and kills its
+    running child processes, and those it starts afterwards
+    """
+    with _worker_states_lock:
+        state = _worker_states.get(ident)
+        if state is None:
+            return
+        state.cancelled.set()
+        children = list(state.children)
+    for proc in children:
+        if proc.poll() is None:
+            try:
+                proc.kill()
+            except OSError:
+                # finished meanwhile
+                pass
+
+
+def is_worker_cancelled():
+    """
+    :returns: True if the worker running in the current thread was
+    terminated, e.g. past the deadline, and must not go on
+    """
+    state = _worker_states.get(threading.current_thread().ident)
+    return state is not None and state.cancelled.is_set()
+
+
+def sleep_unless_cancelled(seconds):
+    """
+    sleeps, returning early if the worker running in the current
+    thread is terminated
+
+    :returns: True if the worker was terminated
+    """
+    state = _worker_states.get(threading.current_thread().ident)
+    if state is None:
+        time.sleep(seconds)
+        return False
+    state.cancelled.wait(seconds)
+    return state.cancelled.is_set()
+
+
+class WorkerThread(threading.Thread):
+    """
+    Runs a worker in a thread of the current process. VCS work is
+    mostly waiting for child processes, so threads avoid the cost of
+    forking and pickling results.
+    """
+
+    def __init__(self, worker, outlist, index, done_queue=None):
+        """
+        :param done_queue: optional queue.Queue, receives index when done
+        """
+        threading.Thread.__init__(self)
+        self.worker = worker
+        if worker is None or worker.element is None:
+            raise MultiProjectException("Bug: Invalid Worker")
+        self.outlist = outlist
+        self.index = index
+        self.done_queue = done_queue
+        # seconds waited to be started, set by DistributedWork
+        self.queue_wait = None
+        # do not keep the interpreter alive after Control-C
+        self.daemon = True
+
+    def run(self):
+        start = time.time()
+        _start_tracking_worker()
+        try:
+            self.outlist[self.index] = run_worker(self.worker)
+        except KeyboardInterrupt:
+            # when run in the main thread, workers running one at a time
+            _cancel_worker(threading.current_thread().ident)
+            raise
+        finally:
+            _stop_tracking_worker()
+        trace_worker(self.worker, start, time.time(),
+                     self.outlist[self.index], self.queue_wait)
+        if self.done_queue is not None:
+            self.done_queue.put(self.index)
+
+    def terminate(self):
+        # threads cannot be killed, but their child processes are,
+        # also when SIGINT was sent to this process only. The worker
+        # is cancelled, stopping at the next check, its result ignored.
+        if self.ident is not None:
+            _cancel_worker(self.ident)
+
+
+class WorkerProcess(Process):
+    """
+    Runs a worker in a separate process, which can be terminated
+    at any time. It is traced by DistributedWork, as the child process
+    has no access to the tracer.
+    """
+
+    def __init__(self, worker, outlist, index, done_queue=None):
+        """
+        :param done_queue: optional multiprocessing.Queue, receives index when done
+        """
         Process.__init__(self)
         self.worker = worker
         if worker is None or worker.element is None:
             raise MultiProjectException("Bug: Invalid Worker")
         self.outlist = outlist
         self.index = index
+        self.done_queue = done_queue
+        self.queue_wait = None
+
+    def _on_terminate(self, signum, frame):
+        # not taking locks the interrupted code may hold, e.g. while
+        # waiting for a child, this process has no other threads
+        state = _worker_states.get(threading.current_thread().ident)
+        for proc in list(state.children if state is not None else []):
+            if proc.returncode is None:
+                try:
+                    proc.kill()
+                    os.waitpid(proc.pid, 0)
+                except OSError:
+                    # finished meanwhile
+                    pass
+        os._exit(1)
 
     def run(self):
-        result = {}
+        if multiprocessing.current_process() is self:
+            # terminate() sends SIGTERM, which would leave the child
+            # processes of the worker running. Not when run in this
+            # process, for workers running one at a time.
+            _start_tracking_worker()
+            signal.signal(signal.SIGTERM, self._on_terminate)
+        self.outlist[self.index] = run_worker(self.worker)
+        if self.done_queue is not None:
+            self.done_queue.put(self.index)
+
+
+def _is_finished(thread):
+    # ident is set for both threads and processes once started
+    return thread.ident is not None and not thread.is_alive()
+
+
+# phase of PhaseTimers waiting for workers to finish, the rest of
+# running workers is charged to 'scheduling'
+WORKERS_PHASE = 'waiting for workers'
+
+# file descriptors a running worker may hold (pipes to child processes)
+FDS_PER_WORKER = 8
+# file descriptors to keep for the main program
+FDS_RESERVED = 32
+
+
+def get_cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def get_max_workers_for_open_files():
+    """
+    :returns: how many workers can run before exhausting the soft
+    limit of open files, None if the limit is unknown or unlimited
+    """
+    if resource is None:
+        return None
+    try:
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (ValueError, OSError):
+        return None
+    if soft_limit == resource.RLIM_INFINITY:
+        return None
+    return max(1, (soft_limit - FDS_RESERVED) // FDS_PER_WORKER)
+
+
+class AutoTuner(object):
+    """
+    Determines the number of concurrent workers for num_threads='auto'.
+
+    Starts from twice the CPU count, then tunes by the observed
+    latency of finished workers: the smaller the share of their wall
+    time spent on CPU (in this process or in its child processes), the
+    more workers are allowed, up to MAX_CPU_FACTOR times the CPU count.
+    The open files limit is never exceeded.
+    """
+
+    MAX_CPU_FACTOR = 8
+
+    def __init__(self, capacity, cpu_count=None, max_workers=None):
+        self.capacity = capacity
+        self.cpu_count = cpu_count or get_cpu_count()
+        if max_workers is None:
+            max_workers = get_max_workers_for_open_files()
+        upper = self.cpu_count * AutoTuner.MAX_CPU_FACTOR
+        if max_workers is not None:
+            upper = min(upper, max_workers)
+        self.upper = max(1, min(upper, capacity))
+        self.lower = min(self.cpu_count, self.upper)
+        self.num_threads = max(self.lower, min(2 * self.cpu_count, self.upper))
+        self.wall_time = 0.0
+        self.cpu_time = 0.0
+        self._cpu_start = self._get_cpu_time()
+
+    @staticmethod
+    def _get_cpu_time():
+        # user and system time of this process and its waited-for children
+        return sum(os.times()[:4])
+
+    def add_latency(self, seconds):
+        """
+        registers the wall time a finished worker took
+
+        :returns: the new number of concurrent workers
+        """
+        self.wall_time += seconds
+        cpu_now = self._get_cpu_time()
+        self.cpu_time += cpu_now - self._cpu_start
+        self._cpu_start = cpu_now
+        if self.wall_time > 0:
+            # workers needed to keep all CPUs busy, assuming the
+            # measured workers are representative
+            cpu_share = max(self.cpu_time / self.wall_time, 1.0 / AutoTuner.MAX_CPU_FACTOR)
+            target = int(round(self.cpu_count / cpu_share))
+            self.num_threads = max(self.lower, min(target, self.upper))
+        return self.num_threads
+
+
+# file in the workspace remembering durations of previous runs
+DURATIONS_FILENAME = '.wstool_durations'
+
+
+class DurationStore(object):
+    """
+    Remembers per element how long an operation took, in a small json
+    file, so that DistributedWork can start the most expensive workers
+    first next time. Durations are only a hint, so failures to read or
+    write the file are ignored.
+    """
+
+    def __init__(self, filename, operation):
+        """
+        :param filename: json file storing {operation: {localname: seconds}}
+        :param operation: name of the operation to read and write durations for
+        """
+        self.filename = filename
+        self.operation = operation
+        self.durations = {}
         try:
-            result = {'entry': self.worker.element.get_path_spec()}
-            result_dict = self.worker.do_work()
-            if result_dict is not None:
-                result.update(result_dict)
-            else:
-                result.update(
-                    {'error': MultiProjectException("worker returned None")})
-        except MultiProjectException as mpe:
-            result.update({'error': mpe})
-        except VcsError as vcse:
-            result.update({'error': vcse})
-        except OSError as ose:
-            result.update({'error': ose})
-        except Exception as exc:
-            # this would be a bug, and we need trace to find them in
-            # multithreaded cases.
-            traceback.print_exc(file=sys.stderr)
-            result.update({'error': exc})
-        self.outlist[self.index] = result
+            with open(filename, 'r') as fhand:
+                durations = json.load(fhand)
+            if isinstance(durations, dict):
+                self.durations = durations
+        except (IOError, OSError, ValueError):
+            pass
+
+    def get(self, localname):
+        """
+        :returns: seconds the operation took last time, None if unknown
+        """
+        return self.durations.get(self.operation, {}).get(localname)
+
+    def set(self, localname, seconds):
+        self.durations.setdefault(self.operation, {})[localname] = round(seconds, 3)
+
+    def save(self):
+        try:
+            # replaced atomically for concurrent wstool invocations
+            write_atomically(self.filename, json.dumps(
+                self.durations, indent=1, sort_keys=True).encode('utf-8'))
+        except (IOError, OSError):
+            pass
+
+
+# known execution backends, 'thread' being the default
+WORKER_BACKENDS = {'thread': WorkerThread,
+                   'process': WorkerProcess}
+# asyncio engine requires python 3.8, older versions cannot run
+# subprocesses from an event loop outside the main thread
+if sys.version_info >= (3, 8):
+    from wstool.async_engine import AsyncWorker
+    WORKER_BACKENDS['asyncio'] = AsyncWorker
 
 
 class DistributedWork():
 
-    def __init__(self, capacity, num_threads=10, silent=True):
-         # need managed array since we need the results later
-        man = Manager()
-        self.outputs = man.list([None for _ in range(capacity)])
+    # seconds to wait for workers before checking liveness
+    POLL_INTERVAL = 1
+
+    def __init__(self, capacity, num_threads=10, silent=True, backend='thread',
+                 scm_limits=None, host_limit=None, duration_store=None,
+                 deadline=None):
+        """
+        :param capacity: maximum number of workers to be added
+        :param num_threads: maximum number of concurrent workers, -1 for
+        capacity, 'auto' to tune by CPU count, open files limit and
+        observed worker latency, see AutoTuner
+        :param silent: if False, print which workers are still active
+        :param backend: one of WORKER_BACKENDS, 'thread' runs workers
+        in threads, 'process' in separate processes, 'asyncio' (python
+        3.8 or newer) runs the subprocesses of workers declaring
+        replay_commands from a single event loop, see wstool.async_engine
+        :param scm_limits: optional dict {scmtype: limit} of how many
+        workers of elements of that type may run concurrently, 1 meaning
+        sequentially, for clients that do not cope with parallel use.
+        Other types are only limited by num_threads.
+        :param host_limit: optional maximum number of workers of elements
+        with a uri on the same remote host running concurrently
+        :param duration_store: optional DurationStore, workers are started
+        longest first by their previous durations, elements without a
+        previous duration before all others. Durations of successful
+        workers are recorded.
+        :param deadline: optional seconds after which running workers
+        are terminated and workers not started are skipped. Their
+        results are dicts with 'entry' and 'timed_out': True.
+        Workers running in threads cannot be terminated, their child
+        processes are killed and their results ignored.
+        """
+        if backend not in WORKER_BACKENDS:
+            raise MultiProjectException(
+                "Unknown backend '%s', valid are %s" % (backend,
+                                                        sorted(WORKER_BACKENDS.keys())))
+        self.backend = backend
+        if backend == 'process':
+            # need managed array since we need the results later
+            man = Manager()
+            self.outputs = man.list([None for _ in range(capacity)])
+            self.done_queue = multiprocessing.Queue()
+        else:
+            self.outputs = [None for _ in range(capacity)]
+            self.done_queue = queue.Queue()
         self.threads = []
+        # group of workers -> maximum number of workers running concurrently
         self.sequentializers = {}
+        for scmtype, limit in (scm_limits or {}).items():
+            if limit < 1:
+                raise MultiProjectException(
+                    "Invalid limit %s for %s workers" % (limit, scmtype))
+            self.sequentializers[('scm', scmtype)] = limit
+        if host_limit is not None and host_limit < 1:
+            raise MultiProjectException(
+                "Invalid limit %s for workers per host" % host_limit)
+        self.host_limit = host_limit
+        self.duration_store = duration_store
+        if deadline is not None and deadline <= 0:
+            raise MultiProjectException("Invalid deadline %s" % deadline)
+        self.deadline = deadline
         self.index = 0
-        self.num_threads = capacity if num_threads <= 0 else min(num_threads, capacity)
+        self.auto_tuner = None
+        if num_threads == 'auto' and backend == 'asyncio':
+            # waiting for subprocesses costs no thread, only open files
+            self.num_threads = min(capacity,
+                                   get_max_workers_for_open_files() or capacity)
+        elif num_threads == 'auto':
+            self.auto_tuner = AutoTuner(capacity)
+            self.num_threads = self.auto_tuner.num_threads
+        else:
+            self.num_threads = capacity if num_threads <= 0 else min(num_threads, capacity)
         self.silent = silent
 
     def add_thread(self, worker):
-        thread = WorkerThread(worker, self.outputs, self.index)
+        thread = WORKER_BACKENDS[self.backend](worker, self.outputs, self.index,
+                                               self.done_queue)
         if self.index >= len(self.outputs):
             raise MultiProjectException(
                 "Bug: Declared capacity exceeded %s >= %s" % (self.index,
@@ -321,63 +1109,229 @@ class DistributedWork():
         self.index += 1
         self.threads.append(thread)
 
+    def _get_groups(self, worker):
+        """
+        :returns: list of sequentializers keys the worker belongs to
+        """
+        groups = []
+        element = getattr(worker, 'element', None)
+        get_vcs_type_name = getattr(element, 'get_vcs_type_name', None)
+        if get_vcs_type_name is not None:
+            group = ('scm', get_vcs_type_name())
+            if group in self.sequentializers:
+                groups.append(group)
+        if self.host_limit is not None:
+            host = get_uri_host(getattr(element, 'uri', None))
+            if host is not None:
+                group = ('host', host)
+                self.sequentializers[group] = self.host_limit
+                groups.append(group)
+        return groups
+
+    def _get_start_priority(self, index):
+        """
+        :returns: sort key for the worker at index, lowest to be started first
+        """
+        thread = self.threads[index]
+        if self.duration_store is None:
+            return (0, 0, index)
+        duration = self.duration_store.get(thread.worker.element.get_local_name())
+        if duration is None:
+            return (0, 0, index)
+        return (1, -duration, index)
+
+    def _get_timed_out_output(self, index):
+        worker = self.threads[index].worker
+        output = _create_result(worker)
+        output.update({'entry': worker.element.get_path_spec(),
+                       'timed_out': True})
+        return output
+
+    def _get_output(self, index):
+        # a worker that finished without storing a result, e.g. a
+        # crashed process, must be reported rather than dropped
+        output = self.outputs[index]
+        if output is None:
+            worker = self.threads[index].worker
+            output = _create_result(worker)
+            output.update({'entry': worker.element.get_path_spec(),
+                           'error': MultiProjectException("worker finished without result")})
+        return output
+
+    def _record_duration(self, index, seconds):
+        output = self.outputs[index]
+        if (self.duration_store is not None
+            and output is not None and 'error' not in output):
+
+            self.duration_store.set(
+                self.threads[index].worker.element.get_local_name(), seconds)
+
     def run(self):
         """
         Execute all collected workers, terminate all on KeyboardInterrupt
+
+        :returns: list of result dicts in the order workers were added
+        :raises MultiProjectException: after all workers finished, if
+        any of them failed
         """
-        if self.threads == []:
-            return []
-        if (self.num_threads == 1):
-            for thread in self.threads:
-                thread.run()
-        else:
-            # The following code is rather delicate and may behave differently
-            # using threading or multiprocessing. running_threads is
-            # intentionally not used as a shrinking list because of al the
-            # possible multithreading / interruption corner cases
-            # Not using Pool because of KeyboardInterrupt cases
-            try:
-                waiting_index = 0
-                maxthreads = self.num_threads
-                running_threads = []
-                missing_threads = copy.copy(self.threads)
-                # we are done if all threads have finished
-                while len(missing_threads) > 0:
-                    # we spawn more threads whenever some threads have finished
-                    if len(running_threads) < maxthreads:
-                        to_index = min(
-                            waiting_index + maxthreads - len(running_threads),
-                            len(self.threads))
-                        for i in range(waiting_index, to_index):
-                            self.threads[i].start()
-                            running_threads.append(self.threads[i])
-                        waiting_index = to_index
-                    # threads have exitcode only once they terminated
-                    missing_threads = [t for t in missing_threads if t.exitcode is None]
-                    running_threads = [t for t in running_threads if t.exitcode is None]
-                    if (not self.silent
-                        and len(running_threads) > 0):
-
-                        print("[%s] still active" % ",".join([th.worker.element.get_local_name() for th in running_threads]))
-                    for thread in running_threads:
-                        # this should prevent busy waiting
-                        thread.join(1)
-            except KeyboardInterrupt as k:
-                for thread in self.threads:
-                    if thread is not None and thread.is_alive():
-                        print("[%s] terminated while active" % thread.worker.element.get_local_name())
-                        thread.terminate()
-                raise k
-
-        self.outputs = [x for x in self.outputs if x is not None]
-        message = ''
-        for output in self.outputs:
+        self.outputs = list(self.run_iter(ordered=True))
+        return self.outputs
+
+    def run_iter(self, ordered=False):
+        """
+        Execute all collected workers, terminate all on KeyboardInterrupt.
+        Generator yielding the result dict of each worker as soon as it
+        finished, so that callers can present results incrementally.
+
+        :param ordered: if True, yield results in the order workers
+        were added, each as soon as it and all workers added before it
+        finished
+        :raises MultiProjectException: after all workers finished, if
+        any of them failed
+        """
+        errors = []
+        for output in timed_iter(self._run_workers(ordered), 'scheduling'):
             if "error" in output:
-                if 'entry' in output:
-                    message += "Error processing '%s' : %s\n" % (
-                        output['entry'].get_local_name(), output["error"])
-                else:
-                    message += "%s\n" % output["error"]
+                errors.append(output)
+            else:
+                yield output
+        message = ''
+        for output in errors:
+            if 'entry' in output:
+                message += "Error processing '%s' : %s\n" % (
+                    output['entry'].get_local_name(), output["error"])
+            else:
+                message += "%s\n" % output["error"]
         if message != '':
             raise MultiProjectException(message)
-        return self.outputs
+
+    def _run_workers(self, ordered):
+        if self.threads == []:
+            return
+        run_start = time.time()
+        if self.num_threads == 1 and self.deadline is None:
+            for thread in self.threads:
+                start_time = time.time()
+                thread.queue_wait = start_time - run_start
+                with timed(WORKERS_PHASE):
+                    thread.run()
+                self._record_duration(thread.index, time.time() - start_time)
+                if isinstance(thread, WorkerProcess):
+                    trace_worker(thread.worker, start_time, time.time(),
+                                 self.outputs[thread.index], thread.queue_wait)
+                yield self._get_output(thread.index)
+            # the order of workers does not matter when running one at
+            # a time, so durations are not saved
+            return
+        # Not using Pool because of KeyboardInterrupt cases. Workers
+        # report their index to done_queue when finished, so a free slot
+        # is refilled as soon as a worker is done. Waiting on the queue
+        # times out periodically to notice workers that died without
+        # reporting, and to report progress when not silent.
+        # Workers are started longest first if previous durations are
+        # known, else in order, skipping those whose sequentializers have
+        # no free slot.
+        end_time = None
+        if self.deadline is not None:
+            end_time = time.time() + self.deadline
+        try:
+            # indices of threads not started yet
+            waiting_indices = sorted(range(len(self.threads)),
+                                     key=self._get_start_priority)
+            worker_groups = [self._get_groups(thread.worker) for thread in self.threads]
+            group_counts = dict([(group, 0) for group in self.sequentializers])
+            # index of next thread to report when ordered
+            reported_index = 0
+            finished_indices = set()
+            # index -> output of workers not done before the deadline
+            timed_out_outputs = {}
+            maxthreads = self.num_threads
+            running_threads = {}
+            start_times = {}
+            while len(waiting_indices) > 0 or len(running_threads) > 0:
+                position = 0
+                while (position < len(waiting_indices) and
+                       len(running_threads) < maxthreads):
+                    index = waiting_indices[position]
+                    if [group for group in worker_groups[index]
+                            if group_counts[group] >= self.sequentializers[group]]:
+                        position += 1
+                        continue
+                    del waiting_indices[position]
+                    for group in worker_groups[index]:
+                        group_counts[group] += 1
+                    thread = self.threads[index]
+                    start_times[index] = time.time()
+                    thread.queue_wait = start_times[index] - run_start
+                    thread.start()
+                    running_threads[index] = thread
+                done_indices = []
+                timeout = DistributedWork.POLL_INTERVAL
+                if end_time is not None:
+                    timeout = max(0, min(timeout, end_time - time.time()))
+                try:
+                    with timed(WORKERS_PHASE):
+                        done_indices.append(
+                            self.done_queue.get(timeout=timeout))
+                    # collect all others finished meanwhile
+                    while True:
+                        done_indices.append(self.done_queue.get_nowait())
+                except queue.Empty:
+                    pass
+                if len(done_indices) == 0:
+                    # workers might have died without reporting
+                    done_indices = [index for index, thread in running_threads.items()
+                                    if _is_finished(thread)]
+                for index in done_indices:
+                    thread = running_threads.pop(index, None)
+                    if thread is None:
+                        # already handled
+                        continue
+                    for group in worker_groups[index]:
+                        group_counts[group] -= 1
+                    latency = time.time() - start_times[index]
+                    self._record_duration(index, latency)
+                    if isinstance(thread, WorkerProcess):
+                        trace_worker(thread.worker, start_times[index], time.time(),
+                                     self.outputs[index], thread.queue_wait)
+                    if self.auto_tuner is not None:
+                        maxthreads = self.auto_tuner.add_latency(latency)
+                    if ordered:
+                        finished_indices.add(index)
+                    else:
+                        yield self._get_output(index)
+                if (end_time is not None and time.time() >= end_time
+                    and (len(running_threads) > 0 or len(waiting_indices) > 0)):
+
+                    for index in sorted(list(running_threads.keys()) + waiting_indices):
+                        if index in running_threads:
+                            running_threads.pop(index).terminate()
+                        timed_out_outputs[index] = self._get_timed_out_output(index)
+                        thread = self.threads[index]
+                        trace_worker(thread.worker, start_times.get(index, end_time),
+                                     time.time(), timed_out_outputs[index],
+                                     thread.queue_wait)
+                        if ordered:
+                            finished_indices.add(index)
+                        else:
+                            yield timed_out_outputs[index]
+                    waiting_indices = []
+                while reported_index in finished_indices:
+                    if reported_index in timed_out_outputs:
+                        yield timed_out_outputs[reported_index]
+                    else:
+                        yield self._get_output(reported_index)
+                    reported_index += 1
+                if (not self.silent
+                    and len(running_threads) > 0):
+
+                    print("[%s] still active" % ",".join([th.worker.element.get_local_name()
+                                                          for _, th in sorted(running_threads.items())]))
+            if self.duration_store is not None:
+                self.duration_store.save()
+        except (KeyboardInterrupt, GeneratorExit):
+            for thread in self.threads:
+                if thread is not None and thread.is_alive():
+                    print("[%s] terminated while active" % thread.worker.element.get_local_name())
+                    thread.terminate()
+            raise
@@ -32,8 +32,19 @@
 
 
 import os
+import sys
+import copy
+import hashlib
+import marshal
 from wstool.config_elements import AVCSConfigElement, OtherConfigElement, SetupConfigElement
-from wstool.common import MultiProjectException, normabspath, realpath_relation, normalize_uri
+from wstool.config_yaml import PathSpec
+from wstool.common import MultiProjectException, normabspath, realpath_relation, normalize_uri,\
+    PathTrie, write_atomically
+
+
+CONFIG_CACHE_FILENAME = '.wstool_cache'
+# increase when the format of cached path specs changes
+CONFIG_CACHE_VERSION = 2
 
 
 class Config:
@@ -44,7 +55,7 @@ class Config:
 
     def __init__(self, path_specs, install_path, config_filename=None, extended_types=None, merge_strategy='KillAppend'):
         """
-        :param config_source_dict: A list (e.g. from yaml) describing the config, list of dict, each dict describing one element.
+        :param path_specs: iterable of PathSpec, e.g. a generator parsing a large file
         :param config_filename: When given a folder, Config
         :param merge_strategy: how to deal with entries with equivalent path. See insert_element
 
@@ -57,6 +68,15 @@ class Config:
         # Also managed (VCS) entries must be disjunct (meaning one cannot be in a child folder of another managed one)
         # The idea is that managed entries can safely be concurrently modified
         self.trees = []
+        # indexes over self.trees, maintained by insert and remove
+        self._elements_by_local_name = {}
+        # realpath of each element, computed once, by id of element
+        self._realpaths = {}
+        self._path_trie = PathTrie()
+        # index of each element in self.trees by id, rebuilt when needed
+        self._positions = None
+        # whether trees and indexes are shared with a clone, see clone
+        self._shared = False
         self.base_path = os.path.abspath(install_path)
 
         self.config_filename = None
@@ -84,6 +104,28 @@ class Config:
     def __str__(self):
         return str([str(x) for x in self.trees])
 
+    def clone(self):
+        """
+        :returns: a Config with the same elements, e.g. to try a merge.
+        The elements are shared, they are replaced, not changed, when
+        inserting. The list of elements and the indexes are shared
+        until either config is changed.
+        """
+        clone = copy.copy(self)
+        self._shared = True
+        clone._shared = True
+        return clone
+
+    def _unshare(self):
+        # copy on write, see clone
+        if self._shared:
+            self.trees = list(self.trees)
+            self._elements_by_local_name = dict(self._elements_by_local_name)
+            self._realpaths = dict(self._realpaths)
+            self._path_trie = self._path_trie.copy()
+            self._positions = None
+            self._shared = False
+
     def add_path_spec(self, path_spec, merge_strategy='KillAppend'):
         """
         add new element to this config with information provided in path spec
@@ -92,6 +134,27 @@ class Config:
         :param path_specs: PathSpec objects
         :returns: merge action taken, see insert_element
         """
+        created = self.create_element(path_spec)
+        if created is None:
+            return None
+        elem, realpath = created
+        if not elem.is_vcs_element():
+            return self.insert_element(elem, merge_strategy, realpath)
+        try:
+            return self.insert_element(elem, merge_strategy, realpath)
+        except LookupError as ex:
+            raise MultiProjectException(
+                "Abstracted VCS Config failed. Exception: %s" % ex)
+
+    def create_element(self, path_spec):
+        """
+        creates the element add_path_spec inserts for path_spec, to
+        insert it into several clones of this config without checking
+        the filesystem again.
+
+        :returns: (element, realpath) or None if path_spec is not added
+        :raises MultiProjectException: for unknown VCS types
+        """
         # compute the local_path for the config element
         local_path = normabspath(
             path_spec.get_local_name(), self.get_base_path())
@@ -100,7 +163,6 @@ class Config:
                 elem = SetupConfigElement(local_path,
                                           os.path.normpath(path_spec.get_local_name()),
                                           properties=path_spec.get_tags())
-                return self.insert_element(elem, merge_strategy)
             else:
                 print("!!!!! Warning: Not adding file %s" % local_path)
                 return None
@@ -114,7 +176,7 @@ class Config:
                 return None
 
             if path_spec.get_scmtype() != None:
-                return self._insert_vcs_path_spec(path_spec, local_path, merge_strategy)
+                elem = self._create_vcs_path_spec_element(path_spec, local_path)
             else:
                 # keep the given local name (e.g. relative path) for other
                 # elements, but normalize
@@ -124,28 +186,27 @@ class Config:
                                           path_spec.get_uri(),
                                           path_spec.get_version(),
                                           properties=path_spec.get_tags())
-                return self.insert_element(elem, merge_strategy)
+        return elem, os.path.realpath(elem.get_path())
 
-    def _insert_vcs_path_spec(self, path_spec, local_path, merge_strategy='KillAppend'):
+    def _create_vcs_path_spec_element(self, path_spec, local_path):
         # Get the version and source_uri elements
         source_uri = normalize_uri(path_spec.get_uri(), self.get_base_path())
 
         version = path_spec.get_version()
         try:
             local_name = os.path.normpath(path_spec.get_local_name())
-            elem = self._create_vcs_config_element(
+            return self._create_vcs_config_element(
                 path_spec.get_scmtype(),
                 local_path,
                 local_name,
                 source_uri,
                 version,
                 properties=path_spec.get_tags())
-            return self.insert_element(elem, merge_strategy)
         except LookupError as ex:
             raise MultiProjectException(
                 "Abstracted VCS Config failed. Exception: %s" % ex)
 
-    def insert_element(self, new_config_elt, merge_strategy='KillAppend'):
+    def insert_element(self, new_config_elt, merge_strategy='KillAppend', realpath=None):
         """
         Insert ConfigElement to self.trees, checking for duplicate
         local-name or path first.  In case local_name matches, follow
@@ -157,54 +218,69 @@ class Config:
 
         In case local path matches but local name does not, raise Exception
 
+        :param realpath: realpath of the element, if known, see create_element
         :returns: the action performed None, 'Append', 'KillAppend',
         'MergeReplace', 'MergeKeep'
         """
-        removals = []
-        replaced = False
-        for index, loop_elt in enumerate(self.trees):
-            # if paths are os.path.realpath, no symlink problems.
-            relationship = realpath_relation(loop_elt.get_path(),
-                                             new_config_elt.get_path())
-            if relationship == 'SAME_AS':
-                if os.path.normpath(loop_elt.get_local_name()) != os.path.normpath(new_config_elt.get_local_name()):
-                    raise MultiProjectException("Elements with different local_name target the same path: %s, %s" % (loop_elt, new_config_elt))
-                else:
-                    if (loop_elt == new_config_elt):
-                        return None
-                    if (merge_strategy == 'MergeReplace' or
-                        (merge_strategy == 'KillAppend' and
-                         index == len(self.trees) - 1)):
-                        self.trees[index] = new_config_elt
-                        # keep looping to check for overlap when replacing non-
-                        # scm with scm entry
-                        replaced = True
-                        if (loop_elt.is_vcs_element or not new_config_elt.is_vcs_element):
-                            return 'MergeReplace'
-                    elif merge_strategy == 'KillAppend':
-                        removals.append(loop_elt)
-                    elif merge_strategy == 'MergeKeep':
-                        return 'MergeKeep'
-                    else:
-                        raise LookupError(
-                            "No such merge strategy: %s" % str(merge_strategy))
-            elif ((relationship == 'CHILD_OF' and new_config_elt.is_vcs_element())
-                  or (relationship == 'PARENT_OF' and loop_elt.is_vcs_element())):
-                # we do not allow any elements to be children of scm elements
-                # to allow for parallel updates and because wstool may
-                # delete scm folders on update, and thus subfolders can be
-                # deleted with their parents
-                raise MultiProjectException(
-                    "Managed Element paths overlap: %s, %s" % (loop_elt,
-                                                               new_config_elt))
-        if replaced:
+        if realpath is None:
+            realpath = os.path.realpath(new_config_elt.get_path())
+        same_elt = self._path_trie.get(realpath)
+        if same_elt is not None:
+            if os.path.normpath(same_elt.get_local_name()) != os.path.normpath(new_config_elt.get_local_name()):
+                raise MultiProjectException("Elements with different local_name target the same path: %s, %s" % (same_elt, new_config_elt))
+            if (same_elt == new_config_elt):
+                return None
+            if merge_strategy == 'MergeKeep':
+                return 'MergeKeep'
+            if merge_strategy not in ['MergeReplace', 'KillAppend']:
+                raise LookupError(
+                    "No such merge strategy: %s" % str(merge_strategy))
+        # we do not allow any elements to be children of scm elements
+        # to allow for parallel updates and because wstool may
+        # delete scm folders on update, and thus subfolders can be
+        # deleted with their parents
+        overlaps = [elt for elt in self._path_trie.get_ancestors(realpath)
+                    if elt.is_vcs_element()]
+        if new_config_elt.is_vcs_element():
+            overlaps.extend(self._path_trie.get_descendants(realpath))
+        if overlaps:
+            positions = self._get_positions()
+            loop_elt = min(overlaps, key=lambda elt: positions[id(elt)])
+            raise MultiProjectException(
+                "Managed Element paths overlap: %s, %s" % (loop_elt,
+                                                           new_config_elt))
+        if same_elt is None:
+            self._append_element(new_config_elt, realpath)
+            return 'Append'
+        if merge_strategy == 'MergeReplace' or same_elt is self.trees[-1]:
+            index = self._get_positions()[id(same_elt)]
+            self._remove_element(same_elt)
+            self.trees.insert(index, new_config_elt)
+            self._add_to_index(new_config_elt, realpath)
             return 'MergeReplace'
-        for loop_elt in removals:
-            self.trees.remove(loop_elt)
-        self.trees.append(new_config_elt)
-        if len(removals) > 0:
-            return 'KillAppend'
-        return 'Append'
+        self._remove_element(same_elt)
+        self._append_element(new_config_elt, realpath)
+        return 'KillAppend'
+
+    def _add_to_index(self, config_elt, realpath):
+        self._unshare()
+        self._elements_by_local_name[config_elt.get_local_name()] = config_elt
+        self._realpaths[id(config_elt)] = realpath
+        self._path_trie.add(realpath, config_elt)
+        self._positions = None
+
+    def _append_element(self, config_elt, realpath):
+        self._unshare()
+        self.trees.append(config_elt)
+        self._add_to_index(config_elt, realpath)
+
+    def _remove_element(self, config_elt):
+        self._unshare()
+        del self.trees[self._get_positions()[id(config_elt)]]
+        self._positions = None
+        if self._elements_by_local_name.get(config_elt.get_local_name()) is config_elt:
+            del self._elements_by_local_name[config_elt.get_local_name()]
+        self._path_trie.remove(self._realpaths.pop(id(config_elt)))
 
     def remove_element(self, local_name):
         """
@@ -212,15 +288,67 @@ class Config:
 
         :returns: True if such an element was found
         """
-        removals = []
-        for tree_el in self.trees:
-            if tree_el.get_local_name() == local_name:
-                removals.append(tree_el)
-        if len(removals) > 0:
-            for tree_el in removals:
-                self.trees.remove(tree_el)
-            return True
-        return False
+        tree_el = self._elements_by_local_name.get(local_name)
+        if tree_el is None:
+            return False
+        self._remove_element(tree_el)
+        return True
+
+    def get_element(self, local_name):
+        """
+        :returns: the element with the given local name, None if not found
+        """
+        return self._elements_by_local_name.get(local_name)
+
+    def _get_positions(self):
+        if self._positions is None:
+            self._positions = dict([(id(tree_el), index)
+                                    for index, tree_el in enumerate(self.trees)])
+        return self._positions
+
+    def select_element(self, localname):
+        """
+        selects element where path or localname matches.
+        Prefers localname matches in case of ambiguity.
+
+        :param localname: local name, or path relative to the current dir
+        :returns: the element, None if not found
+        """
+        if localname is None:
+            return None
+        element = self._elements_by_local_name.get(localname)
+        if element is None:
+            element = self._path_trie.get(os.path.realpath(localname))
+        return element
+
+    def select_elements(self, localnames):
+        """
+        selects elements with given localnames or paths, in the order
+        given in config, without duplicates. If localnames has one
+        element which is the path of the config, returns all elements.
+
+        :param localnames: list of local names or paths, None for all
+        :raises MultiProjectException: if any localname is not found
+        """
+        if localnames is None:
+            return self.get_config_elements()
+        selected = {}
+        notfound = []
+        for localname in localnames:
+            element = self.select_element(localname)
+            if element is not None:
+                selected[id(element)] = element
+            else:
+                notfound.append(localname)
+        if notfound != []:
+            # if we just passed workspace path, return all workspace entries
+            if (len(localnames) == 1 and
+                os.path.realpath(localnames[0]) == os.path.realpath(self.get_base_path())):
+
+                return self.get_config_elements()
+            raise MultiProjectException("Unknown elements '%s'" % notfound)
+        positions = self._get_positions()
+        return sorted(selected.values(), key=lambda elt: positions[id(elt)])
 
     def _create_vcs_config_element(self, scmtype, path, local_name, uri, version='', properties=None):
         try:
@@ -266,3 +394,74 @@ class Config:
         for tree_el in self.trees:
             source_aggregate.append(tree_el)
         return source_aggregate
+
+
+class ConfigCache(object):
+    """
+    Caches the PathSpecs parsed from a workspace config file in a
+    marshal file keyed on a digest of its contents, so that loading an
+    unchanged workspace skips parsing YAML. Elements are still created
+    from the PathSpecs by Config, checking the filesystem, as folders
+    and symlinks in the workspace may change while the config file
+    does not. Only plain data is stored, and failures to read or write
+    the cache are ignored.
+    """
+
+    def __init__(self, filename):
+        """
+        :param filename: path of the cache file, typically
+        CONFIG_CACHE_FILENAME in the workspace
+        """
+        self.filename = filename
+        # key of the config file when loaded, see save
+        self._key = None
+
+    @staticmethod
+    def _get_key(config_path):
+        with open(config_path, 'rb') as fhand:
+            digest = hashlib.sha1(fhand.read()).hexdigest()
+        return (CONFIG_CACHE_VERSION,
+                tuple(sys.version_info[:2]),
+                os.path.abspath(config_path),
+                digest)
+
+    def load(self, config_path):
+        """
+        :returns: list of new PathSpecs as parsed from config_path
+        with as_is=True, None if the cache is missing or outdated
+        """
+        try:
+            self._key = ConfigCache._get_key(config_path)
+        except (IOError, OSError):
+            self._key = None
+            return None
+        try:
+            with open(self.filename, 'rb') as fhand:
+                cached_key, rows = marshal.load(fhand)
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+        if cached_key != self._key:
+            return None
+        return [PathSpec(local_name=local_name, path=path, scmtype=scmtype,
+                         uri=uri, version=version,
+                         tags=list(tags) if tags is not None else None)
+                for (local_name, path, scmtype, uri, version, tags) in rows]
+
+    def save(self, config_path, path_specs):
+        """
+        stores path_specs parsed from config_path, unless the file
+        changed since load was called
+        """
+        rows = [(spec.get_local_name(), spec.get_path(), spec.get_scmtype(),
+                 spec.get_uri(), spec.get_version(), spec.get_tags())
+                for spec in path_specs]
+        try:
+            key = ConfigCache._get_key(config_path)
+            if key != self._key:
+                # edited while parsing, the rows might be of either version
+                return
+            # replaced atomically for concurrent wstool invocations
+            write_atomically(self.filename, marshal.dumps((key, rows)))
+        except (IOError, OSError, ValueError):
+            # ValueError for values marshal does not support, e.g. dates
+            pass
@@ -39,7 +39,8 @@ import datetime
 from vcstools.vcs_abstraction import get_vcs_client
 from vcstools.vcs_base import VcsError
 
-from wstool.common import samefile, MultiProjectException
+from wstool.common import samefile, get_retry_delay, is_worker_cancelled,\
+    sleep_unless_cancelled, MultiProjectException
 from wstool.config_yaml import PathSpec
 from wstool.ui import Ui
 
@@ -61,6 +62,7 @@ class PreparationReport(object):
         self.backup_path = None  # where to move tree to
         self.inplace = False     # whether to follow symlink or just delete
         self.timeout = None      # maximum time for each checkout/update
+        self.retries = 0         # how often to retry failed checkout/update
 
 
 ## Each Config element provides actions on a local folder
@@ -104,7 +106,8 @@ class ConfigElement(object):
         return preparation_report
 
     def install(self, checkout=True, backup=False, backup_path=None,
-                inplace=False, verbose=False, timeout=None, shallow=False):
+                inplace=False, verbose=False, timeout=None, shallow=False,
+                retries=0):
         """
         Attempt to make it so that self.path is the result of checking
         out / updating from remote repo.
@@ -114,6 +117,7 @@ class ConfigElement(object):
         :param checkout: whether to checkout or update
         :param backup: if checking out, what to do if path exists.
         If true, backup_path must be set.
+        :param retries: how often to retry a failed checkout or update
         """
         raise NotImplementedError("ConfigElement install unimplemented")
 
@@ -161,12 +165,35 @@ class ConfigElement(object):
     def __repr__(self):
         return str(self.get_path_spec().get_legacy_yaml())
 
+    def __setattr__(self, name, value):
+        # any change invalidates the snapshot cached by get_spec_key
+        object.__setattr__(self, name, value)
+        if name != '_spec_key':
+            object.__setattr__(self, '_spec_key', None)
+
+    def get_spec_key(self):
+        """
+        :returns: hashable snapshot of get_path_spec(), cached until
+        an attribute of this element is set
+        """
+        key = self.__dict__.get('_spec_key')
+        if key is None:
+            key = self.get_path_spec().get_key()
+            self._spec_key = key
+        return key
+
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.get_path_spec() == other.get_path_spec()
+            return self.get_spec_key() == other.get_spec_key()
         else:
             return False
 
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.get_spec_key())
+
 
 class OtherConfigElement(ConfigElement):
 
@@ -343,7 +370,8 @@ class VCSConfigElement(ConfigElement):
                 inplace=False,
                 timeout=None,
                 verbose=False,
-                shallow=False):
+                shallow=False,
+                retries=0):
         """
         Runs the equivalent of SCM checkout for new local repos or
         update for existing.
@@ -356,6 +384,10 @@ class VCSConfigElement(ConfigElement):
         move folder to this location
         :param inplace: for symlinks, allows to delete contents
         at target location and checkout to there.
+        :param retries: how often to retry a failed checkout or
+        update, after a randomized exponentially growing delay. As
+        failures of vcstools clients are not detailed, any failure
+        is retried, as it may be transient.
         """
         if checkout is True:
             print("[%s] Fetching %s (version %s) to %s" % (
@@ -372,11 +404,17 @@ class VCSConfigElement(ConfigElement):
                         shutil.rmtree(self.path)
                     else:
                         self.backup(backup_path)
-            if not self._get_vcsc().checkout(self.uri,
-                                             self.version,
-                                             timeout=timeout,
-                                             verbose=verbose,
-                                             shallow=shallow):
+            attempt = 0
+            while not self._get_vcsc().checkout(self.uri,
+                                                self.version,
+                                                timeout=timeout,
+                                                verbose=verbose,
+                                                shallow=shallow):
+                attempt += 1
+                if attempt <= retries and self._wait_for_retry(attempt, retries):
+                    # anything at path now is from the failed checkout
+                    self._remove_failed_checkout()
+                    continue
                 raise MultiProjectException(
                     "[%s] Checkout of %s version %s into %s failed." % (
                         self.get_local_name(),
@@ -386,13 +424,37 @@ class VCSConfigElement(ConfigElement):
         else:
             print("[%s] Updating %s" %
                   (self.get_local_name(), self.get_path()))
-            if not self._get_vcsc().update(self.version, verbose=verbose,
-                                           timeout=timeout):
+            attempt = 0
+            while not self._get_vcsc().update(self.version, verbose=verbose,
+                                              timeout=timeout):
+                attempt += 1
+                if attempt <= retries and self._wait_for_retry(attempt, retries):
+                    continue
                 raise MultiProjectException(
                     "[%s] Update Failed of %s" % (self.get_local_name(),
                                                   self.get_path()))
         print("[%s] Done." % self.get_local_name())
 
+    def _wait_for_retry(self, attempt, retries):
+        """
+        :returns: False if the worker was cancelled, e.g. past the
+        deadline, and must not retry
+        """
+        if is_worker_cancelled():
+            return False
+        delay = get_retry_delay(attempt)
+        print("[%s] Failed, retrying in %.1f seconds (%s/%s)" % (
+            self.get_local_name(), delay, attempt, retries))
+        return not sleep_unless_cancelled(delay)
+
+    def _remove_failed_checkout(self):
+        if os.path.islink(self.path):
+            target = os.path.realpath(self.path)
+            if os.path.exists(target):
+                shutil.rmtree(target)
+        elif os.path.exists(self.path):
+            shutil.rmtree(self.path)
+
     def get_path_spec(self):
         "yaml as from source"
         version = self.version
@@ -30,10 +30,24 @@
 # ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import copy
+import marshal
 import os
+import sys
+import threading
 import yaml
-from vcstools.common import urlopen_netrc
-from wstool.common import MultiProjectException
+try:
+    # libyaml bindings are much faster, if PyYAML was built with them
+    from yaml import CSafeLoader as SafeLoader, CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeLoader, SafeDumper
+from wstool.common import MultiProjectException, write_atomically
+from wstool.http_cache import open_uri_cached, is_http_uri, get_host_key, \
+    HostConnection
+
+INCLUDE_CACHE_FILENAME = '.wstool_includes'
+# increase when the format of cached entries changes
+INCLUDE_CACHE_VERSION = 1
 
 __REPOTYPES__ = ['svn', 'bzr', 'hg', 'git', 'tar']
 __ALLTYPES__ = __REPOTYPES__ + ['other', 'setup-file']
@@ -48,30 +62,147 @@ __ALLTYPES__ = __REPOTYPES__ + ['other', 'setup-file']
 ## get_legacy_yaml returns yaml.
 
 
+def load_yaml(stream):
+    """
+    like yaml.safe_load, using libyaml if available
+
+    :param stream: str or file-like object
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
+
+def dump_yaml(data, **kwargs):
+    """
+    like yaml.safe_dump, using libyaml if available, with the same output
+
+    :param kwargs: options of yaml.safe_dump, e.g. default_flow_style
+    """
+    return yaml.dump(data, Dumper=SafeDumper, **kwargs)
+
+
+def _compose_node(loader, anchors):
+    """
+    builds the node of the next element from parser events, like
+    the composer of PyYAML, which the libyaml loader does not expose
+    """
+    event = loader.get_event()
+    if isinstance(event, yaml.AliasEvent):
+        if event.anchor not in anchors:
+            raise yaml.composer.ComposerError(
+                None, None, "found undefined alias %s" % event.anchor,
+                event.start_mark)
+        return anchors[event.anchor]
+    if isinstance(event, yaml.ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.ScalarNode, event.value, event.implicit)
+        node = yaml.ScalarNode(tag, event.value, event.start_mark,
+                               event.end_mark, style=event.style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        return node
+    if isinstance(event, yaml.SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.SequenceNode, None, event.implicit)
+        node = yaml.SequenceNode(tag, [], event.start_mark, None,
+                                 flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(yaml.SequenceEndEvent):
+            node.value.append(_compose_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+        return node
+    if isinstance(event, yaml.MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == '!':
+            tag = loader.resolve(yaml.MappingNode, None, event.implicit)
+        node = yaml.MappingNode(tag, [], event.start_mark, None,
+                                flow_style=event.flow_style)
+        if event.anchor is not None:
+            anchors[event.anchor] = node
+        while not loader.check_event(yaml.MappingEndEvent):
+            key_node = _compose_node(loader, anchors)
+            node.value.append((key_node, _compose_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+        return node
+    raise yaml.composer.ComposerError(
+        None, None, "unexpected event %s" % event, event.start_mark)
+
+
+def iter_yaml_sequence(stream):
+    """
+    Parses a YAML document being a sequence, like a rosinstall file,
+    yielding its items one by one, so that only the current item is
+    held in memory. Other documents are loaded as a whole, yielding
+    what iterating over them yields.
+
+    :param stream: str or file-like object
+    :raises yaml.YAMLError: on invalid YAML
+    """
+    loader = SafeLoader(stream)
+    try:
+        loader.get_event()  # stream start
+        if loader.check_event(yaml.StreamEndEvent):
+            return
+        loader.get_event()  # document start
+        anchors = {}
+        if loader.check_event(yaml.SequenceStartEvent):
+            loader.get_event()
+            while not loader.check_event(yaml.SequenceEndEvent):
+                node = _compose_node(loader, anchors)
+                yield loader.construct_document(node)
+            loader.get_event()
+            documents = None
+        else:
+            documents = loader.construct_document(_compose_node(loader, anchors))
+        loader.get_event()  # document end
+        if not loader.check_event(yaml.StreamEndEvent):
+            event = loader.get_event()
+            raise yaml.composer.ComposerError(
+                "expected a single document in the stream", None,
+                "but found another document", event.start_mark)
+        if documents is not None:
+            for item in documents:
+                yield item
+    finally:
+        loader.dispose()
+
+
+def _open_uri(uri, connection=None):
+    """
+    :param connection: optional HostConnection to the host of uri
+    :returns: stream of a local file or remote uri
+    :raises MultiProjectException: if it cannot be opened
+    """
+    stream = None
+    try:
+        if os.path.isfile(uri):
+            try:
+                stream = open(uri, 'r')
+            except IOError as ioe:
+                raise MultiProjectException(
+                    "Unable open file [%s]: %s" % (uri, ioe))
+        else:
+            try:
+                stream = open_uri_cached(uri, connection)
+            except IOError as ioe2:
+                raise MultiProjectException(
+                    "Unable to download URL [%s]: %s" % (uri, ioe2))
+    except ValueError as vae:
+        raise MultiProjectException(
+            "Is not a local file, nor a valid URL [%s] : %s" % (uri, vae))
+    if not stream:
+        raise MultiProjectException("couldn't load config uri %s" % uri)
+    return stream
+
+
 def get_yaml_from_uri(uri):
     """reads and parses yaml from a local file or remote uri"""
-    stream = None
+    stream = _open_uri(uri)
     try:
         try:
-            if os.path.isfile(uri):
-                try:
-                    stream = open(uri, 'r')
-                except IOError as ioe:
-                    raise MultiProjectException(
-                        "Unable open file [%s]: %s" % (uri, ioe))
-            else:
-                try:
-                    stream = urlopen_netrc(uri)
-                except IOError as ioe2:
-                    raise MultiProjectException(
-                        "Unable to download URL [%s]: %s" % (uri, ioe2))
-        except ValueError as vae:
-            raise MultiProjectException(
-                "Is not a local file, nor a valid URL [%s] : %s" % (uri, vae))
-        if not stream:
-            raise MultiProjectException("couldn't load config uri %s" % uri)
-        try:
-            yamldata = yaml.safe_load(stream)
+            yamldata = load_yaml(stream)
         except yaml.YAMLError as yame:
             raise MultiProjectException(
                 "Invalid multiproject yaml format in [%s]: %s" % (uri, yame))
@@ -81,12 +212,30 @@ def get_yaml_from_uri(uri):
             raise MultiProjectException(
                 "Invalid multiproject yaml format in [%s]: %s" % (uri, yamldata))
     finally:
-        if stream is not None:
-            stream.close()
+        stream.close()
     return yamldata
 
 
-def get_path_specs_from_uri(uri, config_filename=None, as_is=False):
+def iter_yaml_from_uri(uri, connection=None):
+    """
+    like get_yaml_from_uri for a yaml list, but yields the items
+    while reading, see iter_yaml_sequence
+
+    :param connection: optional HostConnection to the host of uri
+    """
+    stream = _open_uri(uri, connection)
+    try:
+        try:
+            for item in iter_yaml_sequence(stream):
+                yield item
+        except yaml.YAMLError as yame:
+            raise MultiProjectException(
+                "Invalid multiproject yaml format in [%s]: %s" % (uri, yame))
+    finally:
+        stream.close()
+
+
+def get_path_specs_from_uri(uri, config_filename=None, as_is=False, resolver=None):
     """
     Builds a list of PathSpec elements from several types of input
     locations, "uris".
@@ -98,6 +247,16 @@ def get_path_specs_from_uri(uri, config_filename=None, as_is=False):
     as other workspaces
     :param as_is: do not rewrite, used for loading the current
     workspace config without rewriting
+    :param resolver: optional IncludeResolver reading the config
+    files of other workspaces
+    """
+    return list(iter_path_specs_from_uri(uri, config_filename, as_is, resolver))
+
+
+def iter_path_specs_from_uri(uri, config_filename=None, as_is=False, resolver=None):
+    """
+    like get_path_specs_from_uri, but yields each PathSpec as soon as
+    its yaml has been parsed, for large files
     """
     if os.path.isdir(uri):
         if (config_filename is not None and
@@ -106,12 +265,9 @@ def get_path_specs_from_uri(uri, config_filename=None, as_is=False):
             uri = os.path.join(uri, config_filename)
         else:
             # plain folders returned as themselves
-            return [PathSpec(local_name=uri)]
-    yaml_spec = get_yaml_from_uri(uri)
-    if yaml_spec is None:
-        return []
-    specs = [get_path_spec_from_yaml(x) for x in yaml_spec]
-
+            yield PathSpec(local_name=uri)
+            return
+    source_dir = None
     if (config_filename is not None and
         not as_is and
         os.path.isfile(uri) and
@@ -119,8 +275,17 @@ def get_path_specs_from_uri(uri, config_filename=None, as_is=False):
 
         # treat config files and folders with such files special
         # to prevent 2 workspaces from interacting
-        specs = rewrite_included_source(specs, os.path.dirname(uri))
-    return specs
+        source_dir = os.path.dirname(uri)
+        if resolver is not None:
+            for spec in rewrite_included_source(resolver.get_path_specs(uri),
+                                                source_dir):
+                yield spec
+            return
+    for yaml_dict in iter_yaml_from_uri(uri):
+        spec = get_path_spec_from_yaml(yaml_dict)
+        if source_dir is not None:
+            spec = rewrite_included_source([spec], source_dir)[0]
+        yield spec
 
 
 def rewrite_included_source(source_path_specs, source_dir):
@@ -144,7 +309,83 @@ def rewrite_included_source(source_path_specs, source_dir):
     return source_path_specs
 
 
-def aggregate_from_uris(config_uris, config_filename=None, allow_other_element=True):
+class IncludeResolver(object):
+    """
+    Reads the config files of other workspaces merged into a config,
+    each file once however often and by whatever path it is given.
+    The entries read are kept in a marshal file keyed on realpath,
+    mtime, size and inode of each config file, so that later runs
+    only parse included files that changed. Failures to read or write
+    that file are ignored.
+    """
+
+    def __init__(self, filename=None):
+        """
+        :param filename: path of the cache file, typically
+        INCLUDE_CACHE_FILENAME in the workspace, None to not persist
+        """
+        self.filename = filename
+        # number of config files parsed
+        self.reads = 0
+        self._entries = None
+        self._changed = False
+
+    def _get_entries(self):
+        if self._entries is None:
+            self._entries = {}
+            if self.filename is not None:
+                try:
+                    with open(self.filename, 'rb') as fhand:
+                        version, entries = marshal.load(fhand)
+                    if version == (INCLUDE_CACHE_VERSION, tuple(sys.version_info[:2])):
+                        self._entries = entries
+                except (IOError, OSError, EOFError, ValueError, TypeError):
+                    pass
+        return self._entries
+
+    def get_path_specs(self, config_path):
+        """
+        :returns: list of new PathSpecs as in config_path, not rewritten
+        :raises MultiProjectException: if config_path is invalid
+        """
+        realpath = os.path.realpath(config_path)
+        try:
+            stat_result = os.stat(realpath)
+            key = (stat_result.st_mtime, stat_result.st_size, stat_result.st_ino)
+        except OSError:
+            key = None
+        entries = self._get_entries()
+        if key is None or realpath not in entries or entries[realpath][0] != key:
+            self.reads += 1
+            specs = get_path_specs_from_uri(config_path, as_is=True)
+            rows = [(spec.get_local_name(), spec.get_path(), spec.get_scmtype(),
+                     spec.get_uri(), spec.get_version(), spec.get_tags())
+                    for spec in specs]
+            if key is None:
+                return specs
+            entries[realpath] = (key, rows)
+            self._changed = True
+        return [PathSpec(local_name=local_name, path=path, scmtype=scmtype,
+                         uri=uri, version=version,
+                         tags=list(tags) if tags is not None else None)
+                for (local_name, path, scmtype, uri, version, tags)
+                in entries[realpath][1]]
+
+    def save(self):
+        """writes the cache file if files were parsed"""
+        if self.filename is None or not self._changed:
+            return
+        try:
+            write_atomically(self.filename, marshal.dumps(
+                ((INCLUDE_CACHE_VERSION, tuple(sys.version_info[:2])),
+                 self._entries)))
+            self._changed = False
+        except (IOError, OSError, ValueError):
+            pass
+
+
+def aggregate_from_uris(config_uris, config_filename=None, allow_other_element=True,
+                        resolver=None):
     """
     Builds a List of PathSpec from a list of location strings (uri,
     paths). If locations is a folder, attempts to find config_filename
@@ -157,26 +398,131 @@ def aggregate_from_uris(config_uris, config_filename=None, allow_other_element=T
     :param config_filename: file to use when given a folder
     :param allow_other_element: if False, discards elements
     to be added without SCM information
+    :param resolver: optional IncludeResolver reading the config
+    files of other workspaces
+    """
+    return list(iter_aggregate_from_uris(config_uris, config_filename,
+                                         allow_other_element, resolver))
+
+
+def iter_aggregate_from_uris(config_uris, config_filename=None, allow_other_element=True,
+                             resolver=None):
+    """
+    like aggregate_from_uris, but yields each PathSpec as soon as it
+    has been parsed, so that large files need not be held in memory.
+    Remote uris are downloaded and parsed concurrently meanwhile, see
+    _RemoteSpecsLoader, the order of PathSpecs stays the same.
     """
-    aggregate_source_yaml = []
     # build up a merged list of config elements from all given config_uris
     if config_uris is None:
-        return []
+        return
+    config_uris = list(config_uris)
+    loader = None
+    if len(config_uris) > 1:
+        loader = _RemoteSpecsLoader(
+            [uri for uri in config_uris if _is_remote_uri(uri)])
     for loop_uri in config_uris:
-        source_path_specs = get_path_specs_from_uri(
-            loop_uri, config_filename)
+        if loader is not None and loader.has_uri(loop_uri):
+            specs = loader.get_path_specs(loop_uri)
+        else:
+            specs = iter_path_specs_from_uri(loop_uri, config_filename,
+                                             resolver=resolver)
         # allow duplicates, dealt with in Config class
-        if not allow_other_element:
-            for spec in source_path_specs:
-                if not spec.get_scmtype():
-                    raise MultiProjectException(
-                        "Forbidden non-SCM element: %s (%s)" %
-                        (spec.get_local_name(), spec.get_legacy_type()))
-        aggregate_source_yaml.extend(source_path_specs)
-    return aggregate_source_yaml
+        for spec in specs:
+            if not allow_other_element and not spec.get_scmtype():
+                raise MultiProjectException(
+                    "Forbidden non-SCM element: %s (%s)" %
+                    (spec.get_local_name(), spec.get_legacy_type()))
+            yield spec
+
+
+def _is_remote_uri(uri):
+    return is_http_uri(uri) and not os.path.exists(uri)
+
+
+class _RemoteSpecsLoader(object):
+    """
+    Downloads and parses remote uris in background threads, one per
+    host fetching the uris of that host in turn over one connection.
+    get_path_specs waits for a uri, and raises the error it failed
+    with, so errors surface in the order of the uris as well.
+    """
+
+    def __init__(self, uris):
+        self._results = {}
+        self._done = {}
+        self._returned = set()
+        uris_by_host = {}
+        hosts = []
+        for uri in uris:
+            if uri in self._done:
+                continue
+            self._done[uri] = threading.Event()
+            host = get_host_key(uri)
+            if host not in uris_by_host:
+                uris_by_host[host] = []
+                hosts.append(host)
+            uris_by_host[host].append(uri)
+        for host in hosts:
+            thread = threading.Thread(target=self._load_host,
+                                      args=(host, uris_by_host[host]))
+            # do not block exit on Control-C
+            thread.daemon = True
+            thread.start()
+
+    def _load_host(self, host, uris):
+        connection = HostConnection(*host)
+        try:
+            for uri in uris:
+                try:
+                    self._results[uri] = (
+                        [get_path_spec_from_yaml(yaml_dict)
+                         for yaml_dict in iter_yaml_from_uri(uri, connection)],
+                        None)
+                except Exception as exc:
+                    self._results[uri] = (None, exc)
+                self._done[uri].set()
+        finally:
+            connection.close()
+
+    def has_uri(self, uri):
+        return uri in self._done
+
+    def get_path_specs(self, uri):
+        """
+        :returns: list of PathSpec of uri, copies when a duplicate
+        uri asks for them again
+        :raises: what loading uri raised
+        """
+        self._done[uri].wait()
+        specs, exc = self._results[uri]
+        if exc is not None:
+            raise exc
+        if uri in self._returned:
+            return [copy.deepcopy(spec) for spec in specs]
+        self._returned.add(uri)
+        return specs
+
+
+def _freeze(value):
+    """
+    :returns: hashable equivalent of yaml value, lists become tuples
+    and dicts frozensets of items
+    """
+    if isinstance(value, dict):
+        return frozenset([(key, _freeze(val)) for key, val in value.items()])
+    if isinstance(value, (list, tuple)):
+        return tuple([_freeze(val) for val in value])
+    return value
+
 
+class PathSpec(object):
+
+    # no per instance dict, workspaces may have thousands of entries
+    __slots__ = ('_local_name', '_path', '_uri', '_curr_uri', '_version',
+                 '_curr_version', '_scmtype', '_tags', '_revision',
+                 '_currevision', '_remote_revision', '_key')
 
-class PathSpec:
     def __init__(self,
                  # localname is used as ID, currently also is used as path
                  local_name,
@@ -214,6 +560,8 @@ class PathSpec:
         self._revision = revision
         self._currevision = currevision
         self._remote_revision = remote_revision
+        # hashable snapshot of all values, see get_key
+        self._key = None
 
     def __str__(self):
         return str(self.get_legacy_yaml())
@@ -223,16 +571,39 @@ class PathSpec:
 
     def __eq__(self, other):
         if isinstance(other, self.__class__):
-            return self.__dict__ == other.__dict__
+            return self.get_key() == other.get_key()
         else:
             return False
 
     def __ne__(self, other):
         return not self.__eq__(other)
 
+    def __hash__(self):
+        return hash(self.get_key())
+
+    def get_key(self):
+        """
+        :returns: tuple of all values, cached until changed through
+        a method of this class
+        """
+        if self._key is None:
+            self._key = (self._local_name,
+                         self._path,
+                         self._uri,
+                         self._curr_uri,
+                         self._version,
+                         self._curr_version,
+                         self._scmtype,
+                         _freeze(self._tags),
+                         self._revision,
+                         self._currevision,
+                         self._remote_revision)
+        return self._key
+
     def detach_vcs_info(self):
         """if wrapper has VCS information, remove it to make it a plain folder"""
         if self._scmtype is not None:
+            self._key = None
             self._scmtype = None
             self._uri = None
             self._version = None
@@ -299,12 +670,14 @@ class PathSpec:
         return self._local_name
 
     def set_local_name(self, local_name):
+        self._key = None
         self._local_name = local_name
 
     def get_path(self):
         return self._path
 
     def set_path(self, path):
+        self._key = None
         self._path = path
 
     def get_tags(self):
@@ -405,6 +778,7 @@ def generate_config_yaml(config, filename, header, pretty=False,
                          exact=False, vcs_only=False):
     """
     Writes file filename with header first and then the config as YAML.
+    The file is replaced atomically.
 
     :param config: The configuration containing all the entries to be included
     in the generated YAML.
@@ -443,16 +817,15 @@ def generate_config_yaml(config, filename, header, pretty=False,
 
     if items:
         if pretty:
-            content += yaml.safe_dump(items, allow_unicode=True,
-                                      default_flow_style=False)
+            content += dump_yaml(items, allow_unicode=True,
+                                 default_flow_style=False)
         else:
-            content += yaml.safe_dump(items, default_flow_style=None)
+            content += dump_yaml(items, default_flow_style=None)
 
     if filename:
         config_filepath = filename if os.path.isabs(filename) else \
             os.path.realpath(os.path.join(config.get_base_path(), filename))
 
-        with open(config_filepath, 'w+b') as f:
-            f.write(content.encode('UTF-8'))
+        write_atomically(config_filepath, content.encode('UTF-8'))
     else:
         print(content)
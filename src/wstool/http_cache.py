@@ -0,0 +1,349 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+On-disk cache for remote config files, e.g. a distro rosinstall
+fetched by wstool init or merge. Cached files are revalidated with
+conditional requests using their ETag and Last-Modified headers, and
+can be used without any request in offline mode or while younger
+than a maximum age.
+
+The cache is stored in $XDG_CACHE_HOME/wstool/http unless
+WSTOOL_HTTP_CACHE names another directory; an empty WSTOOL_HTTP_CACHE
+disables it. WSTOOL_HTTP_MAX_AGE (seconds) and WSTOOL_OFFLINE=1
+provide defaults for the --max-age and --offline options.
+"""
+
+import hashlib
+import io
+import json
+import os
+import socket
+import threading
+import time
+try:
+    from urllib2 import Request, HTTPError, urlopen
+    from urllib import getproxies, proxy_bypass
+    from urlparse import urlparse
+    from httplib import HTTPConnection, HTTPSConnection, HTTPException
+except ImportError:
+    from urllib.request import Request, urlopen, getproxies, proxy_bypass
+    from urllib.error import HTTPError
+    from urllib.parse import urlparse
+    from http.client import HTTPConnection, HTTPSConnection, HTTPException
+
+from vcstools.common import urlopen_netrc
+
+from wstool.common import write_atomically
+
+
+def get_default_cache_dir():
+    """
+    :returns: cache directory from the environment, None if disabled
+    """
+    if 'WSTOOL_HTTP_CACHE' in os.environ:
+        return os.environ['WSTOOL_HTTP_CACHE'].strip() or None
+    cache_home = os.environ.get('XDG_CACHE_HOME') or \
+        os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(cache_home, 'wstool', 'http')
+
+
+class HttpCache(object):
+    """
+    Caches the bodies of http(s) responses by uri. Thread-safe, and
+    safe for concurrent processes sharing the directory as entries
+    are replaced atomically.
+    """
+
+    GLOBAL_CACHE = None
+
+    @staticmethod
+    def get_cache():
+        """
+        :returns: the global HttpCache, configured from the
+        environment on first use, None if caching is disabled
+        """
+        if HttpCache.GLOBAL_CACHE is None:
+            directory = get_default_cache_dir()
+            if directory is None:
+                return None
+            max_age = os.environ.get('WSTOOL_HTTP_MAX_AGE')
+            HttpCache.GLOBAL_CACHE = HttpCache(
+                directory,
+                max_age=float(max_age) if max_age else None,
+                offline=os.environ.get('WSTOOL_OFFLINE', '') not in ['', '0'])
+        return HttpCache.GLOBAL_CACHE
+
+    @staticmethod
+    def set_cache(cache):
+        HttpCache.GLOBAL_CACHE = cache
+
+    def __init__(self, directory, max_age=None, offline=False):
+        """
+        :param directory: where to store entries, created when needed
+        :param max_age: seconds a cached entry is used without
+        revalidation, None to always revalidate
+        :param offline: use cached entries only, never send requests
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.offline = offline
+        # counters for tests and diagnostics
+        self.hits = 0
+        self.revalidations = 0
+        self.downloads = 0
+        self._lock = threading.Lock()
+
+    def _get_paths(self, uri):
+        digest = hashlib.sha1(uri.encode('utf-8')).hexdigest()
+        base = os.path.join(self.directory, digest)
+        return base + '.json', base + '.data'
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def get_entry(self, uri):
+        """
+        :returns: (metadata dict, body bytes) or None if not cached
+        """
+        meta_path, data_path = self._get_paths(uri)
+        try:
+            with open(meta_path, 'r') as fhand:
+                meta = json.load(fhand)
+            with open(data_path, 'rb') as fhand:
+                data = fhand.read()
+        except (IOError, OSError, ValueError):
+            return None
+        if meta.get('uri') != uri or meta.get('size') != len(data):
+            # hash collision, or body replaced while reading
+            return None
+        return meta, data
+
+    def put_entry(self, uri, data, etag=None, last_modified=None):
+        """
+        stores data for uri with its validators, data first so that
+        readers never see metadata of a missing body
+        """
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        write_atomically(self._get_paths(uri)[1], data)
+        self._put_meta(uri, len(data), etag, last_modified)
+
+    def _put_meta(self, uri, size, etag, last_modified):
+        meta = {'uri': uri,
+                'etag': etag,
+                'last_modified': last_modified,
+                'size': size,
+                'fetched': time.time()}
+        write_atomically(self._get_paths(uri)[0], json.dumps(meta).encode('utf-8'))
+
+    def _is_fresh(self, meta):
+        if self.offline:
+            return True
+        if self.max_age is None:
+            return False
+        return time.time() - meta.get('fetched', 0) < self.max_age
+
+    def fetch(self, uri, connection=None):
+        """
+        :param connection: optional HostConnection to the host of uri
+        :returns: body of uri as bytes, from the cache if it is
+        fresh or the server confirms it did not change
+        :raises IOError: if uri cannot be downloaded, or is not
+        cached in offline mode
+        """
+        entry = self.get_entry(uri)
+        if entry is not None and self._is_fresh(entry[0]):
+            self._count('hits')
+            return entry[1]
+        if self.offline:
+            raise IOError("Not in cache and offline: %s" % uri)
+        headers = {}
+        if entry is not None:
+            meta = entry[0]
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        status = None
+        if connection is not None:
+            result = connection.get(uri, headers)
+            # anything else, e.g. redirects, is left to urlopen
+            if result is not None and result[0] in [200, 304]:
+                status, response_headers, data = result
+        if status is None:
+            status, response_headers, data = _urlopen(uri, headers)
+        if status == 304 and entry is not None:
+            self._count('revalidations')
+            meta = entry[0]
+            try:
+                # restarts max_age
+                self._put_meta(uri, len(entry[1]),
+                               response_headers.get('ETag') or meta.get('etag'),
+                               meta.get('last_modified'))
+            except (IOError, OSError):
+                pass
+            return entry[1]
+        self._count('downloads')
+        try:
+            self.put_entry(uri, data,
+                           etag=response_headers.get('ETag'),
+                           last_modified=response_headers.get('Last-Modified'))
+        except (IOError, OSError):
+            # caching is optional, e.g. read-only home
+            pass
+        return data
+
+    def open(self, uri, connection=None):
+        """
+        :returns: binary stream of the body of uri, see fetch
+        """
+        return io.BytesIO(self.fetch(uri, connection))
+
+
+def _urlopen(uri, headers):
+    """
+    :returns: (status, headers, body) of a GET request, status 304
+    if headers hold conditions the resource still matches
+    :raises: IOError and urlopen errors
+    """
+    try:
+        response = urlopen(Request(uri, headers=headers))
+    except HTTPError as hte:
+        if hte.code == 304:
+            return 304, hte.headers, None
+        if hte.code != 401:
+            raise
+        # netrc credentials, without conditional headers
+        response = urlopen_netrc(uri)
+    try:
+        return 200, response.info(), response.read()
+    finally:
+        response.close()
+
+
+def is_http_uri(uri):
+    return uri.lower().startswith(('http://', 'https://'))
+
+
+def get_host_key(uri):
+    """
+    :returns: (scheme, netloc) of an http(s) uri, uris with equal
+    keys can share a HostConnection
+    """
+    parsed = urlparse(uri)
+    return parsed.scheme.lower(), parsed.netloc.lower()
+
+
+class HostConnection(object):
+    """
+    Persistent HTTP/1.1 connection to one host, to fetch several uris
+    from it without a new TCP and TLS handshake each. Not thread-safe,
+    meant to be used by one thread fetching the uris of its host in
+    turn. Hosts reached through a proxy are left to urlopen.
+    """
+
+    def __init__(self, scheme, netloc, timeout=60):
+        self.scheme = scheme
+        self.netloc = netloc
+        self.timeout = timeout
+        self.connects = 0
+        self._connection = None
+
+    def _connect(self):
+        parsed = urlparse('%s://%s' % (self.scheme, self.netloc))
+        if self.scheme == 'https':
+            connection_class = HTTPSConnection
+        else:
+            connection_class = HTTPConnection
+        self._connection = connection_class(parsed.hostname, parsed.port,
+                                            timeout=self.timeout)
+        self.connects += 1
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def get(self, uri, headers=None):
+        """
+        :returns: (status, headers, body), None if uri is to be opened
+        with urlopen instead, e.g. behind a proxy or when the request
+        failed, so that urlopen reports the error
+        """
+        parsed = urlparse(uri)
+        if (get_host_key(uri) != (self.scheme, self.netloc) or
+                parsed.username is not None or
+                (self.scheme in getproxies() and not proxy_bypass(parsed.hostname))):
+            return None
+        path = parsed.path or '/'
+        if parsed.query:
+            path += '?' + parsed.query
+        request_headers = {'Accept-Encoding': 'identity'}
+        request_headers.update(headers or {})
+        # a kept alive connection may have been closed by the server
+        for attempt in range(2):
+            if self._connection is None:
+                self._connect()
+            try:
+                self._connection.request('GET', path, headers=request_headers)
+                response = self._connection.getresponse()
+                body = response.read()
+            except (HTTPException, socket.error):
+                self.close()
+                continue
+            if response.will_close:
+                self.close()
+            return response.status, response.msg, body
+        return None
+
+
+def open_uri_cached(uri, connection=None):
+    """
+    opens uri using the global HttpCache for http(s) uris, if enabled
+
+    :param connection: optional HostConnection to the host of uri
+    :returns: binary stream as urlopen_netrc
+    :raises: IOError and urlopen errors
+    """
+    if not is_http_uri(uri):
+        return urlopen_netrc(uri)
+    cache = HttpCache.get_cache()
+    if cache is not None:
+        return cache.open(uri, connection)
+    if connection is not None:
+        result = connection.get(uri)
+        if result is not None and result[0] == 200:
+            return io.BytesIO(result[2])
+    return urlopen_netrc(uri)
@@ -41,9 +41,9 @@ from optparse import OptionParser, IndentedHelpFormatter
 
 from wstool.cli_common import get_info_list, get_info_table, \
     get_info_table_raw_csv, ONLY_OPTION_VALID_ATTRS
-from wstool.common import samefile, select_element, select_elements, \
+from wstool.common import samefile, select_elements, \
     MultiProjectException, normalize_uri, string_diff
-from wstool.config_yaml import PathSpec, get_path_spec_from_yaml
+from wstool.config_yaml import PathSpec, get_path_spec_from_yaml, load_yaml, dump_yaml
 import wstool.multiproject_cmd as multiproject_cmd
 from wstool.ui import Ui
 
@@ -120,6 +120,72 @@ def _get_mode_from_options(parser, options):
     return mode
 
 
+def _get_num_threads(parser, jobs):
+    """
+    :param jobs: value of the -j option, a number or 'auto'
+    :returns: int or 'auto', as accepted by DistributedWork
+    """
+    if jobs == 'auto':
+        return jobs
+    try:
+        return int(jobs)
+    except ValueError:
+        parser.error("Invalid number of parallel jobs '%s', use a number or 'auto'" % jobs)
+
+
+def _get_scm_limits(parser, value):
+    """
+    :param value: value of the --max-per-scm option, e.g. 'svn=2,bzr=1'
+    :returns: dict {scmtype: limit}, as accepted by DistributedWork
+    """
+    limits = {}
+    if not value:
+        return limits
+    for item in value.split(','):
+        try:
+            scmtype, limit = item.split('=')
+            limits[scmtype.strip()] = int(limit)
+        except ValueError:
+            parser.error("Invalid --max-per-scm value '%s', use e.g. svn=2,bzr=1" % value)
+        if limits[scmtype.strip()] < 1:
+            parser.error("Invalid --max-per-scm value '%s', limits must be positive" % value)
+    return limits
+
+
+def _get_host_limit(parser, value):
+    """
+    :param value: value of the --max-per-host option
+    :returns: positive int or None
+    """
+    if value is not None and value < 1:
+        parser.error("Invalid --max-per-host value %s, must be positive" % value)
+    return value
+
+
+def _get_retries(parser, value):
+    """
+    :param value: value of the --retries option
+    :returns: int >= 0
+    """
+    if value < 0:
+        parser.error("Invalid --retries value %s, must not be negative" % value)
+    return value
+
+
+def _print_timed_out(output):
+    sys.stderr.write("[%s] timed out\n" % output['entry'].get_local_name())
+
+
+def _get_deadline(parser, value):
+    """
+    :param value: value of the --deadline option
+    :returns: positive float or None
+    """
+    if value is not None and value <= 0:
+        parser.error("Invalid --deadline value %s, must be positive" % value)
+    return value
+
+
 def _get_element_diff(new_path_spec, config_old, extra_verbose=False):
     """
     :returns: a string telling what changed for element compared to old config
@@ -130,8 +196,7 @@ def _get_element_diff(new_path_spec, config_old, extra_verbose=False):
     if extra_verbose:
         old_element = None
         if config_old is not None:
-            old_element = select_element(config_old.get_config_elements(),
-                                         new_path_spec.get_local_name())
+            old_element = config_old.select_element(new_path_spec.get_local_name())
 
         if old_element is None:
             if new_path_spec.get_scmtype() is not None:
@@ -204,6 +269,17 @@ def prompt_merge(target_path,
         raise MultiProjectException(msg)
     local_names_old = [x.get_local_name() for x in config.get_config_elements()]
 
+    # load and check the incoming elements once, so that changing the
+    # merge strategy only merges them into another clone of config
+    incoming_specs = list(multiproject_cmd.iter_uris_path_specs(
+        config,
+        additional_uris,
+        config_filename=None,
+        allow_other_element=allow_other_element))
+    incoming_specs.extend(additional_specs)
+    incoming = [(path_spec, config.create_element(path_spec))
+                for path_spec in incoming_specs]
+
     extra_verbose = confirmed or confirm
     abort = False
     last_merge_strategy = None
@@ -211,22 +287,14 @@ def prompt_merge(target_path,
 
         if (last_merge_strategy is None
             or last_merge_strategy != merge_strategy):
-            if not config_filename:
-                # should never happen right now with rosinstall/rosws/wstool
-                # TODO Need a better way to work with clones of original config
-                raise ValueError('Cannot merge when no config filename is set')
-            newconfig = multiproject_cmd.get_config(
-                target_path,
-                additional_uris=[],
-                config_filename=config_filename)
-            config_actions = multiproject_cmd.add_uris(
-                config=newconfig,
-                additional_uris=additional_uris,
-                config_filename=None,
-                merge_strategy=merge_strategy,
-                allow_other_element=allow_other_element)
-            for path_spec in additional_specs:
-                action = newconfig.add_path_spec(path_spec, merge_strategy)
+            newconfig = config.clone()
+            config_actions = {}
+            for path_spec, created in incoming:
+                action = None
+                if created is not None:
+                    action = newconfig.insert_element(created[0],
+                                                      merge_strategy,
+                                                      realpath=created[1])
                 config_actions[path_spec.get_local_name()] = (action, path_spec)
             last_merge_strategy = merge_strategy
 
@@ -424,7 +492,18 @@ $ %(prog)s init ~/fuerte /opt/ros/fuerte
                           help="Continue despite checkout errors",
                           action="store_true")
         parser.add_option("-j", "--parallel", dest="jobs", default=1,
-                          help="How many parallel threads to use for installing",
+                          help="How many parallel threads to use for installing, or 'auto'",
+                          action="store")
+        parser.add_option("--max-per-scm", dest="max_per_scm", default=None,
+                          help="Limit parallel threads per SCM type, e.g. svn=2,bzr=1",
+                          action="store")
+        parser.add_option("--max-per-host", dest="max_per_host", default=None,
+                          type="int",
+                          help="Limit parallel threads fetching from the same remote host",
+                          action="store")
+        parser.add_option("--retries", dest="retries", default=0,
+                          type="int",
+                          help="How often to retry a failed checkout or update, with increasing delays",
                           action="store")
         parser.add_option("--shallow", dest="shallow", default=False,
                           help="Checkout only latest revision if possible",
@@ -477,7 +556,10 @@ $ %(prog)s init ~/fuerte /opt/ros/fuerte
             config,
             robust=False,
             shallow=options.shallow,
-            num_threads=int(options.jobs))
+            num_threads=_get_num_threads(parser, options.jobs),
+            scm_limits=_get_scm_limits(parser, options.max_per_scm),
+            host_limit=_get_host_limit(parser, options.max_per_host),
+            retries=_get_retries(parser, options.retries))
 
         if not install_success:
             print("Warning: installation encountered errors, but --continue-on-error was requested.  Look above for warnings.")
@@ -546,7 +628,7 @@ $ roslocate info robot_model | %(prog)s merge -
         if config_uris[0] == '-':
             pipedata = "".join(sys.stdin.readlines())
             try:
-                yamldicts = yaml.safe_load(pipedata)
+                yamldicts = load_yaml(pipedata)
             except yaml.YAMLError as e:
                 raise MultiProjectException(
                     "Invalid yaml format: \n%s \n%s" % (pipedata, e))
@@ -597,12 +679,23 @@ $ roslocate info robot_model | %(prog)s merge -
         parser = OptionParser(usage="usage: %s diff [localname]* " % self.progname,
                               description=__MULTIPRO_CMD_DICT__["diff"],
                               epilog="See: http://www.ros.org/wiki/rosinstall for details\n")
+        parser.add_option("-j", "--parallel", dest="jobs",
+                          default='auto',
+                          help="How many parallel threads to use, or 'auto' (default)",
+                          action="store")
+        parser.add_option("--keep-order", dest="keep_order", default=False,
+                          help="print entries in config order instead of as soon as they are done",
+                          action="store_true")
+        parser.add_option("--deadline", dest="deadline", default=None,
+                          help="How long to wait for all entries before reporting the rest as timed out [seconds]",
+                          action="store", type=float)
         # required here but used one layer above
         parser.add_option("-t", "--target-workspace", dest="workspace",
                           default=None,
                           help="which workspace to use",
                           action="store")
-        (_, args) = parser.parse_args(argv)
+        (options, args) = parser.parse_args(argv)
+        num_threads = _get_num_threads(parser, options.jobs)
 
         if config is None:
             config = multiproject_cmd.get_config(
@@ -614,20 +707,22 @@ $ roslocate info robot_model | %(prog)s merge -
                 "Config path does not match %s %s " % (config.get_base_path(),
                                                        target_path))
 
-        if len(args) > 0:
-            difflist = multiproject_cmd.cmd_diff(config, localnames=args)
-        else:
-            difflist = multiproject_cmd.cmd_diff(config)
-        alldiff = []
+        difflist = multiproject_cmd.cmd_diff_iter(config,
+                                                  localnames=args or None,
+                                                  num_threads=num_threads,
+                                                  ordered=options.keep_order,
+                                                  deadline=_get_deadline(parser, options.deadline))
+        timed_out = False
         for entrydiff in difflist:
-            if entrydiff['diff'] is not None and entrydiff['diff'] != '':
-                alldiff.append(entrydiff['diff'])
-        result = '\n'.join(alldiff)
-        # result has no newline at end
-        if result:
-            print(result)
+            if entrydiff.get('timed_out'):
+                _print_timed_out(entrydiff)
+                timed_out = True
+            elif entrydiff['diff'] is not None and entrydiff['diff'] != '':
+                # diffs have no newline at end
+                print(entrydiff['diff'])
+                sys.stdout.flush()
 
-        return False
+        return 1 if timed_out else False
 
     def cmd_foreach(self, target_path, argv, config=None):
         """Run shell commands in each repository."""
@@ -670,12 +765,18 @@ $ %(progname)s foreach --git 'git status'
                           action="store", type=float)
         parser.add_option("-j", "--parallel", dest="jobs",
                           default=1,
-                          help="How many parallel threads to use for running the custom commands",
+                          help="How many parallel threads to use for running the custom commands, or 'auto'",
                           action="store")
         parser.add_option("-v", "--verbose", dest="verbose",
                           default=False,
                           help="Whether to print out more information",
                           action="store_true")
+        parser.add_option("--keep-order", dest="keep_order", default=False,
+                          help="print entries in config order instead of as soon as they are done",
+                          action="store_true")
+        parser.add_option("--deadline", dest="deadline", default=None,
+                          help="How long to wait for all entries before reporting the rest as timed out [seconds]",
+                          action="store", type=float)
         # -t option required here for help but used one layer above
         # see cli_common
         parser.add_option("-t", "--target-workspace", dest="workspace",
@@ -719,21 +820,30 @@ $ %(progname)s foreach --git 'git status'
                                         (config.get_base_path(), target_path))
 
         # run shell command
-        outputs = multiproject_cmd.cmd_foreach(config,
-                                               command=command,
-                                               localnames=localnames,
-                                               num_threads=int(options.jobs),
-                                               timeout=options.timeout,
-                                               scm_types=scm_types,
-                                               shell=options.shell,
-                                               verbose=options.verbose)
+        outputs = multiproject_cmd.cmd_foreach_iter(
+            config,
+            command=command,
+            localnames=localnames,
+            num_threads=_get_num_threads(parser, options.jobs),
+            timeout=options.timeout,
+            scm_types=scm_types,
+            shell=options.shell,
+            verbose=options.verbose,
+            ordered=options.keep_order,
+            deadline=_get_deadline(parser, options.deadline))
 
         def add_localname_prefix(localname, lines):
             return ['[%s] %s' % (localname, line) for line in lines]
 
+        returncodes = []
         for output in outputs:
+            if output.get('timed_out'):
+                _print_timed_out(output)
+                returncodes.append(None)
+                continue
             localname = output['entry'].get_local_name()
             rc = output['returncode']
+            returncodes.append(rc)
             if options.show_stdout:
                 if output['stdout'] is None:
                     continue
@@ -741,6 +851,7 @@ $ %(progname)s foreach --git 'git status'
                 lines = add_localname_prefix(localname, lines)
                 sys.stdout.write('\n'.join(lines))
                 sys.stdout.write('\n')
+                sys.stdout.flush()
             if options.show_stderr:
                 lines = []
                 if output['stderr'] is not None:
@@ -752,7 +863,7 @@ $ %(progname)s foreach --git 'git status'
                 lines = add_localname_prefix(localname, lines)
                 sys.stderr.write('\n'.join(lines))
                 sys.stderr.write('\n')
-        return 0 if all([o['returncode'] == 0  for o in outputs]) else 1
+        return 0 if all([rc == 0 for rc in returncodes]) else 1
 
     def cmd_status(self, target_path, argv, config=None):
         parser = OptionParser(usage="usage: %s status [localname]* " % self.progname,
@@ -763,12 +874,23 @@ $ %(progname)s foreach --git 'git status'
                           default=False,
                           help="Also shows untracked files",
                           action="store_true")
+        parser.add_option("-j", "--parallel", dest="jobs",
+                          default='auto',
+                          help="How many parallel threads to use, or 'auto' (default)",
+                          action="store")
+        parser.add_option("--keep-order", dest="keep_order", default=False,
+                          help="print entries in config order instead of as soon as they are done",
+                          action="store_true")
+        parser.add_option("--deadline", dest="deadline", default=None,
+                          help="How long to wait for all entries before reporting the rest as timed out [seconds]",
+                          action="store", type=float)
         # -t option required here for help but used one layer above, see cli_common
         parser.add_option("-t", "--target-workspace", dest="workspace",
                           default=None,
                           help="which workspace to use",
                           action="store")
         (options, args) = parser.parse_args(argv)
+        num_threads = _get_num_threads(parser, options.jobs)
 
         if config is None:
             config = multiproject_cmd.get_config(
@@ -780,19 +902,21 @@ $ %(progname)s foreach --git 'git status'
                 "Config path does not match %s %s " % (config.get_base_path(),
                                                        target_path))
 
-        if len(args) > 0:
-            statuslist = multiproject_cmd.cmd_status(config,
-                                                     localnames=args,
-                                                     untracked=options.untracked)
-        else:
-            statuslist = multiproject_cmd.cmd_status(config,
-                                                     untracked=options.untracked)
-        allstatus = []
+        statuslist = multiproject_cmd.cmd_status_iter(config,
+                                                      localnames=args or None,
+                                                      untracked=options.untracked,
+                                                      num_threads=num_threads,
+                                                      ordered=options.keep_order,
+                                                      deadline=_get_deadline(parser, options.deadline))
+        timed_out = False
         for entrystatus in statuslist:
-            if entrystatus['status'] is not None:
-                allstatus.append(entrystatus['status'])
-        print(''.join(allstatus), end='')
-        return 0
+            if entrystatus.get('timed_out'):
+                _print_timed_out(entrystatus)
+                timed_out = True
+            elif entrystatus['status'] is not None:
+                print(entrystatus['status'], end='')
+                sys.stdout.flush()
+        return 1 if timed_out else 0
 
     def cmd_set(self, target_path, argv, config=None):
         """
@@ -895,7 +1019,7 @@ $ %(progname)s set robot_model --version-new robot_model-1.7.1
         if len(args) == 0:
             parser.error("Must provide a localname")
 
-        element = select_element(config.get_config_elements(), args[0])
+        element = config.select_element(args[0])
 
         uri = None
         if len(args) == 2:
@@ -1032,8 +1156,22 @@ $ %(progname)s update robot_model geometry
                           action="store", type=float)
         parser.add_option("-j", "--parallel", dest="jobs",
                           default=1,
-                          help="How many parallel threads to use for installing",
+                          help="How many parallel threads to use for installing, or 'auto'",
+                          action="store")
+        parser.add_option("--max-per-scm", dest="max_per_scm", default=None,
+                          help="Limit parallel threads per SCM type, e.g. svn=2,bzr=1",
                           action="store")
+        parser.add_option("--max-per-host", dest="max_per_host", default=None,
+                          type="int",
+                          help="Limit parallel threads fetching from the same remote host",
+                          action="store")
+        parser.add_option("--retries", dest="retries", default=0,
+                          type="int",
+                          help="How often to retry a failed checkout or update, with increasing delays",
+                          action="store")
+        parser.add_option("--deadline", dest="deadline", default=None,
+                          help="How long to wait for all entries before aborting the rest [seconds]",
+                          action="store", type=float)
         parser.add_option("-v", "--verbose", dest="verbose",
                           default=False,
                           help="Whether to print out more information",
@@ -1066,7 +1204,11 @@ $ %(progname)s update robot_model geometry
                 backup_path=options.backup_changed,
                 mode=mode,
                 robust=options.robust,
-                num_threads=int(options.jobs),
+                num_threads=_get_num_threads(parser, options.jobs),
+                scm_limits=_get_scm_limits(parser, options.max_per_scm),
+                host_limit=_get_host_limit(parser, options.max_per_host),
+                deadline=_get_deadline(parser, options.deadline),
+                retries=_get_retries(parser, options.retries),
                 timeout=options.timeout,
                 verbose=options.verbose)
             if install_success or options.robust:
@@ -1186,6 +1328,7 @@ The Status (S) column shows
  L  for uncommited (local) changes
  V  for difference in version and/or remote URI
  C  for difference in local and remote versions
+ T  for timed out, see --deadline
 
 The 'Version-Spec' column shows what tag, branch or revision was given
 in the .rosinstall file. The 'UID' column shows the unique ID of the
@@ -1246,7 +1389,16 @@ $ %(prog)s info --only=path,cur_uri,cur_revision robot_model geometry
             "-m", "--managed-only", dest="unmanaged", default=True,
             help="only show managed elements",
             action="store_false")
+        parser.add_option(
+            "-j", "--parallel", dest="jobs", default='auto',
+            help="How many parallel threads to use, or 'auto' (default)",
+            action="store")
+        parser.add_option(
+            "--deadline", dest="deadline", default=None,
+            help="How long to wait for all entries before showing the rest as timed out [seconds]",
+            action="store", type=float)
         (options, args) = parser.parse_args(argv)
+        num_threads = _get_num_threads(parser, options.jobs)
 
         if config is None:
             config = multiproject_cmd.get_config(
@@ -1279,14 +1431,16 @@ $ %(prog)s info --only=path,cur_uri,cur_revision robot_model geometry
             # but that command was not implemented.
             source_aggregate = multiproject_cmd.cmd_snapshot(config,
                                                              localnames=args)
-            print(yaml.safe_dump(source_aggregate, default_flow_style=None), end='')
+            print(dump_yaml(source_aggregate, default_flow_style=None), end='')
             return 0
 
         # this call takes long, as it invokes scms.
         outputs = multiproject_cmd.cmd_info(config,
                                             localnames=args,
                                             untracked=options.untracked,
-                                            fetch=options.fetch)
+                                            fetch=options.fetch,
+                                            num_threads=num_threads,
+                                            deadline=_get_deadline(parser, options.deadline))
         if args and len(args) == 1:
             # if only one element selected, print just one line
             print(get_info_list(config.get_base_path(),
@@ -1309,7 +1463,8 @@ $ %(prog)s info --only=path,cur_uri,cur_revision robot_model geometry
            print("\n%s" % table)
 
         if options.unmanaged:
-            outputs2 = multiproject_cmd.cmd_find_unmanaged_repos(config)
+            outputs2 = multiproject_cmd.cmd_find_unmanaged_repos(
+                config, num_threads=num_threads)
             table2 = get_info_table(config.get_base_path(),
                                    outputs2,
                                    options.data_only,
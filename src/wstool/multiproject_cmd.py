@@ -47,11 +47,14 @@ import sys
 import os
 import shlex
 from wstool.common import MultiProjectException, DistributedWork, \
-    select_elements, normabspath
-from wstool.config import Config, realpath_relation
+    DurationStore, ResultRecord, select_elements, normabspath, DURATIONS_FILENAME
+from wstool.config import Config, ConfigCache, CONFIG_CACHE_FILENAME, \
+    realpath_relation
 from wstool.config_elements import AVCSConfigElement
-from wstool.config_yaml import aggregate_from_uris, generate_config_yaml, \
-    get_path_specs_from_uri, PathSpec
+from wstool.config_yaml import iter_aggregate_from_uris, generate_config_yaml, \
+    iter_path_specs_from_uri, PathSpec, \
+    IncludeResolver, INCLUDE_CACHE_FILENAME
+from wstool.tracing import timed, traced
 
 import vcstools
 import vcstools.__version__
@@ -63,6 +66,30 @@ from vcstools.bzr import BzrClient
 from vcstools.svn import SvnClient
 
 
+class StatusResult(ResultRecord):
+    """Result of cmd_status for one element"""
+    __slots__ = ('status',)
+
+
+class DiffResult(ResultRecord):
+    """Result of cmd_diff for one element"""
+    __slots__ = ('diff',)
+
+
+class ForeachResult(ResultRecord):
+    """Result of cmd_foreach for one element"""
+    __slots__ = ('returncode', 'stdout', 'stderr')
+
+
+class InfoResult(ResultRecord):
+    """Result of cmd_info and cmd_find_unmanaged_repos for one element"""
+    __slots__ = ('scm', 'exists', 'localname', 'path', 'uri', 'curr_uri',
+                 'version', 'curr_version', 'remote_revision',
+                 'default_remote_label', 'curr_version_label',
+                 'specversion', 'actualversion', 'modified', 'properties')
+
+
+@timed('get_config')
 def get_config(basepath,
                additional_uris=None,
                config_filename=None,
@@ -92,19 +119,34 @@ def get_config(basepath,
     # print("source...........................", path_specs)
 
     ## Generate the config class with the uri and path
+    config = None
     if (config_filename is not None
         and basepath is not None
         and os.path.isfile(os.path.join(basepath, config_filename))):
 
-        base_path_specs = get_path_specs_from_uri(os.path.join(basepath,
-                                                               config_filename),
-                                                  as_is=True)
-    else:
-        base_path_specs = []
-
-    config = Config(base_path_specs, basepath,
-                    config_filename=config_filename,
-                    merge_strategy=merge_strategy)
+        config_path = os.path.join(basepath, config_filename)
+        cache = ConfigCache(os.path.join(basepath, CONFIG_CACHE_FILENAME))
+        base_path_specs = cache.load(config_path)
+        parsed_specs = None
+        if base_path_specs is None:
+            # parsed while added to the config, for large files
+            parsed_specs = []
+
+            def collect_specs(path_specs):
+                for path_spec in path_specs:
+                    parsed_specs.append(path_spec)
+                    yield path_spec
+            base_path_specs = collect_specs(
+                iter_path_specs_from_uri(config_path, as_is=True))
+        config = Config(base_path_specs, basepath,
+                        config_filename=config_filename,
+                        merge_strategy=merge_strategy)
+        if parsed_specs is not None:
+            cache.save(config_path, parsed_specs)
+    if config is None:
+        config = Config([], basepath,
+                        config_filename=config_filename,
+                        merge_strategy=merge_strategy)
 
     add_uris(config=config,
              additional_uris=additional_uris,
@@ -138,8 +180,26 @@ def add_uris(config,
     if config is None:
         raise MultiProjectException("Need to provide a Config.")
 
+    actions = {}
+    for path_spec in iter_uris_path_specs(config, additional_uris,
+                                          config_filename,
+                                          allow_other_element):
+        action = config.add_path_spec(path_spec, merge_strategy)
+        actions[path_spec.get_local_name()] = (action, path_spec)
+    return actions
+
+
+def iter_uris_path_specs(config,
+                         additional_uris,
+                         config_filename=None,
+                         allow_other_element=True):
+    """
+    yields the PathSpecs add_uris merges into config, e.g. to merge
+    them into clones of config without loading the uris again, see
+    add_uris for the parameters
+    """
     if not additional_uris:
-        return {}
+        return
 
     if config_filename is None:
         added_uris = additional_uris
@@ -165,16 +225,16 @@ def add_uris(config,
                 continue
             added_uris.append(uri)
 
-    actions = {}
     if len(added_uris) > 0:
-        path_specs = aggregate_from_uris(added_uris,
-                                         config_filename,
-                                         allow_other_element)
-        for path_spec in path_specs:
-            action = config.add_path_spec(path_spec, merge_strategy)
-            actions[path_spec.get_local_name()] = (action, path_spec)
-
-    return actions
+        # other workspaces are parsed once, and again only when changed
+        resolver = IncludeResolver(
+            os.path.join(config.get_base_path(), INCLUDE_CACHE_FILENAME))
+        for path_spec in iter_aggregate_from_uris(added_uris,
+                                                  config_filename,
+                                                  allow_other_element,
+                                                  resolver):
+            yield path_spec
+        resolver.save()
 
 
 def cmd_persist_config(config, filename, header=None,
@@ -205,16 +265,40 @@ Bzr:       %s
        prettyversion(vcstools.BzrClient.get_environment_metadata()))
 
 
-def cmd_status(config, localnames=None, untracked=False):
+def cmd_status(config, localnames=None, untracked=False, num_threads='auto',
+               backend='thread', deadline=None):
     """
     calls SCM status for all SCM entries in config, relative to path
 
     :returns: List of dict {element: ConfigElement, diff: diffstring}
     :param untracked: also show files not added to the SCM
+    :param num_threads: number of parallel workers or 'auto'
+    :param backend: DistributedWork backend, e.g. 'asyncio'
+    :param deadline: seconds after which remaining entries are
+    reported with 'timed_out': True instead of a status
     :raises MultiProjectException: on plenty of errors
     """
+    return list(cmd_status_iter(config, localnames, untracked,
+                                num_threads=num_threads, ordered=True,
+                                backend=backend, deadline=deadline))
+
+
+def cmd_status_iter(config, localnames=None, untracked=False,
+                    num_threads='auto', ordered=False, backend='thread',
+                    deadline=None):
+    """
+    like cmd_status, but returns a generator yielding each result
+    as soon as it is available
+
+    :param ordered: if True, yield in config order, else in order of completion
+    """
     class StatusRetriever():
 
+        phase = 'status'
+        result_class = StatusResult
+        # only runs SCM commands, see wstool.async_engine
+        replay_commands = True
+
         def __init__(self, element, path, untracked):
             self.element = element
             self.path = path
@@ -224,6 +308,9 @@ def cmd_status(config, localnames=None, untracked=False):
             path_spec = self.element.get_path_spec()
             scmtype = path_spec.get_scmtype()
             status = self.element.get_status(self.path, self.untracked)
+            return {'status': self.align_status(scmtype, status)}
+
+        def align_status(self, scmtype, status):
             # align other scm output to svn
             columns = -1
             if scmtype == "git":
@@ -239,29 +326,52 @@ def cmd_status(config, localnames=None, untracked=False):
                                                    line[:columns].ljust(8),
                                                    line[columns:])
                 status = status_aligned
-            return {'status': status}
+            return status
 
     path = config.get_base_path()
     # call SCM info in separate threads
     elements = config.get_config_elements()
-    work = DistributedWork(capacity=len(elements), num_threads=-1)
+    work = DistributedWork(capacity=len(elements), num_threads=num_threads,
+                           backend=backend, deadline=deadline)
     elements = select_elements(config, localnames)
     for element in elements:
         if element.is_vcs_element():
             work.add_thread(StatusRetriever(element, path, untracked))
-    outputs = work.run()
-    return outputs
+    return work.run_iter(ordered=ordered)
 
 
-def cmd_diff(config, localnames=None):
+def cmd_diff(config, localnames=None, num_threads='auto', backend='thread',
+             deadline=None):
     """
     calls SCM diff for all SCM entries in config, relative to path
 
     :returns: List of dict {element: ConfigElement, diff: diffstring}
+    :param num_threads: number of parallel workers or 'auto'
+    :param backend: DistributedWork backend, e.g. 'asyncio'
+    :param deadline: seconds after which remaining entries are
+    reported with 'timed_out': True instead of a diff
     :raises MultiProjectException: on plenty of errors
     """
+    return list(cmd_diff_iter(config, localnames,
+                              num_threads=num_threads, ordered=True,
+                              backend=backend, deadline=deadline))
+
+
+def cmd_diff_iter(config, localnames=None, num_threads='auto', ordered=False,
+                  backend='thread', deadline=None):
+    """
+    like cmd_diff, but returns a generator yielding each result
+    as soon as it is available
+
+    :param ordered: if True, yield in config order, else in order of completion
+    """
     class DiffRetriever():
 
+        phase = 'diff'
+        result_class = DiffResult
+        # only runs SCM commands, see wstool.async_engine
+        replay_commands = True
+
         def __init__(self, element, path):
             self.element = element
             self.path = path
@@ -271,13 +381,13 @@ def cmd_diff(config, localnames=None):
 
     path = config.get_base_path()
     elements = config.get_config_elements()
-    work = DistributedWork(capacity=len(elements), num_threads=-1)
+    work = DistributedWork(capacity=len(elements), num_threads=num_threads,
+                           backend=backend, deadline=deadline)
     elements = select_elements(config, localnames)
     for element in elements:
         if element.is_vcs_element():
             work.add_thread(DiffRetriever(element, path))
-    outputs = work.run()
-    return outputs
+    return work.run_iter(ordered=ordered)
 
 
 def cmd_foreach(
@@ -288,10 +398,52 @@ def cmd_foreach(
     timeout=None,
     scm_types=None,
     shell=False,
-    verbose=False):
+    verbose=False,
+    deadline=None):
     """Run command in all SCM entries in config, relative to path"""
+    return list(cmd_foreach_iter(config, command, localnames,
+                                 num_threads=num_threads,
+                                 timeout=timeout,
+                                 scm_types=scm_types,
+                                 shell=shell,
+                                 verbose=verbose,
+                                 ordered=True,
+                                 deadline=deadline))
+
+
+def _get_duration_store(config, operation):
+    """
+    :returns: DurationStore for operation in the workspace of config
+    """
+    return DurationStore(os.path.join(config.get_base_path(), DURATIONS_FILENAME),
+                         operation)
+
+
+def cmd_foreach_iter(
+    config,
+    command,
+    localnames=None,
+    num_threads=1,
+    timeout=None,
+    scm_types=None,
+    shell=False,
+    verbose=False,
+    ordered=False,
+    deadline=None):
+    """
+    like cmd_foreach, but returns a generator yielding each result
+    as soon as it is available
+
+    :param ordered: if True, yield in config order, else in order of completion
+    :param deadline: seconds after which remaining entries are
+    reported with 'timed_out': True instead of command results
+    """
 
     class ForeachRetriever(object):
+
+        phase = 'foreach'
+        result_class = ForeachResult
+
         def __init__(self, element, command, timeout, shell, verbose):
             self.element = element
             self.command = command
@@ -315,7 +467,9 @@ def cmd_foreach(
 
     elements = select_elements(config, localnames)
     work = DistributedWork(capacity=len(elements),
-                           num_threads=num_threads)
+                           num_threads=num_threads,
+                           duration_store=_get_duration_store(config, 'foreach'),
+                           deadline=deadline)
     for element in elements:
         if ((scm_types is not None) and
                 (element.get_vcs_type_name() not in scm_types)):
@@ -325,8 +479,7 @@ def cmd_foreach(
                                          timeout,
                                          shell,
                                          verbose))
-    outputs = work.run()
-    return outputs
+    return work.run_iter(ordered=ordered)
 
 
 def cmd_install_or_update(
@@ -338,7 +491,11 @@ def cmd_install_or_update(
     num_threads=1,
     timeout=None,
     verbose=False,
-    shallow=False):
+    shallow=False,
+    scm_limits=None,
+    host_limit=None,
+    deadline=None,
+    retries=0):
     """
     performs many things, generally attempting to make
     the local filesystem look like what the config specifies,
@@ -348,6 +505,10 @@ def cmd_install_or_update(
 
     :param backup_path: if and where to backup trees before deleting them
     :param robust: proceed to next element even when one element fails
+    :param scm_limits: dict {scmtype: limit} of concurrent installs per VCS type
+    :param host_limit: maximum concurrent installs from the same remote host
+    :param deadline: seconds after which unfinished installs are aborted
+    :param retries: how often to retry a failed checkout or update of an element
     :returns: True on Success
     :raises MultiProjectException: on plenty of errors
     """
@@ -362,10 +523,11 @@ def cmd_install_or_update(
         if backup_path is not None:
             abs_backup_path = os.path.join(config.get_base_path(), backup_path)
         try:
-            preparation_report = tree_el.prepare_install(
-                backup_path=abs_backup_path,
-                arg_mode=mode,
-                robust=robust)
+            with traced(tree_el.get_local_name(), 'prepare_install'):
+                preparation_report = tree_el.prepare_install(
+                    backup_path=abs_backup_path,
+                    arg_mode=mode,
+                    robust=robust)
             if preparation_report is not None:
                 if preparation_report.abort:
                     raise MultiProjectException(
@@ -391,29 +553,46 @@ def cmd_install_or_update(
         def __init__(self, report):
             self.element = report.config_element
             self.report = report
+            self.phase = 'checkout' if report.checkout else 'update'
 
         def do_work(self):
+            kwargs = {}
+            if self.report.retries:
+                # only when requested, for elements not supporting retries
+                kwargs['retries'] = self.report.retries
             self.element.install(checkout=self.report.checkout,
                                  backup=self.report.backup,
                                  backup_path=self.report.backup_path,
                                  inplace=self.report.inplace,
                                  timeout=self.report.timeout,
                                  verbose=self.report.verbose,
-                                 shallow=self.report.shallow)
+                                 shallow=self.report.shallow,
+                                 **kwargs)
             return {}
 
     work = DistributedWork(capacity=len(preparation_reports),
                            num_threads=num_threads,
-                           silent=False)
+                           silent=False,
+                           scm_limits=scm_limits,
+                           host_limit=host_limit,
+                           duration_store=_get_duration_store(config, 'install'),
+                           deadline=deadline)
     for report in preparation_reports:
         report.verbose = verbose
         report.timeout = timeout
         report.shallow = shallow
+        report.retries = retries
         thread = Installer(report)
         work.add_thread(thread)
 
     try:
-        work.run()
+        outputs = work.run()
+        timed_out = [output['entry'].get_local_name() for output in outputs
+                     if output.get('timed_out')]
+        if timed_out:
+            raise MultiProjectException(
+                "Deadline of %s seconds exceeded, timed out: %s" % (deadline,
+                                                                   ', '.join(timed_out)))
     except MultiProjectException as exc:
         print ("Exception caught during install: %s" % exc)
         success = False
@@ -450,10 +629,16 @@ def cmd_snapshot(config, localnames=None):
     return source_aggregate
 
 
-def cmd_info(config, localnames=None, untracked=False, fetch=False):
+def cmd_info(config, localnames=None, untracked=False, fetch=False,
+             num_threads='auto', backend='thread', deadline=None):
     """This function compares what should be (config_file) with what is
     (directories) and returns a list of dictionary giving each local
     path and all the state information about it available.
+
+    :param num_threads: number of parallel workers or 'auto'
+    :param backend: DistributedWork backend, e.g. 'asyncio'
+    :param deadline: seconds after which remaining entries are
+    reported from the config only, with 'timed_out': True
     """
 
     class InfoRetriever():
@@ -461,6 +646,11 @@ def cmd_info(config, localnames=None, untracked=False, fetch=False):
         Auxilliary class to perform IO-bound operations in individual threads
         """
 
+        phase = 'info'
+        result_class = InfoResult
+        # only runs SCM commands, see wstool.async_engine
+        replay_commands = True
+
         def __init__(self, element, path, untracked, fetch):
             self.element = element
             self.path = path
@@ -494,7 +684,8 @@ def cmd_info(config, localnames=None, untracked=False, fetch=False):
                     path_spec = self.element.get_path_spec()
                     version = path_spec.get_version()
                 else:
-                    path_spec = self.element.get_versioned_path_spec(fetch=fetch)
+                    with traced(localname, 'get_versioned_path_spec'):
+                        path_spec = self.element.get_versioned_path_spec(fetch=fetch)
                     version = path_spec.get_version()
                     remote_revision = path_spec.get_remote_revision()
                     curr_version_label = path_spec.get_curr_version()
@@ -504,7 +695,8 @@ def cmd_info(config, localnames=None, untracked=False, fetch=False):
                     else:
                         display_version = version
                     curr_uri = path_spec.get_curr_uri()
-                    status = self.element.get_status(self.path, self.untracked)
+                    with traced(localname, 'status'):
+                        status = self.element.get_status(self.path, self.untracked)
                     if (status is not None and
                         status.strip() != ''):
                         modified = True
@@ -538,26 +730,42 @@ def cmd_info(config, localnames=None, untracked=False, fetch=False):
     # call SCM info in separate threads
     elements = config.get_config_elements()
     elements = select_elements(config, localnames)
-    work = DistributedWork(capacity=len(elements), num_threads=-1)
+    work = DistributedWork(capacity=len(elements), num_threads=num_threads,
+                           backend=backend, deadline=deadline)
     for element in elements:
         if element.get_properties() is None or not 'setup-file' in element.get_properties():
             work.add_thread(InfoRetriever(element, path, untracked, fetch))
     outputs = work.run()
+    for output in outputs:
+        if output.get('timed_out'):
+            # what is known without invoking SCMs
+            path_spec = output['entry']
+            output.update({'scm': path_spec.get_scmtype(),
+                           'localname': path_spec.get_local_name(),
+                           'path': path_spec.get_path() or path_spec.get_local_name(),
+                           'uri': path_spec.get_uri(),
+                           'version': path_spec.get_version(),
+                           'properties': path_spec.get_tags()})
 
     return outputs
 
 
 
-def cmd_find_unmanaged_repos(config):
+def cmd_find_unmanaged_repos(config, num_threads='auto'):
     """
     Auxilliary function to find SCM folders within workspace that have not been tracked. This
     allows quicker diagnosis of the general state in a workspace, where folders can be part
     of the build even when they are not mentioned in the .rosinstall file.
     Nested SCMs are not investigated.
+
+    :param num_threads: number of parallel workers or 'auto'
     """
 
     class UnmanagedInfoRetriever():
 
+        phase = 'find_unmanaged'
+        result_class = InfoResult
+
         def __init__(self, path, localname, scm_type):
             self.path = path
             self.localname = localname
@@ -591,7 +799,7 @@ def cmd_find_unmanaged_repos(config):
                     unmanaged_paths.append((os.path.relpath(root, path), key))
                     # don't walk any other directories in this root
                     del dirs[:]
-    work = DistributedWork(capacity=len(unmanaged_paths), num_threads=-1)
+    work = DistributedWork(capacity=len(unmanaged_paths), num_threads=num_threads)
     for localname, scm_type in sorted(unmanaged_paths, key=lambda up: up[0], reverse=True):
         work.add_thread(UnmanagedInfoRetriever(path, localname, scm_type))
     outputs = work.run()
@@ -0,0 +1,423 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Instrumentation of wstool commands: a timing trace in the Chrome trace
+event format, viewable in chrome://tracing or https://ui.perfetto.dev,
+and a ledger of the subprocesses spawned.
+"""
+
+import json
+import os
+import shlex
+import subprocess
+import threading
+import time
+
+
+class Tracer(object):
+    """
+    Collects complete events, one per element and phase. Thread-safe.
+    Tracing is disabled unless a global tracer is set.
+    """
+
+    GLOBAL_TRACER = None
+
+    @staticmethod
+    def get_tracer():
+        """
+        :returns: the global Tracer, None if tracing is disabled
+        """
+        return Tracer.GLOBAL_TRACER
+
+    @staticmethod
+    def set_tracer(tracer):
+        Tracer.GLOBAL_TRACER = tracer
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.pid = os.getpid()
+        self.events = []
+        self._lock = threading.Lock()
+
+    def _get_timestamp(self, seconds):
+        # microseconds since start of tracing
+        return int((seconds - self.start_time) * 1000000)
+
+    def add_event(self, name, phase, start, end, args=None):
+        """
+        records a complete event of the current thread
+
+        :param name: what the event applies to, typically a localname
+        :param phase: category of the event, e.g. 'status' or 'checkout'
+        :param start: time.time() when the event started
+        :param end: time.time() when the event ended
+        :param args: optional dict of details, e.g. exit status
+        """
+        event = {'name': name,
+                 'cat': phase,
+                 'ph': 'X',
+                 'ts': self._get_timestamp(start),
+                 'dur': self._get_timestamp(end) - self._get_timestamp(start),
+                 'pid': self.pid,
+                 'tid': threading.current_thread().ident,
+                 'args': args or {}}
+        with self._lock:
+            self.events.append(event)
+
+    def save(self, filename):
+        with self._lock:
+            events = list(self.events)
+        with open(filename, 'w') as fhand:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fhand)
+
+
+class traced(object):
+    """
+    Context manager recording an event with the global tracer, if any.
+
+    Example::
+
+      with traced(localname, 'prepare_install'):
+          element.prepare_install()
+    """
+
+    def __init__(self, name, phase, args=None):
+        self.name = name
+        self.phase = phase
+        self.args = args
+        self.tracer = Tracer.get_tracer()
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        # not recording blocks interrupted rather than failed, e.g. by
+        # Control-C or when replayed by wstool.async_engine
+        if (self.tracer is not None and
+                (exc_type is None or issubclass(exc_type, Exception))):
+            args = dict(self.args or {})
+            args['status'] = 'ok' if exc_type is None else 'error'
+            if exc_value is not None:
+                args['error'] = str(exc_value)
+            self.tracer.add_event(self.name, self.phase, self.start, time.time(), args)
+        return False
+
+
+def get_command_name(args):
+    """
+    :param args: argv list or shell command string of a subprocess
+    :returns: program and first argument not being an option, e.g. 'git status'
+    """
+    if isinstance(args, (list, tuple)):
+        tokens = list(args)
+    else:
+        try:
+            tokens = shlex.split(args)
+        except ValueError:
+            tokens = args.split()
+    if not tokens:
+        return ''
+    words = [os.path.basename(tokens[0])]
+    for token in tokens[1:]:
+        if not token.startswith('-'):
+            words.append(token)
+            break
+    else:
+        # options only, e.g. git --version
+        words.extend(tokens[1:2])
+    return ' '.join(words)
+
+
+class CallLedger(object):
+    """
+    Records every subprocess spawned through subprocess.Popen while
+    installed, with argv, cwd, duration, returncode and output bytes.
+    The asyncio engine, which reads output itself, records its calls
+    using add_call.
+    """
+
+    GLOBAL_LEDGER = None
+
+    @staticmethod
+    def get_ledger():
+        """
+        :returns: the installed CallLedger, None if not recording
+        """
+        return CallLedger.GLOBAL_LEDGER
+
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def install(self):
+        CallLedger.GLOBAL_LEDGER = self
+        PopenHooks.add_hook(self)
+
+    def uninstall(self):
+        PopenHooks.remove_hook(self)
+        CallLedger.GLOBAL_LEDGER = None
+
+    def popen_started(self, proc):
+        pass
+
+    def popen_done(self, proc, output_bytes):
+        self.add_call(proc.hook_args, proc.hook_cwd,
+                      time.time() - proc.hook_start,
+                      proc.returncode, output_bytes)
+
+    def add_call(self, args, cwd, duration, returncode=None, output_bytes=None):
+        """
+        :param args: argv list or shell command string
+        :param duration: seconds from spawning until output was read
+        :param output_bytes: bytes read from stdout and stderr, None if unknown
+        """
+        with self._lock:
+            self.calls.append({'args': args,
+                               'cwd': cwd,
+                               'duration': duration,
+                               'returncode': returncode,
+                               'output_bytes': output_bytes})
+
+    def get_summary(self):
+        """
+        :returns: list of (command name, calls, seconds, output bytes),
+        most time consuming first
+        """
+        summary = {}
+        with self._lock:
+            calls = list(self.calls)
+        for call in calls:
+            name = get_command_name(call['args'])
+            count, seconds, output_bytes = summary.get(name, (0, 0.0, 0))
+            summary[name] = (count + 1,
+                             seconds + call['duration'],
+                             output_bytes + (call['output_bytes'] or 0))
+        return sorted([(name,) + values for name, values in summary.items()],
+                      key=lambda entry: (-entry[2], entry[0]))
+
+    def format_summary(self):
+        summary = self.get_summary()
+        lines = ["subprocess calls: %s in %.2fs, %s bytes output" % (
+            sum([entry[1] for entry in summary]),
+            sum([entry[2] for entry in summary]),
+            sum([entry[3] for entry in summary]))]
+        if summary:
+            lines.append("%6s %8s %10s  %s" % ('calls', 'seconds', 'bytes', 'command'))
+        for name, count, seconds, output_bytes in summary:
+            lines.append("%6d %8.2f %10d  %s" % (count, seconds, output_bytes, name))
+        return '\n'.join(lines)
+
+
+_Popen = subprocess.Popen
+
+
+class PopenHooks(object):
+    """
+    Hooks notified of every subprocess spawned through
+    subprocess.Popen, which is replaced by the subclass _HookedPopen
+    while any hook is registered. Hooks provide
+    popen_started(proc), called once the process was spawned, and
+    popen_done(proc, output_bytes), called once its output was read,
+    or it was waited for, with output_bytes None if unknown.
+    """
+
+    # replaced rather than modified, so that it can be read unlocked
+    _hooks = []
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_hooks():
+        return PopenHooks._hooks
+
+    @staticmethod
+    def add_hook(hook):
+        with PopenHooks._lock:
+            PopenHooks._hooks = PopenHooks._hooks + [hook]
+            subprocess.Popen = _HookedPopen
+
+    @staticmethod
+    def remove_hook(hook):
+        with PopenHooks._lock:
+            PopenHooks._hooks = [other for other in PopenHooks._hooks
+                                 if other is not hook]
+            if len(PopenHooks._hooks) == 0:
+                subprocess.Popen = _Popen
+
+
+class _HookedPopen(_Popen):
+    """
+    subprocess.Popen notifying the registered PopenHooks
+    """
+
+    def __init__(self, args, *pargs, **kwargs):
+        self.hook_start = time.time()
+        self.hook_args = args
+        self.hook_cwd = kwargs.get('cwd')
+        self._hook_done = False
+        # communicate() calls wait(), notify only once with output size
+        self._hook_communicating = False
+        _Popen.__init__(self, args, *pargs, **kwargs)
+        for hook in PopenHooks.get_hooks():
+            hook.popen_started(self)
+
+    def _notify_done(self, output_bytes):
+        if self._hook_done:
+            return
+        self._hook_done = True
+        for hook in PopenHooks.get_hooks():
+            hook.popen_done(self, output_bytes)
+
+    def communicate(self, *args, **kwargs):
+        self._hook_communicating = True
+        try:
+            stdout, stderr = _Popen.communicate(self, *args, **kwargs)
+        finally:
+            self._hook_communicating = False
+        self._notify_done(len(stdout or b'') + len(stderr or b''))
+        return stdout, stderr
+
+    def wait(self, *args, **kwargs):
+        returncode = _Popen.wait(self, *args, **kwargs)
+        if not self._hook_communicating:
+            self._notify_done(None)
+        return returncode
+
+
+class PhaseTimers(object):
+    """
+    Accumulates wall time per phase of a command, e.g. get_config,
+    when a global instance is set, as done by wstool --profile.
+    """
+
+    GLOBAL_TIMERS = None
+
+    @staticmethod
+    def get_timers():
+        """
+        :returns: the global PhaseTimers, None if not timing
+        """
+        return PhaseTimers.GLOBAL_TIMERS
+
+    @staticmethod
+    def set_timers(timers):
+        PhaseTimers.GLOBAL_TIMERS = timers
+
+    def __init__(self):
+        # phase names in order of first use
+        self.phases = []
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds):
+        with self._lock:
+            if phase not in self.durations:
+                self.phases.append(phase)
+                self.durations[phase] = 0.0
+            self.durations[phase] += seconds
+
+    def format_summary(self):
+        with self._lock:
+            return '\n'.join(["%-28s %8.3fs" % (phase, self.durations[phase])
+                              for phase in self.phases])
+
+
+# stack of timed blocks entered in the current thread
+_timed_blocks = threading.local()
+
+
+class timed(object):
+    """
+    Adds the time spent to a phase of the global PhaseTimers, if any.
+    Time spent in a timed block nested in the same thread is only
+    added to the phase of the nested block.
+    Usable as context manager or as function decorator.
+    """
+
+    def __init__(self, phase):
+        self.phase = phase
+        self.start = None
+        # seconds spent in nested blocks
+        self.nested = 0.0
+
+    def __enter__(self):
+        self.start = time.time()
+        self.nested = 0.0
+        if not hasattr(_timed_blocks, 'stack'):
+            _timed_blocks.stack = []
+        _timed_blocks.stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_tb):
+        duration = time.time() - self.start
+        stack = _timed_blocks.stack
+        stack.pop()
+        if stack:
+            stack[-1].nested += duration
+        timers = PhaseTimers.get_timers()
+        if timers is not None:
+            timers.add(self.phase, duration - self.nested)
+        return False
+
+    def __call__(self, function):
+        phase = self.phase
+
+        def timed_function(*args, **kwargs):
+            with timed(phase):
+                return function(*args, **kwargs)
+        timed_function.__name__ = function.__name__
+        timed_function.__doc__ = function.__doc__
+        return timed_function
+
+
+def timed_iter(iterable, phase):
+    """
+    Generator yielding from iterable, adding the time spent producing
+    items to phase, but not the time the consumer spends on them.
+    """
+    iterator = iter(iterable)
+    try:
+        while True:
+            with timed(phase):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+    finally:
+        # let generators clean up when the consumer stops early
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            close()
@@ -37,10 +37,26 @@ Official usage:
 
 %(prog)s will try to infer install path from context
 
+Global options:
+  --trace FILE  write per element timings in Chrome trace format to FILE
+  --stats       print a summary of the subprocesses run, per command
+  --profile[=FILE]
+                profile the command, print the most expensive functions
+                or write pstats to FILE. Only the main thread is profiled,
+                use -j 1 to include the work on elements.
+  --offline     use cached copies of remote config files, never download
+  --max-age SECONDS
+                use cached copies of remote config files younger than
+                SECONDS without revalidating them with the server
+
 Type '%(prog)s help' for usage.
 """
 
 from __future__ import print_function
+import time
+# start of importing wstool and its dependencies, see --profile
+_IMPORT_START = time.time()
+
 import os
 import sys
 
@@ -52,6 +68,8 @@ import wstool.__version__
 
 from wstool.helpers import ROSINSTALL_FILENAME
 from wstool.common import MultiProjectException
+from wstool.http_cache import HttpCache
+from wstool.tracing import CallLedger, PhaseTimers, Tracer
 from wstool.multiproject_cli import MultiprojectCLI, \
     __MULTIPRO_CMD_DICT__, __MULTIPRO_CMD_ALIASES__, \
     __MULTIPRO_CMD_HELP_LIST__, IndentedHelpFormatterWithNL, \
@@ -60,6 +78,8 @@ from wstool.multiproject_cli import MultiprojectCLI, \
 ## This file adds or extends commands from multiproject_cli where ROS
 ## specific output has to be generated.
 
+_IMPORT_DURATION = time.time() - _IMPORT_START
+
 
 _PROGNAME = 'wstool'
 
@@ -87,6 +107,96 @@ class WstoolCLI(MultiprojectCLI):
             config_generator=config_generator)
 
 
+def _pop_option_value(argv, option):
+    """
+    removes '--option VALUE' or '--option=VALUE' from argv
+
+    :returns: VALUE, None if option is not in argv
+    """
+    for index, arg in enumerate(argv):
+        if arg == option and index + 1 < len(argv):
+            value = argv[index + 1]
+            del argv[index:index + 2]
+            return value
+        if arg.startswith(option + '='):
+            del argv[index]
+            return arg[len(option) + 1:]
+    return None
+
+
+def _pop_profile_option(argv):
+    """
+    removes '--profile' or '--profile=FILE' from argv
+
+    :returns: (found, FILE or None)
+    """
+    for index, arg in enumerate(argv):
+        if arg == '--profile':
+            del argv[index]
+            return True, None
+        if arg.startswith('--profile='):
+            del argv[index]
+            return True, arg[len('--profile='):]
+    return False, None
+
+
+def _get_sampling_profiler():
+    """
+    :returns: a pyinstrument Profiler if installed, else None
+    """
+    try:
+        from pyinstrument import Profiler
+    except ImportError:
+        return None
+    return Profiler()
+
+
+def _run_profiled(argv, usage, filename):
+    """
+    runs wstool_main under a sampling profiler if available and no
+    filename is given, else under cProfile, then prints the profile
+    and phase timers to stderr, or writes pstats to filename
+    """
+    timers = PhaseTimers()
+    timers.add('import', _IMPORT_DURATION)
+    PhaseTimers.set_timers(timers)
+    profiler = None
+    if filename is None:
+        profiler = _get_sampling_profiler()
+    if profiler is None:
+        import cProfile
+        profiler = cProfile.Profile()
+    sampling = hasattr(profiler, 'output_text')
+    start = time.time()
+    if sampling:
+        profiler.start()
+    else:
+        profiler.enable()
+    try:
+        return wstool_main(argv, usage)
+    finally:
+        if sampling:
+            profiler.stop()
+        else:
+            profiler.disable()
+        PhaseTimers.set_timers(None)
+        total = time.time() - start
+        timers.add('output rendering and other',
+                   total - sum([seconds for phase, seconds in timers.durations.items()
+                                if phase != 'import']))
+        timers.add('total', total)
+        if sampling:
+            sys.stderr.write(profiler.output_text())
+        elif filename is not None:
+            profiler.dump_stats(filename)
+            sys.stderr.write("profile written to %s\n" % filename)
+        else:
+            import pstats
+            stats = pstats.Stats(profiler, stream=sys.stderr)
+            stats.sort_stats('cumulative').print_stats(30)
+        sys.stderr.write(timers.format_summary() + '\n')
+
+
 def wstool_main(argv=None, usage=None):
     """
     Calls the function corresponding to the first argument.
@@ -98,6 +208,52 @@ def wstool_main(argv=None, usage=None):
         argv = sys.argv
     if (sys.argv[0] == '-c'):
         sys.argv = [_PROGNAME] + sys.argv[1:]
+    profile, profile_filename = _pop_profile_option(argv)
+    if profile:
+        return _run_profiled(argv, usage, profile_filename)
+    if '--stats' in argv:
+        argv.remove('--stats')
+        ledger = CallLedger()
+        ledger.install()
+        try:
+            return wstool_main(argv, usage)
+        finally:
+            ledger.uninstall()
+            sys.stderr.write(ledger.format_summary() + '\n')
+    offline = '--offline' in argv
+    max_age = _pop_option_value(argv, '--max-age')
+    if offline or max_age is not None:
+        if offline:
+            argv.remove('--offline')
+        cache = HttpCache.get_cache()
+        if cache is None:
+            sys.stderr.write("--offline and --max-age need the http cache, "
+                             "disabled by WSTOOL_HTTP_CACHE\n")
+            return 1
+        saved = (cache.offline, cache.max_age)
+        try:
+            if max_age is not None:
+                try:
+                    cache.max_age = float(max_age)
+                except ValueError:
+                    sys.stderr.write("Invalid --max-age: %s\n" % max_age)
+                    return 1
+            cache.offline = cache.offline or offline
+            return wstool_main(argv, usage)
+        finally:
+            cache.offline, cache.max_age = saved
+    trace_filename = _pop_option_value(argv, '--trace')
+    if trace_filename is not None:
+        Tracer.set_tracer(Tracer())
+        try:
+            return wstool_main(argv, usage)
+        finally:
+            Tracer.get_tracer().save(trace_filename)
+            Tracer.set_tracer(None)
+    return _wstool_main(argv, usage)
+
+
+def _wstool_main(argv, usage):
     if '--version' in argv:
         print("%s: \t%s\n%s" % (_PROGNAME,
                                 wstool.__version__.version,
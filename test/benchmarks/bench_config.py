@@ -0,0 +1,83 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measures building a Config of many scm elements and selecting 50 of
+them, and counts the calls to os.path.realpath, which used to be made
+for every pair of elements.
+
+Usage: PYTHONPATH=src python test/benchmarks/bench_config.py [ELEMENTS]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+
+from wstool.common import select_elements
+from wstool.config import Config
+from wstool.config_yaml import PathSpec
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 2000
+    path_specs = [PathSpec('src/group%d/repo%d' % (i % 50, i), 'git',
+                           'https://example.org/repo%d.git' % i)
+                  for i in range(count)]
+    realpath = os.path.realpath
+    calls = [0]
+
+    def counting_realpath(path, *args, **kwargs):
+        calls[0] += 1
+        return realpath(path, *args, **kwargs)
+    os.path.realpath = counting_realpath
+    try:
+        start = time.time()
+        config = Config(path_specs, '/tmp/bench_config_workspace')
+        duration = time.time() - start
+        print("%d elements in %.3fs, %d realpath calls" % (
+            len(config.get_config_elements()), duration, calls[0]))
+        localnames = [path_spec.get_local_name()
+                      for path_spec in path_specs[::max(1, count // 50)]]
+        calls[0] = 0
+        start = time.time()
+        selected = select_elements(config, localnames)
+        duration = time.time() - start
+        print("selected %d elements in %.3fs, %d realpath calls" % (
+            len(selected), duration, calls[0]))
+    finally:
+        os.path.realpath = realpath
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,105 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measures the wall time of DistributedWork when expensive jobs sit at
+the end of the config, in config order and ordered by durations
+recorded in a DurationStore during a previous run.
+
+Usage: PYTHONPATH=src python test/benchmarks/bench_durations.py [JOBS [SLOTS]]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+
+from wstool.common import DistributedWork, DurationStore, DURATIONS_FILENAME
+
+
+class SleepElement(object):
+    def __init__(self, name):
+        self.name = name
+
+    def get_path_spec(self):
+        return self
+
+    def get_local_name(self):
+        return self.name
+
+
+class SleepWorker(object):
+    def __init__(self, name, seconds):
+        self.element = SleepElement(name)
+        self.seconds = seconds
+
+    def do_work(self):
+        time.sleep(self.seconds)
+        return {}
+
+
+def timed_run(durations, slots, duration_store):
+    work = DistributedWork(len(durations), num_threads=slots,
+                           duration_store=duration_store)
+    for i, seconds in enumerate(durations):
+        work.add_thread(SleepWorker(str(i), seconds))
+    start = time.time()
+    work.run()
+    return time.time() - start
+
+
+def main(argv):
+    jobs = int(argv[1]) if len(argv) > 1 else 40
+    slots = int(argv[2]) if len(argv) > 2 else 4
+    random.seed(42)
+    # mostly small repositories, a huge one at the end
+    durations = [random.uniform(0.01, 0.1) for _ in range(jobs - 1)] + [1.0]
+    print("%d jobs on %d slots, ideal %.2fs" % (jobs, slots,
+                                                max(max(durations), sum(durations) / slots)))
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, DURATIONS_FILENAME)
+        first = timed_run(durations, slots, DurationStore(filename, 'bench'))
+        print("config order:    %6.2fs" % first)
+        second = timed_run(durations, slots, DurationStore(filename, 'bench'))
+        print("longest first:   %6.2fs" % second)
+        print("speedup:         %6.2fx" % (first / second))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,132 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measures reading several remote rosinstall files from slow local HTTP
+servers, one after another compared to aggregate_from_uris, which
+fetches them concurrently, one keep-alive connection per host.
+
+Usage: PYTHONPATH=src python test/benchmarks/bench_fetch.py [LATENCY]
+"""
+
+from __future__ import print_function
+import os
+import sys
+import threading
+import time
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+# measure the network, not the download cache
+os.environ['WSTOOL_HTTP_CACHE'] = ''
+
+from wstool.config_yaml import aggregate_from_uris, iter_path_specs_from_uri
+
+HOSTS = 2
+URIS_PER_HOST = 4
+ENTRIES = 200
+
+
+class SlowServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """
+    delays each connection (handshake) and each response by latency
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        time.sleep(self.server.latency)
+        BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+        time.sleep(self.server.latency)
+        name = self.path.strip('/')
+        body = ''.join(["- git: {local-name: %s/repo%d, uri: 'https://example.org/repo%d.git'}\n"
+                        % (name, index, index)
+                        for index in range(ENTRIES)]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def load_sequentially(uris):
+    specs = []
+    for uri in uris:
+        specs.extend(iter_path_specs_from_uri(uri))
+    return specs
+
+
+def main(argv):
+    latency = float(argv[1]) if len(argv) > 1 else 0.1
+    servers = []
+    uris = []
+    for _ in range(HOSTS):
+        server = SlowServer(('127.0.0.1', 0), SlowHandler)
+        server.latency = latency
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        servers.append(server)
+    for index in range(URIS_PER_HOST):
+        for server in servers:
+            uris.append('http://127.0.0.1:%s/file%d' % (server.server_address[1], index))
+    try:
+        results = []
+        for function in [load_sequentially, aggregate_from_uris]:
+            start = time.time()
+            specs = function(uris)
+            results.append([spec.get_local_name() for spec in specs])
+            print("%-20s %8.3fs" % (function.__name__, time.time() - start))
+        assert results[0] == results[1]
+        print("%d uris on %d hosts, %.3fs latency per connection and request"
+              % (len(uris), HOSTS, latency))
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == '__main__':
+    main(sys.argv)
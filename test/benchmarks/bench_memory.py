@@ -0,0 +1,111 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measures the memory held by path specs and info results of a large
+workspace, comparing the slotted PathSpec and InfoResult with
+equivalent instances keeping their attributes in a dict.
+
+Usage: PYTHONPATH=src python test/benchmarks/bench_memory.py [ELEMENTS]
+"""
+
+from __future__ import print_function
+import sys
+import tracemalloc
+
+from wstool.config_yaml import PathSpec
+from wstool.multiproject_cmd import InfoResult
+
+
+class DictPathSpec(object):
+    """holds the same attributes as PathSpec in a per instance dict"""
+
+    def __init__(self, local_name, scmtype, uri, version):
+        self._local_name = local_name
+        self._path = local_name
+        self._uri = uri
+        self._curr_uri = None
+        self._version = version
+        self._curr_version = None
+        self._scmtype = scmtype
+        self._tags = []
+        self._revision = None
+        self._currevision = None
+        self._remote_revision = None
+        self._key = None
+
+
+def get_info(index):
+    return {'scm': 'git',
+            'exists': True,
+            'localname': 'src/repo%d' % index,
+            'path': '/ws/src/repo%d' % index,
+            'uri': 'https://example.org/repo%d.git' % index,
+            'curr_uri': 'https://example.org/repo%d.git' % index,
+            'version': 'master',
+            'remote_revision': '',
+            'default_remote_label': None,
+            'curr_version_label': 'master',
+            'specversion': '',
+            'actualversion': '',
+            'modified': False,
+            'properties': []}
+
+
+def measure(create, count):
+    # values shared by both variants are created beforehand
+    infos = [get_info(i) for i in range(count)]
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    objects = [create(i, infos[i]) for i in range(count)]
+    size = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    del objects
+    return size
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 5000
+    variants = [
+        ('PathSpec with dict', lambda i, info: DictPathSpec(info['localname'], 'git', info['uri'], 'master')),
+        ('PathSpec with slots', lambda i, info: PathSpec(info['localname'], 'git', info['uri'], 'master')),
+        ('info result dict', lambda i, info: dict(info)),
+        ('InfoResult', lambda i, info: InfoResult(info)),
+    ]
+    for name, create in variants:
+        size = measure(create, count)
+        print("%-20s %8d bytes per element" % (name, size // count))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,116 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Measures DistributedWork throughput with many short jobs, compared
+to the former scheduler that polled workers using join(1).
+
+Usage: PYTHONPATH=src python test/benchmarks/bench_scheduler.py [JOBS [SLOTS]]
+"""
+
+from __future__ import print_function
+import sys
+import time
+import random
+
+from wstool.common import DistributedWork, WorkerThread
+
+
+class SleepElement(object):
+    def __init__(self, name):
+        self.name = name
+
+    def get_path_spec(self):
+        return self
+
+    def get_local_name(self):
+        return self.name
+
+
+class SleepWorker(object):
+    def __init__(self, name, seconds):
+        self.element = SleepElement(name)
+        self.seconds = seconds
+
+    def do_work(self):
+        time.sleep(self.seconds)
+        return {}
+
+
+def legacy_run(threads, maxthreads):
+    """the scheduling loop of DistributedWork before it waited for events"""
+    waiting_index = 0
+    running_threads = []
+    missing_threads = list(threads)
+    while len(missing_threads) > 0:
+        if len(running_threads) < maxthreads:
+            to_index = min(waiting_index + maxthreads - len(running_threads),
+                           len(threads))
+            for i in range(waiting_index, to_index):
+                threads[i].start()
+                running_threads.append(threads[i])
+            waiting_index = to_index
+        missing_threads = [t for t in missing_threads
+                           if t.ident is None or t.is_alive()]
+        running_threads = [t for t in running_threads if t.is_alive()]
+        for thread in running_threads:
+            thread.join(1)
+
+
+def main(argv):
+    jobs = int(argv[1]) if len(argv) > 1 else 200
+    slots = int(argv[2]) if len(argv) > 2 else 8
+    random.seed(42)
+    durations = [random.uniform(0.01, 0.3) for _ in range(jobs)]
+    ideal = sum(durations) / slots
+    print("%d jobs of 0.01-0.3s on %d slots, ideal %.2fs" % (jobs, slots, ideal))
+
+    outputs = [None] * jobs
+    threads = [WorkerThread(SleepWorker(str(i), d), outputs, i)
+               for i, d in enumerate(durations)]
+    start = time.time()
+    legacy_run(threads, slots)
+    legacy = time.time() - start
+    print("join(1) polling:  %6.2fs  %6.1f jobs/s" % (legacy, jobs / legacy))
+
+    work = DistributedWork(jobs, num_threads=slots)
+    for i, d in enumerate(durations):
+        work.add_thread(SleepWorker(str(i), d))
+    start = time.time()
+    work.run()
+    current = time.time() - start
+    print("event driven:     %6.2fs  %6.1f jobs/s" % (current, jobs / current))
+    print("speedup:          %6.2fx" % (legacy / current))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
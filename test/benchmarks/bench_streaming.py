@@ -0,0 +1,94 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measures peak memory while reading the PathSpecs of a large rosinstall
+file, loading the whole document compared to streaming it one element
+at a time as wstool does when building a Config.
+
+Usage: PYTHONPATH=src python test/benchmarks/bench_streaming.py [ENTRIES]
+"""
+
+from __future__ import print_function
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+
+from wstool.config_yaml import get_path_spec_from_yaml, get_yaml_from_uri, \
+    iter_path_specs_from_uri, dump_yaml
+
+
+def count_loaded(filename):
+    return len([get_path_spec_from_yaml(item) for item in get_yaml_from_uri(filename)])
+
+
+def count_streamed(filename):
+    count = 0
+    for _ in iter_path_specs_from_uri(filename):
+        count += 1
+    return count
+
+
+def measure(function, filename):
+    tracemalloc.start()
+    count = function(filename)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return count, peak
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 20000
+    directory = tempfile.mkdtemp()
+    try:
+        filename = os.path.join(directory, 'distro.rosinstall')
+        entries = [{'git': {'local-name': 'src/repo%d' % index,
+                            'uri': 'https://example.org/repo%d.git' % index,
+                            'version': 'release-%d' % index}}
+                   for index in range(count)]
+        with open(filename, 'w') as fhand:
+            fhand.write(dump_yaml(entries, default_flow_style=False))
+        del entries
+        print("%d entries, %.1f MB" % (count, os.path.getsize(filename) / 1e6))
+        for name, function in [('load whole file', count_loaded),
+                               ('streaming', count_streamed)]:
+            specs, peak = measure(function, filename)
+            print("%-16s %6d specs, peak %8.1f kB" % (name, specs, peak / 1e3))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,97 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Measures loading and writing a rosinstall file of many entries with
+the libyaml bindings used by wstool, compared to the pure Python
+implementation of PyYAML, and checks both round trip to equal data
+and identical text.
+
+Usage: PYTHONPATH=src python test/benchmarks/bench_yaml.py [ENTRIES]
+"""
+
+from __future__ import print_function
+import sys
+import time
+
+import yaml
+
+from wstool.config_yaml import SafeLoader, SafeDumper
+
+
+def get_entries(count):
+    entries = []
+    for index in range(count):
+        properties = {'local-name': 'src/group%d/repo%d' % (index % 50, index),
+                      'uri': 'https://example.org/group%d/repo%d.git' % (index % 50, index)}
+        if index % 3 == 0:
+            properties['version'] = 'release-%d.%d' % (index % 7, index % 11)
+        if index % 10 == 0:
+            properties['meta'] = {'maintainer': 'user%d' % index, 'tags': ['a', 'b']}
+        entries.append({['git', 'hg', 'svn'][index % 3]: properties})
+    return entries
+
+
+def timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time() - start
+
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 5000
+    entries = get_entries(count)
+    if SafeLoader is yaml.SafeLoader:
+        print("PyYAML built without libyaml, nothing to compare")
+        return 1
+    results = []
+    for name, loader, dumper in [('python', yaml.SafeLoader, yaml.SafeDumper),
+                                 ('libyaml', SafeLoader, SafeDumper)]:
+        text, dump_time = timed(lambda: yaml.dump(entries, Dumper=dumper,
+                                                  default_flow_style=None))
+        data, load_time = timed(lambda: yaml.load(text, Loader=loader))
+        if data != entries:
+            print("%s: round trip changed the data" % name)
+            return 1
+        print("%-8s load %6.3fs  dump %6.3fs" % (name, load_time, dump_time))
+        results.append((text, load_time, dump_time))
+    if results[0][0] != results[1][0]:
+        print("libyaml and python output differ")
+        return 1
+    print("%d entries, identical output, speedup load %.1fx dump %.1fx" % (
+        count, results[0][1] / results[1][1], results[0][2] / results[1][2]))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -36,7 +36,8 @@ import shutil
 import unittest
 
 import wstool.config
-from wstool.config import MultiProjectException, Config
+import wstool.multiproject_cmd
+from wstool.config import MultiProjectException, Config, ConfigCache, CONFIG_CACHE_FILENAME
 from wstool.config_yaml import PathSpec
 
 from . import mock_client
@@ -206,6 +207,60 @@ class ConfigSimple_Test(unittest.TestCase):
         finally:
             shutil.rmtree(root_path)
 
+    def test_config_cache(self):
+        root_path = tempfile.mkdtemp()
+        try:
+            config_path = os.path.join(root_path, '.rosinstall')
+            with open(config_path, 'w') as fhand:
+                fhand.write('- git: {local-name: foo, uri: git/uri}')
+            path_specs = [PathSpec('foo', 'git', 'git/uri', 'v1'),
+                          PathSpec('share', tags=[{'meta': {'a': 1}}])]
+            cache = ConfigCache(os.path.join(root_path, CONFIG_CACHE_FILENAME))
+            self.assertEqual(None, cache.load(config_path))
+            cache.save(config_path, path_specs)
+            self.assertEqual(path_specs, cache.load(config_path))
+            # same size, same mtime
+            stat_result = os.stat(config_path)
+            with open(config_path, 'w') as fhand:
+                fhand.write('- git: {local-name: bar, uri: git/uri}')
+            os.utime(config_path, (stat_result.st_atime, stat_result.st_mtime))
+            self.assertEqual(None, cache.load(config_path))
+            # not saved when changed since loading
+            with open(config_path, 'a') as fhand:
+                fhand.write('\n')
+            cache.save(config_path, path_specs)
+            self.assertEqual(None, ConfigCache(cache.filename).load(config_path))
+        finally:
+            shutil.rmtree(root_path)
+
+    def test_get_config_cached(self):
+        root_path = tempfile.mkdtemp()
+        try:
+            workspace = os.path.join(root_path, 'ws')
+            os.makedirs(os.path.join(workspace, 'other'))
+            os.makedirs(os.path.join(workspace, 'r'))
+            os.makedirs(os.path.join(root_path, 'elsewhere'))
+            with open(os.path.join(workspace, '.rosinstall'), 'w') as fhand:
+                fhand.write('- other: {local-name: other}\n'
+                            '- git: {local-name: r, uri: git/uri}\n')
+            config = wstool.multiproject_cmd.get_config(workspace, config_filename='.rosinstall')
+            self.assertEqual(['other', 'r'], [elt.get_local_name() for elt in config.get_config_elements()])
+            self.assertTrue(os.path.isfile(os.path.join(workspace, CONFIG_CACHE_FILENAME)))
+            config = wstool.multiproject_cmd.get_config(workspace, config_filename='.rosinstall')
+            self.assertTrue(config.get_element('r').is_vcs_element())
+            # elements are still checked against the filesystem
+            with open(os.path.join(workspace, 'other', '.rosinstall'), 'w') as fhand:
+                fhand.write('[]')
+            os.rmdir(os.path.join(workspace, 'r'))
+            os.symlink(os.path.join(root_path, 'elsewhere'), os.path.join(workspace, 'r'))
+            cache = ConfigCache(os.path.join(workspace, CONFIG_CACHE_FILENAME))
+            self.assertEqual(2, len(cache.load(os.path.join(workspace, '.rosinstall'))))
+            config = wstool.multiproject_cmd.get_config(workspace, config_filename='.rosinstall')
+            self.assertEqual(['r'], [elt.get_local_name() for elt in config.get_config_elements()])
+            self.assertEqual('r', config.select_element(os.path.join(root_path, 'elsewhere')).get_local_name())
+        finally:
+            shutil.rmtree(root_path)
+
     def test_config_merging_kill_append(self):
         git1 = PathSpec('foo', 'git', 'git/uri')
         svn1 = PathSpec('foo', 'svn', 'svn/uri')
@@ -313,6 +368,71 @@ class ConfigSimple_Test(unittest.TestCase):
         self.assertTrue(config.remove_element('foob'))
         self.assertEqual(0, len(config.get_config_elements()))
 
+    def test_get_element(self):
+        git1 = PathSpec('foo', 'git', 'git/uri', 'git.version')
+        other1 = PathSpec('bar')
+        svn1 = PathSpec('bar/baz', 'svn', 'svn/uri', '12345')
+        config = self._get_mock_config([git1, other1, svn1])
+        self.assertEqual('/install/path/foo', config.get_element('foo').get_path())
+        self.assertEqual(None, config.get_element('bam'))
+        self.assertTrue(config.remove_element('foo'))
+        self.assertEqual(None, config.get_element('foo'))
+        # replacing the parent of a scm element with a scm element fails
+        self.assertRaises(MultiProjectException, config.add_path_spec,
+                          PathSpec('bar', 'git', 'git/uri'))
+        self.assertEqual(2, len(config.get_config_elements()))
+        self.assertEqual(None, config.add_path_spec(PathSpec('bar')))
+        self.assertEqual('KillAppend', config.add_path_spec(PathSpec('bar', tags=[{'foo': 1}])))
+        self.assertEqual(['bar/baz', 'bar'],
+                         [elt.get_local_name() for elt in config.get_config_elements()])
+        self.assertTrue(config.remove_element('bar/baz'))
+        self.assertEqual('MergeReplace', config.add_path_spec(PathSpec('bar', 'git', 'git/uri')))
+        self.assertEqual('Append', config.add_path_spec(PathSpec('foo', 'git', 'git/uri')))
+        self.assertEqual(['bar', 'foo'],
+                         [elt.get_local_name() for elt in config.get_config_elements()])
+
+    def test_select_elements(self):
+        path_specs = [PathSpec('foo%d' % i, 'git', 'git/uri') for i in range(5)]
+        config = self._get_mock_config(path_specs)
+        self.assertEqual(None, config.select_element(None))
+        self.assertEqual(None, config.select_element('bar'))
+        self.assertEqual('foo2', config.select_element('foo2').get_local_name())
+        self.assertEqual('foo3', config.select_element('/install/path/../path/foo3/').get_local_name())
+        self.assertEqual(5, len(config.select_elements(None)))
+        self.assertEqual(['foo1', 'foo3', 'foo4'],
+                         [elt.get_local_name() for elt in
+                          config.select_elements(['foo4', '/install/path/foo1', 'foo3', 'foo4'])])
+        self.assertEqual(5, len(config.select_elements(['/install/path'])))
+        self.assertRaises(MultiProjectException, config.select_elements, ['foo1', 'bar'])
+        config.remove_element('foo1')
+        config.add_path_spec(PathSpec('foo1', 'git', 'git/uri'))
+        self.assertEqual(['foo0', 'foo1'],
+                         [elt.get_local_name() for elt in
+                          config.select_elements(['foo1', 'foo0'])])
+
+    def test_clone(self):
+        path_specs = [PathSpec('foo%d' % i, 'git', 'git/uri') for i in range(3)]
+        config = self._get_mock_config(path_specs)
+        clone = config.clone()
+        self.assertEqual(config.get_config_elements(), clone.get_config_elements())
+        self.assertTrue(clone.trees is config.trees)
+        # changing the clone copies its elements list and indexes
+        elem, realpath = clone.create_element(PathSpec('foo1', 'git', 'https://example.com/foo1.git'))
+        self.assertEqual('MergeReplace', clone.insert_element(elem, 'MergeReplace', realpath))
+        self.assertEqual('Append', clone.add_path_spec(PathSpec('bar', 'git', 'git/uri')))
+        self.assertEqual(['foo0', 'foo1', 'foo2', 'bar'],
+                         [elt.get_local_name() for elt in clone.get_config_elements()])
+        self.assertEqual('https://example.com/foo1.git', clone.get_element('foo1').get_path_spec().get_uri())
+        self.assertEqual(['foo0', 'foo1', 'foo2'],
+                         [elt.get_local_name() for elt in config.get_config_elements()])
+        self.assertEqual('/install/path/git/uri', config.get_element('foo1').get_path_spec().get_uri())
+        self.assertEqual(None, config.select_element('bar'))
+        # and the other way round
+        clone = config.clone()
+        self.assertTrue(config.remove_element('foo0'))
+        self.assertEqual(3, len(clone.get_config_elements()))
+        self.assertEqual('foo0', clone.select_element('/install/path/foo0').get_local_name())
+
     def test_absolute_localname(self):
         mock1 = PathSpec('/foo/bim')
         config = self._get_mock_config([mock1], install_path='/foo/bar/ba/ra/baz/bam')
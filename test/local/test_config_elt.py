@@ -33,7 +33,7 @@
 import unittest
 
 import wstool.config
-from wstool.common import MultiProjectException
+from wstool.common import DistributedWork, MultiProjectException
 from . import mock_client
 
 
@@ -72,6 +72,18 @@ class ConfigElements_Test(unittest.TestCase):
         self.assertEqual({'other': {'local-name': 'some/local/name', 'meta': {'repo-name': 'skynetish-ros-pkg'}}}, other1.get_path_spec().get_legacy_yaml())
         self.assertFalse(other1.is_vcs_element())
 
+    def test_config_element_hash(self):
+        other1 = wstool.config_elements.OtherConfigElement("some/path", "name", properties=['meta'])
+        other2 = wstool.config_elements.OtherConfigElement("some/path", "name", properties=['meta'])
+        self.assertEqual(other1, other2)
+        self.assertEqual(1, len(set([other1, other2])))
+        self.assertEqual({other1: 1}[other2], 1)
+        key = other1.get_spec_key()
+        self.assertTrue(key is other1.get_spec_key())
+        other2.version = 'foo'
+        self.assertNotEqual(other1, other2)
+        self.assertEqual(2, len(set([other1, other2])))
+
     def test_mock_vcs_config_element_init(self):
         path = "some/path"
         localname = "some/local/name"
@@ -170,3 +182,72 @@ class ConfigElements_Test(unittest.TestCase):
             self.fail("should have raised Exception")
         except MultiProjectException:
             pass
+
+    def test_mock_install_retries(self):
+        path = "some/path"
+        localname = "some/local/name"
+        uri = 'some/uri'
+
+        class FlakyVcsClient(mock_client.MockVcsClient):
+            def __init__(self, failures):
+                mock_client.MockVcsClient.__init__(self, url=uri)
+                self.failures = failures
+                self.attempts = 0
+
+            def checkout(self, *args, **kwargs):
+                self.attempts += 1
+                return self.attempts > self.failures
+
+            def update(self, *args, **kwargs):
+                self.attempts += 1
+                return self.attempts > self.failures
+
+        get_retry_delay = wstool.config_elements.get_retry_delay
+        wstool.config_elements.get_retry_delay = lambda attempt: 0
+        try:
+            for checkout in [True, False]:
+                mockclient = FlakyVcsClient(2)
+                vcsc = wstool.config_elements.AVCSConfigElement("mock", path, localname, uri, None, vcsc=mockclient)
+                vcsc.install(checkout=checkout, retries=2)
+                self.assertEqual(3, mockclient.attempts)
+                mockclient = FlakyVcsClient(2)
+                vcsc = wstool.config_elements.AVCSConfigElement("mock", path, localname, uri, None, vcsc=mockclient)
+                self.assertRaises(MultiProjectException, vcsc.install,
+                                  checkout=checkout, retries=1)
+                self.assertEqual(2, mockclient.attempts)
+        finally:
+            wstool.config_elements.get_retry_delay = get_retry_delay
+
+    def test_mock_install_cancelled(self):
+        # a worker past the deadline must stop retrying
+        uri = 'some/uri'
+
+        class FailingVcsClient(mock_client.MockVcsClient):
+            attempts = 0
+
+            def checkout(self, *args, **kwargs):
+                FailingVcsClient.attempts += 1
+                return False
+
+        class InstallThing:
+            def __init__(self, element):
+                self.element = element
+
+            def do_work(self):
+                self.element.install(retries=100)
+                return {}
+
+        get_retry_delay = wstool.config_elements.get_retry_delay
+        wstool.config_elements.get_retry_delay = lambda attempt: 0.2
+        try:
+            vcsc = wstool.config_elements.AVCSConfigElement(
+                "mock", "some/path", "some/local/name", uri, None,
+                vcsc=FailingVcsClient(url=uri))
+            work = DistributedWork(1, deadline=0.5)
+            work.add_thread(InstallThing(vcsc))
+            self.assertTrue(work.run()[0]['timed_out'])
+            work.threads[0].join(1)
+            self.assertFalse(work.threads[0].is_alive())
+            self.assertTrue(FailingVcsClient.attempts < 10)
+        finally:
+            wstool.config_elements.get_retry_delay = get_retry_delay
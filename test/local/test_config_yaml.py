@@ -35,13 +35,16 @@ import unittest
 import tempfile
 import shutil
 import subprocess
+import yaml
 
 import wstool.config_yaml
 import wstool.config
 from wstool.common import MultiProjectException
 from wstool.config_yaml import rewrite_included_source, \
     get_path_spec_from_yaml, get_yaml_from_uri, get_path_specs_from_uri, \
-    PathSpec, aggregate_from_uris, __REPOTYPES__
+    PathSpec, aggregate_from_uris, load_yaml, dump_yaml, iter_yaml_sequence, \
+    IncludeResolver, INCLUDE_CACHE_FILENAME, \
+    __REPOTYPES__
 
 _test_root = os.path.dirname(os.path.dirname(__file__))
 
@@ -101,6 +104,32 @@ class YamlIO_Test(unittest.TestCase):
 
 class ConfigElementYamlFunctions_Test(unittest.TestCase):
 
+    def test_iter_yaml_sequence(self):
+        for text in ['- git: {local-name: foo, uri: \'foo\', version: 1}\n- other: {local-name: bar}',
+                     '- &a {other: {local-name: bar, meta: [1, true, null, 2.5]}}\n- *a\n- !!str 3',
+                     '', '--- \n', '[]', 'foo', '{a: 1, b: 2}', '- [1, 2]\n- {a: b}\n...\n']:
+            expected = yaml.safe_load(text)
+            if expected is None:
+                expected = []
+            self.assertEqual(list(expected), list(iter_yaml_sequence(text)), text)
+        self.assertRaises(yaml.YAMLError, list, iter_yaml_sequence('- foo\n---\n- bar'))
+        self.assertRaises(yaml.YAMLError, list, iter_yaml_sequence('- *b'))
+        self.assertRaises(yaml.YAMLError, list, iter_yaml_sequence('- [foo'))
+        items = iter_yaml_sequence('- foo\n- bar: [1')
+        self.assertEqual('foo', next(items))
+        self.assertRaises(yaml.YAMLError, next, items)
+
+    def test_load_dump_yaml(self):
+        items = [{'git': {'local-name': 'foo', 'uri': 'https://example.org/foo.git', 'version': 'v1'}},
+                 {'other': {'local-name': 'bar: baz', 'meta': {'list': [1, None, u'\xfc']}}},
+                 {'setup-file': {'local-name': "it's \"long\" " * 20}}]
+        for options in [{'default_flow_style': None},
+                        {'default_flow_style': False, 'allow_unicode': True}]:
+            text = dump_yaml(items, **options)
+            self.assertEqual(yaml.safe_dump(items, **options), text)
+            self.assertEqual(items, load_yaml(text))
+        self.assertEqual(None, load_yaml(''))
+
     def test_rewrite_included_source(self):
         base_path = '/foo/bar'
         version = 'common_rosdeps-1.0.2'
@@ -161,6 +190,36 @@ class UriAggregationTest(unittest.TestCase):
                           config.get_config_filename(),
                           allow_other_element=False)
 
+    def test_include_resolver(self):
+        self.directory = tempfile.mkdtemp()
+        underlay = os.path.join(self.directory, 'underlay')
+        os.makedirs(underlay)
+        config_file = os.path.join(underlay, '.rosinstall')
+        with open(config_file, 'w') as fhand:
+            fhand.write("- git: {local-name: src/foo, uri: 'https://example.com/foo.git'}\n"
+                        "- other: {local-name: /opt/ros/indigo}\n")
+        uris = [underlay, config_file, underlay + '/']
+        expected = aggregate_from_uris(uris, '.rosinstall')
+        self.assertEqual(['other', 'other'],
+                         [spec.get_legacy_type() for spec in expected[:2]])
+        cache_file = os.path.join(self.directory, INCLUDE_CACHE_FILENAME)
+        resolver = IncludeResolver(cache_file)
+        specs = aggregate_from_uris(uris, '.rosinstall', resolver=resolver)
+        self.assertEqual(expected, specs)
+        # read once for all paths to it
+        self.assertEqual(1, resolver.reads)
+        resolver.save()
+
+        resolver = IncludeResolver(cache_file)
+        self.assertEqual(expected, aggregate_from_uris(uris, '.rosinstall',
+                                                       resolver=resolver))
+        self.assertEqual(0, resolver.reads)
+        with open(config_file, 'a') as fhand:
+            fhand.write("- other: {local-name: src/bar}\n")
+        specs = aggregate_from_uris(uris, '.rosinstall', resolver=resolver)
+        self.assertEqual(1, resolver.reads)
+        self.assertEqual(os.path.join(underlay, 'src/bar'), specs[2].get_local_name())
+
     def tearDown(self):
         if os.path.exists(self.directory):
             shutil.rmtree(self.directory)
@@ -299,6 +358,19 @@ class ConfigFile_Test(unittest.TestCase):
 
 class ConfigElementYamlWrapper_Test(unittest.TestCase):
 
+    def test_path_spec_hash(self):
+        spec1 = PathSpec('foo', 'git', 'git/uri', tags=[{'meta': {'a': [1, 2]}}])
+        spec2 = PathSpec('foo', 'git', 'git/uri', tags=[{'meta': {'a': [1, 2]}}])
+        self.assertEqual(spec1, spec2)
+        self.assertEqual(hash(spec1), hash(spec2))
+        self.assertEqual(1, len(set([spec1, spec2])))
+        spec2.set_local_name('bar')
+        self.assertNotEqual(spec1, spec2)
+        self.assertEqual('bar', spec2.get_key()[0])
+        spec1.detach_vcs_info()
+        self.assertEqual(None, spec1.get_key()[6])
+        self.assertEqual(PathSpec('foo', tags=[{'meta': {'a': [1, 2]}}]), spec1)
+
     def test_original_syntax_scm(self):
         # - hg: {local-name: common_rosdeps, version: common_rosdeps-1.0.2, uri: https://kforge.ros.org/common/rosdepcore}
         local_name = 'common_rosdeps'
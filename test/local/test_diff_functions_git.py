@@ -37,7 +37,9 @@ import subprocess
 from test.io_wrapper import StringIO
 
 import wstool
+import wstool.common
 import wstool.helpers
+import wstool.multiproject_cmd
 import wstool.wstool_cli
 from wstool.wstool_cli import WstoolCLI
 from wstool.wstool_cli import wstool_main
@@ -181,6 +183,22 @@ class WstoolDiffGitTest(AbstractSCMTest):
         cli = WstoolCLI()
         self.assertEqual(0, cli.cmd_info(os.path.join(self.test_root_path, 'ws'), []))
 
+    def test_asyncio_backend(self):
+        """asyncio backend results must equal those of threads"""
+        if 'asyncio' not in wstool.common.WORKER_BACKENDS:
+            return
+        config = wstool.multiproject_cmd.get_config(basepath=self.local_path,
+                                                    config_filename='.rosinstall')
+        for untracked in [False, True]:
+            self.assertEqual(
+                wstool.multiproject_cmd.cmd_status(config, untracked=untracked),
+                wstool.multiproject_cmd.cmd_status(config, untracked=untracked,
+                                                   backend='asyncio'))
+        self.assertEqual(wstool.multiproject_cmd.cmd_diff(config),
+                         wstool.multiproject_cmd.cmd_diff(config, backend='asyncio'))
+        self.assertEqual(wstool.multiproject_cmd.cmd_info(config),
+                         wstool.multiproject_cmd.cmd_info(config, backend='asyncio'))
+
 
 class WstoolInfoGitTest(AbstractSCMTest):
 
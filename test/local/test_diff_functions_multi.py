@@ -111,7 +111,7 @@ class WstoolDiffMultiTest(AbstractSCMTest):
     def test_multi_diff_rosinstall_outside(self):
         '''Test wstool diff output from outside workspace.
         In particular asserts that there are newlines between diffs, and no overlaps'''
-        cmd = ["wstool", "diff", "-t", "ws"]
+        cmd = ["wstool", "diff", "--keep-order", "-t", "ws"]
         os.chdir(self.test_root_path)
         sys.stdout = output = StringIO()
         wstool_main(cmd)
@@ -122,7 +122,7 @@ class WstoolDiffMultiTest(AbstractSCMTest):
     def test_multi_diff_wstool_outside(self):
         '''Test wstool diff output from outside workspace.
         In particular asserts that there are newlines between diffs, and no overlaps'''
-        cmd = ["wstool", "diff", "-t", "ws"]
+        cmd = ["wstool", "diff", "--keep-order", "-t", "ws"]
         os.chdir(self.test_root_path)
         sys.stdout = output = StringIO()
         wstool_main(cmd)
@@ -137,7 +137,7 @@ class WstoolDiffMultiTest(AbstractSCMTest):
         '''Test wstool diff output from inside workspace.
         In particular asserts that there are newlines between diffs, and no overlaps'''
         directory = self.test_root_path + "/ws"
-        cmd = ["wstool", "diff"]
+        cmd = ["wstool", "diff", "--keep-order"]
         os.chdir(directory)
         sys.stdout = output = StringIO()
         wstool_main(cmd)
@@ -148,7 +148,7 @@ class WstoolDiffMultiTest(AbstractSCMTest):
         '''Test wstool diff output from inside workspace.
         In particular asserts that there are newlines between diffs, and no overlaps'''
         directory = self.test_root_path + "/ws"
-        cmd = ["wstool", "diff"]
+        cmd = ["wstool", "diff", "--keep-order"]
         os.chdir(directory)
         sys.stdout = output = StringIO()
         wstool_main(cmd)
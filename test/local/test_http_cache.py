@@ -0,0 +1,188 @@
+# Software License Agreement (BSD License)
+#
+# Copyright (c) 2009, Willow Garage, Inc.
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#  * Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+#  * Redistributions in binary form must reproduce the above
+#    copyright notice, this list of conditions and the following
+#    disclaimer in the documentation and/or other materials provided
+#    with the distribution.
+#  * Neither the name of Willow Garage, Inc. nor the names of its
+#    contributors may be used to endorse or promote products derived
+#    from this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES;
+# LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER
+# CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+from wstool.common import MultiProjectException
+from wstool.config_yaml import get_yaml_from_uri, aggregate_from_uris
+from wstool.http_cache import HttpCache
+
+ROSINSTALL = b"- git: {local-name: foo, uri: 'https://example.com/foo.git'}\n"
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    serves ROSINSTALL with an ETag, honoring If-None-Match, with
+    local-name foo for /distro.rosinstall, else the path
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.server.requests.append(dict(self.headers.items()))
+        if self.path == '/missing':
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        etag = '"v%s"' % self.server.version
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        name = 'foo'
+        if self.path != '/distro.rosinstall':
+            name = self.path.strip('/')
+        body = ROSINSTALL.replace(
+            b'foo', ('%s%d' % (name, self.server.version)).encode('utf-8'))
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', 'Sat, 17 Oct 2026 10:00:00 GMT')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class HttpCache_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.server = _Server(('127.0.0.1', 0), _Handler)
+        self.server.requests = []
+        self.server.connections = 0
+        self.server.version = 1
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+        self.thread.start()
+        self.root = 'http://127.0.0.1:%s/' % self.server.server_address[1]
+        self.uri = self.root + 'distro.rosinstall'
+        self.cache = HttpCache(os.path.join(self.directory, 'cache'))
+        HttpCache.set_cache(self.cache)
+
+    def tearDown(self):
+        HttpCache.set_cache(None)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.directory)
+
+    def test_revalidation(self):
+        self.assertEqual('foo1', get_yaml_from_uri(self.uri)[0]['git']['local-name'])
+        self.assertEqual(1, self.cache.downloads)
+        self.assertFalse('If-None-Match' in self.server.requests[0])
+        # unchanged, server answers 304
+        self.assertEqual('foo1', get_yaml_from_uri(self.uri)[0]['git']['local-name'])
+        self.assertEqual(1, self.cache.revalidations)
+        self.assertEqual('"v1"', self.server.requests[1]['If-None-Match'])
+        self.assertEqual('Sat, 17 Oct 2026 10:00:00 GMT',
+                         self.server.requests[1]['If-Modified-Since'])
+        # changed
+        self.server.version = 2
+        self.assertEqual('foo2', get_yaml_from_uri(self.uri)[0]['git']['local-name'])
+        self.assertEqual(2, self.cache.downloads)
+        self.assertEqual(3, len(self.server.requests))
+
+    def test_max_age_and_offline(self):
+        self.cache.max_age = 3600
+        get_yaml_from_uri(self.uri)
+        self.server.version = 2
+        # fresh, no request
+        self.assertEqual('foo1', get_yaml_from_uri(self.uri)[0]['git']['local-name'])
+        self.assertEqual(1, len(self.server.requests))
+        self.assertEqual(1, self.cache.hits)
+
+        self.cache.max_age = None
+        self.cache.offline = True
+        self.assertEqual('foo1', get_yaml_from_uri(self.uri)[0]['git']['local-name'])
+        self.assertEqual(1, len(self.server.requests))
+        self.assertRaises(IOError, self.cache.fetch, self.uri + '.missing')
+        self.assertEqual(1, len(self.server.requests))
+
+    def test_corrupt_entry(self):
+        self.cache.fetch(self.uri)
+        with open(self.cache._get_paths(self.uri)[1], 'wb') as fhand:
+            fhand.write(b'truncated')
+        self.assertEqual(None, self.cache.get_entry(self.uri))
+        self.assertTrue(b'foo1' in self.cache.fetch(self.uri))
+        self.assertEqual(2, self.cache.downloads)
+
+    def test_aggregate_remote_uris(self):
+        local_file = os.path.join(self.directory, 'local.rosinstall')
+        with open(local_file, 'wb') as fhand:
+            fhand.write(ROSINSTALL.replace(b'foo', b'local'))
+        uris = [self.root + 'a', local_file, self.root + 'b', self.root + 'a', self.uri]
+        specs = aggregate_from_uris(uris)
+        self.assertEqual(['a1', 'local', 'b1', 'a1', 'foo1'],
+                         [spec.get_local_name() for spec in specs])
+        self.assertFalse(specs[0] is specs[3])
+        # one keep-alive connection for all uris of the host
+        self.assertEqual(1, self.server.connections)
+
+        # without cache
+        HttpCache.set_cache(None)
+        saved = os.environ.get('WSTOOL_HTTP_CACHE')
+        os.environ['WSTOOL_HTTP_CACHE'] = ''
+        try:
+            specs = aggregate_from_uris([self.root + 'a', self.root + 'b'])
+        finally:
+            if saved is None:
+                del os.environ['WSTOOL_HTTP_CACHE']
+            else:
+                os.environ['WSTOOL_HTTP_CACHE'] = saved
+        self.assertEqual(['a1', 'b1'], [spec.get_local_name() for spec in specs])
+        self.assertEqual(2, self.server.connections)
+
+    def test_aggregate_remote_error(self):
+        self.assertRaises(MultiProjectException, aggregate_from_uris,
+                          [self.uri, self.root + 'missing', self.root + 'b'])
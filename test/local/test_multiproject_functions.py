@@ -31,11 +31,25 @@
 # POSSIBILITY OF SUCH DAMAGE.
 
 import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 import unittest
 
-from wstool.common import DistributedWork, WorkerThread, normabspath,\
+import vcstools.git
+
+from wstool.common import DistributedWork, WorkerThread, AutoTuner, normabspath, PathTrie,\
+    write_atomically, WORKER_BACKENDS, WORKERS_PHASE,\
+    DurationStore, DURATIONS_FILENAME, ResultRecord,\
     is_web_uri, select_elements, select_element, normalize_uri, realpath_relation,\
-    conditional_abspath, string_diff, MultiProjectException
+    conditional_abspath, string_diff, get_uri_host, get_retry_delay,\
+    MultiProjectException
+from wstool.tracing import CallLedger, PhaseTimers, PopenHooks, Tracer, get_command_name,\
+    timed, timed_iter
 
 
 class FooThing:
@@ -55,6 +69,101 @@ class FooThing:
         return 'bar'
 
 
+class SleepThing(FooThing):
+    def __init__(self, el, seconds):
+        FooThing.__init__(self, el, result={'seconds': seconds})
+        self.seconds = seconds
+
+    def do_work(self):
+        time.sleep(self.seconds)
+        return FooThing.do_work(self)
+
+
+class ScmElement:
+    def __init__(self, scmtype, uri=None):
+        self.scmtype = scmtype
+        self.uri = uri
+
+    def get_vcs_type_name(self):
+        return self.scmtype
+
+    def get_path_spec(self):
+        return self.scmtype
+
+
+class ConcurrencyThing(SleepThing):
+    """records the maximum number of concurrent workers per scmtype"""
+    lock = threading.Lock()
+    running = {}
+    maximum = {}
+
+    def do_work(self):
+        scmtype = self.element.get_vcs_type_name()
+        with ConcurrencyThing.lock:
+            count = ConcurrencyThing.running.get(scmtype, 0) + 1
+            ConcurrencyThing.running[scmtype] = count
+            ConcurrencyThing.maximum[scmtype] = max(
+                count, ConcurrencyThing.maximum.get(scmtype, 0))
+        try:
+            return SleepThing.do_work(self)
+        finally:
+            with ConcurrencyThing.lock:
+                ConcurrencyThing.running[scmtype] -= 1
+
+
+class CommandThing(FooThing):
+    """
+    runs python commands through vcstools, OUTPUT in each replaced by
+    the output of the previous one
+    """
+    replay_commands = True
+
+    def __init__(self, el, codes):
+        FooThing.__init__(self, el, result={'done': True})
+        self.codes = codes
+
+    def do_work(self):
+        outputs = []
+        output = ''
+        for code in self.codes:
+            returncode, output, _ = vcstools.git.run_shell_command(
+                [sys.executable, '-c', code.replace('OUTPUT', output)])
+            outputs.append((returncode, output))
+        return {'outputs': outputs}
+
+
+class CrashThing(FooThing):
+    """exits the process of the worker without a result"""
+    def do_work(self):
+        os._exit(1)
+
+
+class ChildThing(FooThing):
+    """runs a child process, which writes its pid to a file"""
+    def __init__(self, el, pidfile, seconds):
+        FooThing.__init__(self, el, result={'done': True})
+        self.pidfile = pidfile
+        self.seconds = seconds
+
+    def do_work(self):
+        subprocess.call(['sh', '-c', 'echo $$ > %s; exec sleep %s' %
+                         (self.pidfile, self.seconds)])
+        return FooThing.do_work(self)
+
+
+def _is_process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    # killed processes not reaped yet remain as zombies
+    try:
+        with open('/proc/%s/stat' % pid) as stat_file:
+            return stat_file.read().rsplit(')', 1)[1].split()[0] != 'Z'
+    except IOError:
+        return True
+
+
 class MockElement:
     def __init__(self, localname, path):
         self.localname = localname
@@ -66,6 +175,9 @@ class MockElement:
     def get_path(self):
         return self.path
 
+    def get_path_spec(self):
+        return self
+
 
 class FunctionsTest(unittest.TestCase):
 
@@ -197,6 +309,25 @@ class FunctionsTest(unittest.TestCase):
         work = DistributedWork(capacity=3, num_threads=-1)
         self.assertEqual(3, work.num_threads)
 
+    def test_auto_tuner(self):
+        tuner = AutoTuner(capacity=100, cpu_count=4, max_workers=20)
+        self.assertEqual(8, tuner.num_threads)
+        self.assertEqual(20, tuner.upper)
+        # cannot exceed capacity
+        tuner = AutoTuner(capacity=3, cpu_count=4, max_workers=20)
+        self.assertEqual(3, tuner.num_threads)
+        # nothing but waiting observed, go to the limit
+        tuner = AutoTuner(capacity=100, cpu_count=4, max_workers=20)
+        tuner._get_cpu_time = lambda: 0.0
+        tuner._cpu_start = 0.0
+        self.assertEqual(20, tuner.add_latency(10.0))
+        # CPU-bound workers, go down to CPU count
+        tuner.cpu_time = 100.0
+        self.assertEqual(4, tuner.add_latency(10.0))
+        work = DistributedWork(capacity=5, num_threads='auto')
+        self.assertTrue(work.num_threads <= 5)
+        self.assertTrue(work.num_threads >= 1)
+
     def test_distributed_work(self):
         work = DistributedWork(3)
 
@@ -218,6 +349,425 @@ class FunctionsTest(unittest.TestCase):
         self.assertEqual(False, 'error' in output[1], output)
         self.assertEqual(False, 'error' in output[2], output)
 
+    def test_distributed_work_backends(self):
+        self.assertRaises(MultiProjectException, DistributedWork, 3, backend='foo')
+        for backend in ['thread', 'process']:
+            work = DistributedWork(3, backend=backend)
+            for _ in range(3):
+                work.add_thread(FooThing(FooThing(FooThing(None)), result={'done': True}))
+            output = work.run()
+            self.assertEqual(3, len(output), backend)
+            for result in output:
+                self.assertEqual(True, result['done'], backend)
+
+    def test_distributed_work_run_iter(self):
+        work = DistributedWork(3)
+        for seconds in [0.2, 0.0, 0.1]:
+            work.add_thread(SleepThing(FooThing(FooThing(None)), seconds))
+        outputs = [output['seconds'] for output in work.run_iter(ordered=True)]
+        self.assertEqual([0.2, 0.0, 0.1], outputs)
+        work = DistributedWork(3)
+        for seconds in [0.2, 0.0, 0.1]:
+            work.add_thread(SleepThing(FooThing(FooThing(None)), seconds))
+        outputs = [output['seconds'] for output in work.run_iter(ordered=False)]
+        self.assertEqual([0.0, 0.1, 0.2], outputs)
+        work = DistributedWork(2)
+        work.add_thread(FooThing(FooThing(FooThing(None)), result={'done': True}))
+        work.add_thread(FooThing(FooThing(FooThing(None)), result=None))
+        outputs = []
+        try:
+            for output in work.run_iter():
+                outputs.append(output)
+            self.fail("expected Exception")
+        except MultiProjectException:
+            pass
+        # successful results are yielded before raising
+        self.assertEqual(1, len(outputs))
+
+    def test_distributed_work_asyncio(self):
+        if 'asyncio' not in WORKER_BACKENDS:
+            return
+        codes = ["print('foo')", "print('OUTPUT' + 'bar')", "import sys; sys.exit(3)"]
+        ledger = CallLedger()
+        ledger.install()
+        try:
+            results = {}
+            for backend in ['thread', 'asyncio']:
+                del ledger.calls[:]
+                work = DistributedWork(2, num_threads=2, backend=backend)
+                for _ in range(2):
+                    work.add_thread(CommandThing(MockElement('foo', '/tmp/foo'), codes))
+                results[backend] = [output['outputs'] for output in work.run()]
+                # each command runs once
+                self.assertEqual(6, len(ledger.calls), backend)
+        finally:
+            ledger.uninstall()
+        self.assertEqual([(0, 'foo'), (0, 'foobar'), (3, '')], results['thread'][0])
+        self.assertEqual(results['thread'], results['asyncio'])
+
+    def test_distributed_work_asyncio_errors(self):
+        if 'asyncio' not in WORKER_BACKENDS:
+            return
+        work = DistributedWork(2, num_threads=2, backend='asyncio')
+        work.add_thread(CommandThing(MockElement('good', '/tmp/good'), ["print('foo')"]))
+        # stdout cannot be decoded
+        work.add_thread(CommandThing(MockElement('bad', '/tmp/bad'),
+                                     ["import os; os.write(1, b'\\xff')"]))
+        outputs = []
+        try:
+            for output in work.run_iter():
+                outputs.append(output)
+            self.fail("expected Exception")
+        except MultiProjectException as mpe:
+            self.assertTrue('bad' in str(mpe), str(mpe))
+        self.assertEqual([[(0, 'foo')]], [output['outputs'] for output in outputs])
+        # a single worker is run without the scheduling loop
+        work = DistributedWork(1, backend='asyncio')
+        work.add_thread(CommandThing(MockElement('bad', '/tmp/bad'),
+                                     ["import os; os.write(1, b'\\xff')"]))
+        self.assertRaises(MultiProjectException, work.run)
+
+    def test_distributed_work_no_result(self):
+        # a worker process dying without result is reported as failed
+        work = DistributedWork(2, num_threads=2, backend='process')
+        work.add_thread(FooThing(MockElement('good', '/tmp/good'), {'done': True}))
+        work.add_thread(CrashThing(MockElement('crash', '/tmp/crash')))
+        outputs = []
+        try:
+            for output in work.run_iter():
+                outputs.append(output)
+            self.fail("expected Exception")
+        except MultiProjectException as mpe:
+            self.assertTrue('crash' in str(mpe), str(mpe))
+        self.assertEqual(1, len(outputs))
+
+    def test_distributed_work_refills_slots(self):
+        # a free slot must be refilled when a worker is done, not
+        # after polling intervals
+        for backend in ['thread', 'process']:
+            work = DistributedWork(20, num_threads=2, backend=backend)
+            for _ in range(20):
+                work.add_thread(SleepThing(FooThing(FooThing(None)), 0.01))
+            start = time.time()
+            self.assertEqual(20, len(work.run()))
+            self.assertTrue(time.time() - start < DistributedWork.POLL_INTERVAL, backend)
+
+    def test_distributed_work_scm_limits(self):
+        self.assertRaises(MultiProjectException, DistributedWork, 3,
+                          scm_limits={'svn': 0})
+        ConcurrencyThing.maximum.clear()
+        work = DistributedWork(12, num_threads=12,
+                               scm_limits={'svn': 2, 'bzr': 1})
+        for scmtype in ['git', 'svn', 'bzr'] * 4:
+            work.add_thread(ConcurrencyThing(ScmElement(scmtype), 0.05))
+        self.assertEqual(12, len(work.run()))
+        self.assertEqual({'git': 4, 'svn': 2, 'bzr': 1}, ConcurrencyThing.maximum)
+
+    def test_distributed_work_deadline(self):
+        self.assertRaises(MultiProjectException, DistributedWork, 3, deadline=0)
+        for backend in ['thread', 'process']:
+            for num_threads in [1, 2]:
+                work = DistributedWork(3, num_threads=num_threads, backend=backend,
+                                       deadline=0.5)
+                for seconds in [0.0, 5.0, 0.0]:
+                    work.add_thread(SleepThing(FooThing(FooThing(None)), seconds))
+                start = time.time()
+                outputs = work.run()
+                self.assertTrue(time.time() - start < 2, backend)
+                self.assertEqual(3, len(outputs))
+                self.assertEqual(0.0, outputs[0]['seconds'])
+                self.assertTrue(outputs[1]['timed_out'])
+                if num_threads == 1:
+                    # was never started
+                    self.assertTrue(outputs[2]['timed_out'])
+                else:
+                    self.assertEqual(0.0, outputs[2]['seconds'])
+
+    def test_distributed_work_deadline_kills_children(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for backend in sorted(WORKER_BACKENDS.keys()):
+                pidfiles = [os.path.join(directory, '%s%s' % (backend, index))
+                            for index in range(2)]
+                work = DistributedWork(2, num_threads=2, backend=backend, deadline=1)
+                for pidfile in pidfiles:
+                    work.add_thread(ChildThing(MockElement('foo', '/tmp/foo'), pidfile, 7))
+                outputs = work.run()
+                self.assertEqual([True, True],
+                                 [output.get('timed_out') for output in outputs], backend)
+                pids = []
+                for pidfile in pidfiles:
+                    with open(pidfile) as pid_file:
+                        pids.append(int(pid_file.read()))
+                end_time = time.time() + 2
+                while (time.time() < end_time and
+                       [pid for pid in pids if _is_process_running(pid)]):
+                    time.sleep(0.05)
+                self.assertEqual([], [pid for pid in pids if _is_process_running(pid)],
+                                 backend)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_distributed_work_interrupt_kills_children(self):
+        # SIGINT sent to this process only, not to its process group
+        directory = tempfile.mkdtemp()
+        try:
+            for backend in sorted(WORKER_BACKENDS.keys()):
+                pidfiles = [os.path.join(directory, '%s%s' % (backend, index))
+                            for index in range(2)]
+                work = DistributedWork(2, num_threads=2, backend=backend)
+                for pidfile in pidfiles:
+                    work.add_thread(ChildThing(MockElement('foo', '/tmp/foo'), pidfile, 7))
+                timer = threading.Timer(1, os.kill, [os.getpid(), signal.SIGINT])
+                timer.start()
+                try:
+                    self.assertRaises(KeyboardInterrupt, work.run)
+                finally:
+                    timer.cancel()
+                pids = []
+                for pidfile in pidfiles:
+                    with open(pidfile) as pid_file:
+                        pids.append(int(pid_file.read()))
+                end_time = time.time() + 2
+                while (time.time() < end_time and
+                       [pid for pid in pids if _is_process_running(pid)]):
+                    time.sleep(0.05)
+                self.assertEqual([], [pid for pid in pids if _is_process_running(pid)],
+                                 backend)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_distributed_work_durations(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, DURATIONS_FILENAME)
+            store = DurationStore(filename, 'install')
+            self.assertEqual(None, store.get('a'))
+            for localname, seconds in [('a', 0.1), ('b', 5), ('c', 1)]:
+                store.set(localname, seconds)
+            store.save()
+            store = DurationStore(filename, 'install')
+            self.assertEqual(5, store.get('b'))
+            self.assertEqual(None, DurationStore(filename, 'foreach').get('b'))
+
+            work = DistributedWork(4, num_threads=2, duration_store=store)
+            for localname in ['a', 'b', 'c', 'd']:
+                work.add_thread(FooThing(MockElement(localname, '/tmp/' + localname), {}))
+            # unknown first, then longest first
+            self.assertEqual([3, 1, 2, 0],
+                             sorted(range(4), key=work._get_start_priority))
+            self.assertEqual(4, len(work.run()))
+            store = DurationStore(filename, 'install')
+            self.assertTrue(store.get('d') is not None)
+            self.assertTrue(store.get('b') < 5)
+
+            # the order does not matter with one thread, nothing is saved
+            os.remove(filename)
+            work = DistributedWork(1, num_threads=1, duration_store=store)
+            work.add_thread(FooThing(MockElement('a', '/tmp/a'), {}))
+            self.assertEqual(1, len(work.run()))
+            self.assertFalse(os.path.exists(filename))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_distributed_work_trace(self):
+        tracer = Tracer()
+        Tracer.set_tracer(tracer)
+        try:
+            for backend in ['thread', 'process']:
+                del tracer.events[:]
+                work = DistributedWork(3, num_threads=2, backend=backend)
+                for seconds in [0.1, 0.1, 0.0]:
+                    work.add_thread(SleepThing(MockElement('foo', '/tmp/foo'), seconds))
+                work.run()
+                self.assertEqual(3, len(tracer.events), backend)
+                for event in tracer.events:
+                    self.assertEqual('foo', event['name'])
+                    self.assertEqual('work', event['cat'])
+                    self.assertEqual('ok', event['args']['status'])
+                # third worker waited for a free slot
+                self.assertTrue(max([event['args']['queue_wait_ms']
+                                     for event in tracer.events]) >= 50)
+        finally:
+            Tracer.set_tracer(None)
+
+    def test_call_ledger(self):
+        self.assertEqual('git status', get_command_name(['/usr/bin/git', '--no-pager', 'status', '-s']))
+        self.assertEqual('git submodule', get_command_name("git submodule foreach 'git status'"))
+        self.assertEqual('git --version', get_command_name('git --version'))
+        ledger = CallLedger()
+        ledger.install()
+        try:
+            proc = subprocess.Popen(['python', '-c', 'print(42)'],
+                                    stdout=subprocess.PIPE, cwd='/')
+            proc.communicate()
+            self.assertTrue(isinstance(proc, subprocess.Popen))
+            subprocess.Popen(['python', '-c', 'pass']).wait()
+        finally:
+            ledger.uninstall()
+        self.assertEqual('Popen', subprocess.Popen.__name__)
+
+        # hooks are independent of each other
+        class StartHook:
+            started = 0
+
+            def popen_started(self, proc):
+                StartHook.started += 1
+
+            def popen_done(self, proc, output_bytes):
+                pass
+        hook = StartHook()
+        PopenHooks.add_hook(hook)
+        other_ledger = CallLedger()
+        other_ledger.install()
+        other_ledger.uninstall()
+        try:
+            subprocess.Popen(['python', '-c', 'pass']).wait()
+        finally:
+            PopenHooks.remove_hook(hook)
+        self.assertEqual(1, StartHook.started)
+        self.assertEqual(0, len(other_ledger.calls))
+        self.assertEqual(2, len(ledger.calls))
+        self.assertEqual('/', ledger.calls[0]['cwd'])
+        self.assertEqual(0, ledger.calls[0]['returncode'])
+        self.assertEqual(len('42' + os.linesep), ledger.calls[0]['output_bytes'])
+        self.assertEqual(None, ledger.calls[1]['output_bytes'])
+        summary = ledger.get_summary()
+        self.assertEqual(['python print(42)', 'python pass'],
+                         sorted([entry[0] for entry in summary], reverse=True))
+        self.assertTrue('subprocess calls: 2' in ledger.format_summary())
+
+    def test_phase_timers(self):
+        @timed('decorated')
+        def sleep():
+            time.sleep(0.05)
+            return 42
+
+        def generate():
+            time.sleep(0.05)
+            yield 1
+            time.sleep(0.05)
+            yield 2
+        # no global timers, no effect
+        self.assertEqual(42, sleep())
+        timers = PhaseTimers()
+        PhaseTimers.set_timers(timers)
+        try:
+            self.assertEqual(42, sleep())
+            with timed('context'):
+                time.sleep(0.05)
+            self.assertEqual([1, 2], list(timed_iter(generate(), 'iterated')))
+            with timed('outer'):
+                time.sleep(0.05)
+                self.assertEqual(42, sleep())
+        finally:
+            PhaseTimers.set_timers(None)
+        self.assertEqual(['decorated', 'context', 'iterated', 'outer'], timers.phases)
+        self.assertTrue(timers.durations['decorated'] >= 0.1)
+        self.assertTrue(timers.durations['iterated'] >= 0.1)
+        # nested time only counts for the nested phase
+        self.assertTrue(timers.durations['outer'] < 0.1)
+        self.assertTrue('context' in timers.format_summary())
+
+        for num_threads in [1, 2]:
+            timers = PhaseTimers()
+            PhaseTimers.set_timers(timers)
+            try:
+                work = DistributedWork(2, num_threads=num_threads)
+                for _ in range(2):
+                    work.add_thread(SleepThing(FooThing(FooThing(None)), 0.2))
+                work.run()
+            finally:
+                PhaseTimers.set_timers(None)
+            self.assertTrue(timers.durations[WORKERS_PHASE] >= 0.2, timers.durations)
+            self.assertTrue(timers.durations['scheduling'] < 0.1, timers.durations)
+
+    def test_write_atomically(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory, 'file')
+            write_atomically(filename, b'first')
+            os.chmod(filename, 0o640)
+            write_atomically(filename, b'second')
+            with open(filename, 'rb') as fhand:
+                self.assertEqual(b'second', fhand.read())
+            self.assertEqual(0o640, os.stat(filename).st_mode & 0o777)
+            self.assertEqual(['file'], os.listdir(directory))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_path_trie(self):
+        trie = PathTrie()
+        for path in ['/foo', '/foo/bar/baz', '/foo/bim', '/foobar']:
+            trie.add(path, path)
+        self.assertEqual(4, len(trie))
+        self.assertEqual('/foo/bim', trie.get('/foo/bim'))
+        self.assertEqual(None, trie.get('/foo/bar'))
+        self.assertEqual(None, trie.get('/fo'))
+        self.assertEqual(['/foo'], trie.get_ancestors('/foo/bar/baz'))
+        self.assertEqual([], trie.get_ancestors('/foo'))
+        self.assertEqual(['/foo/bar/baz', '/foo/bim'],
+                         sorted(trie.get_descendants('/foo')))
+        self.assertEqual(['/foo/bar/baz'], trie.get_descendants('/foo/bar'))
+        self.assertEqual([], trie.get_descendants('/foobar'))
+        self.assertFalse(trie.remove('/foo/bar'))
+        self.assertTrue(trie.remove('/foo/bar/baz'))
+        self.assertEqual(['/foo/bim'], trie.get_descendants('/foo'))
+        trie.add('/foo', 'replaced')
+        self.assertEqual(3, len(trie))
+        self.assertEqual(['replaced'], trie.get_ancestors('/foo/bar'))
+        copied = trie.copy()
+        copied.remove('/foo/bim')
+        self.assertEqual(2, len(copied))
+        self.assertEqual(['/foo/bim'], trie.get_descendants('/foo'))
+        self.assertEqual([], copied.get_descendants('/foo'))
+
+    def test_result_record(self):
+        class Record(ResultRecord):
+            __slots__ = ('status',)
+        record = Record({'status': 'M foo'}, entry='foo')
+        self.assertEqual('M foo', record['status'])
+        self.assertEqual(['entry', 'status'], record.keys())
+        self.assertFalse('error' in record)
+        self.assertEqual(None, record.get('error'))
+        self.assertRaises(KeyError, record.__getitem__, 'error')
+        record.update({'error': 'failed', 'other': 42})
+        self.assertTrue('error' in record)
+        self.assertEqual(42, record['other'])
+        self.assertEqual({'entry': 'foo', 'status': 'M foo', 'error': 'failed', 'other': 42},
+                         dict(record.items()))
+        self.assertEqual(record, dict(record.items()))
+        del record['error']
+        del record['other']
+        self.assertEqual(2, len(record))
+        self.assertRaises(KeyError, record.__delitem__, 'error')
+        self.assertFalse(hasattr(record, '__dict__'))
+
+    def test_get_retry_delay(self):
+        for attempt in range(1, 10):
+            delay = get_retry_delay(attempt, base_delay=2, max_delay=60)
+            self.assertTrue(0 <= delay <= min(60, 2 ** attempt), delay)
+
+    def test_get_uri_host(self):
+        self.assertEqual('github.com', get_uri_host('https://GitHub.com/foo/bar.git'))
+        self.assertEqual('github.com', get_uri_host('git@github.com:foo/bar.git'))
+        self.assertEqual('svn.org', get_uri_host('svn+ssh://user@svn.org/repo'))
+        self.assertEqual(None, get_uri_host('/tmp/foo'))
+        self.assertEqual(None, get_uri_host('foo/bar'))
+        self.assertEqual(None, get_uri_host(None))
+
+    def test_distributed_work_host_limit(self):
+        self.assertRaises(MultiProjectException, DistributedWork, 3,
+                          host_limit=0)
+        ConcurrencyThing.maximum.clear()
+        work = DistributedWork(12, num_threads=12, host_limit=2)
+        for uri in ['https://a.org/x', 'git@b.org:x', '/tmp/x'] * 4:
+            # group counts by uri instead of scmtype
+            work.add_thread(ConcurrencyThing(ScmElement(uri, uri), 0.3))
+        self.assertEqual(12, len(work.run()))
+        self.assertEqual({'https://a.org/x': 2, 'git@b.org:x': 2, '/tmp/x': 4},
+                         ConcurrencyThing.maximum)
+
     def test_select_elements(self):
         self.assertEqual([], select_elements(None, None))
         mock1 = MockElement('foo', '/test/path1')